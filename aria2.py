@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+aria2 downloader backend
+Sends plain HTTP(S) file links to a managed aria2c daemon over JSON-RPC
+for segmented, multi-connection transfers
+"""
+
+import os
+import time
+import atexit
+import shutil
+import secrets
+import logging
+import threading
+import subprocess
+from typing import Callable, Dict, Optional
+from urllib.parse import urlsplit
+from config import Config
+from preflight import FileTooLarge, disk_reservations, format_size
+
+logger = logging.getLogger(__name__)
+
+# Links that point straight at a media file (no extractor, no playlist)
+DIRECT_FILE_EXTENSIONS = ('.mp4', '.mkv', '.webm', '.mov', '.m4v', '.avi', '.flv', '.ts')
+
+# How often the download status is polled over RPC
+POLL_INTERVAL = 0.5
+
+# How long to wait for a freshly started daemon to answer
+STARTUP_TIMEOUT = 10
+
+
+def is_direct_file_url(url: str) -> bool:
+    """Whether a URL is a plain HTTP(S) file aria2 can fetch on its own"""
+    parts = urlsplit(url.strip())
+    
+    if parts.scheme not in ('http', 'https'):
+        return False
+    
+    return parts.path.lower().endswith(DIRECT_FILE_EXTENSIONS)
+
+
+def _format_eta(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+
+def _format_speed(speed: int) -> str:
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if speed < 1024:
+            return f"{speed:.2f}{unit}/s"
+        speed /= 1024
+    return f"{speed:.2f}TiB/s"
+
+
+class Aria2Daemon:
+    """
+    Lazily started aria2c process with an RPC client
+    
+    The daemon is started on first use, listens on localhost only and
+    exits together with the bot (--stop-with-process plus atexit).
+    """
+    
+    def __init__(self):
+        self.port = Config.ARIA2_RPC_PORT
+        self.secret = Config.ARIA2_RPC_SECRET or secrets.token_hex(16)
+        self.process: Optional[subprocess.Popen] = None
+        self.api = None
+        self.unavailable = False
+        self._lock = threading.Lock()
+    
+    def _connect(self):
+        import aria2p
+        
+        api = aria2p.API(aria2p.Client(host="http://127.0.0.1", port=self.port, secret=self.secret))
+        api.client.get_version()
+        return api
+    
+    def _spawn(self):
+        os.makedirs(Config.DOWNLOAD_PATH, exist_ok=True)
+        
+        self.process = subprocess.Popen(
+            [
+                'aria2c',
+                '--enable-rpc',
+                '--rpc-listen-all=false',
+                f'--rpc-listen-port={self.port}',
+                f'--rpc-secret={self.secret}',
+                f'--stop-with-process={os.getpid()}',
+                f'--max-concurrent-downloads={max(1, Config.MAX_CONCURRENT_DOWNLOADS)}',
+                f'--split={Config.ARIA2_CONNECTIONS}',
+                f'--max-connection-per-server={min(16, Config.ARIA2_CONNECTIONS)}',
+                f'--min-split-size={Config.ARIA2_MIN_SPLIT_SIZE}',
+                '--file-allocation=none',
+                '--continue=true',
+                '--auto-file-renaming=false',
+                '--allow-overwrite=true',
+                '--check-certificate=false',
+                '--max-tries=10',
+                '--retry-wait=3',
+                '--summary-interval=0',
+                '--quiet=true',
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        atexit.register(self.stop)
+    
+    def ensure_started(self):
+        """
+        Get the RPC API, starting aria2c if needed
+        
+        Returns:
+            aria2p.API instance, or None if aria2 can't be used
+        """
+        with self._lock:
+            if self.api is not None or self.unavailable:
+                return self.api
+            
+            try:
+                import aria2p  # noqa: F401
+            except ImportError:
+                logger.warning("aria2p not installed, direct links will use yt-dlp")
+                self.unavailable = True
+                return None
+            
+            if not shutil.which('aria2c'):
+                logger.warning("aria2c not found, direct links will use yt-dlp")
+                self.unavailable = True
+                return None
+            
+            try:
+                self._spawn()
+                deadline = time.monotonic() + STARTUP_TIMEOUT
+                
+                while True:
+                    try:
+                        self.api = self._connect()
+                        break
+                    except Exception:
+                        if self.process.poll() is not None or time.monotonic() > deadline:
+                            raise
+                        time.sleep(0.2)
+                
+                logger.info(f"aria2 RPC daemon started on port {self.port}")
+            except Exception as e:
+                logger.error(f"Error starting aria2: {str(e)}")
+                self.stop()
+                self.unavailable = True
+            
+            return self.api
+    
+    def stop(self):
+        """Terminate the managed aria2c process"""
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+        self.api = None
+
+
+_daemon: Optional[Aria2Daemon] = None
+
+
+def get_daemon() -> Optional[Aria2Daemon]:
+    """Get the shared aria2 daemon (None when disabled in the config)"""
+    global _daemon
+    
+    if not Config.ARIA2_ENABLED:
+        return None
+    
+    if _daemon is None:
+        _daemon = Aria2Daemon()
+    
+    return _daemon
+
+
+def accepts(url: str) -> bool:
+    """Backend selector: direct file links while aria2 is usable"""
+    daemon = get_daemon()
+    return daemon is not None and not daemon.unavailable and is_direct_file_url(url)
+
+
+def download(url: str, workspace: str, headers: Dict[str, str] = None,
+             progress_hook: Callable[[dict], None] = None) -> Optional[str]:
+    """
+    Download one file through aria2 (blocking, run it in the download pool)
+    
+    Args:
+        url: Direct HTTP(S) file URL
+        workspace: Directory the file is written to
+        headers: Extra HTTP request headers
+        progress_hook: Called with yt-dlp style progress dicts
+    
+    Returns:
+        Path of the downloaded file, or None if aria2 is unavailable
+    
+    Raises:
+        FileTooLarge: The file is over Config.MAX_FILE_SIZE
+        NotEnoughDiskSpace: The file's size can't be reserved on disk
+    """
+    daemon = get_daemon()
+    api = daemon.ensure_started() if daemon else None
+    if api is None:
+        return None
+    
+    options = {'dir': os.path.abspath(workspace)}
+    if headers:
+        options['header'] = [f"{key}: {value}" for key, value in headers.items()]
+    
+    task = api.add_uris([url], options=options)
+    reserved = False
+    
+    try:
+        while True:
+            time.sleep(POLL_INTERVAL)
+            task.update()
+            
+            if task.status == 'complete':
+                break
+            
+            if task.status in ('error', 'removed'):
+                raise Exception(f"aria2: {task.error_message or task.status}")
+            
+            # The size is known after the first response, stop before wasting bandwidth
+            if task.total_length > Config.MAX_FILE_SIZE and not Config.AUTO_SPLIT:
+                raise FileTooLarge(
+                    f"File is too large: {format_size(task.total_length)} "
+                    f"(limit {format_size(Config.MAX_FILE_SIZE)})"
+                )
+            
+            # The job reserved a flat guess, now the real size is known
+            if not reserved and task.total_length:
+                disk_reservations.reserve_blocking(workspace, task.total_length)
+                reserved = True
+            
+            if progress_hook and task.total_length:
+                speed = task.download_speed
+                remaining = task.total_length - task.completed_length
+                progress_hook({
+                    'status': 'downloading',
+                    'downloaded_bytes': task.completed_length,
+                    'total_bytes': task.total_length,
+                    '_percent_str': f"{task.completed_length * 100 / task.total_length:.1f}%",
+                    '_speed_str': _format_speed(speed),
+                    '_eta_str': _format_eta(remaining / speed) if speed else 'N/A',
+                })
+        
+        return str(task.files[0].path)
+    finally:
+        try:
+            api.remove([task], force=True, files=False, clean=True)
+        except Exception:
+            # Finished downloads only need their result purged
+            try:
+                api.client.remove_download_result(task.gid)
+            except Exception:
+                pass
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark: streaming link parser vs. the old extract_links_from_txt
+
+Usage:
+    python benchmarks/bench_extract_links.py [lines]
+"""
+
+import os
+import re
+import sys
+import time
+import logging
+import tempfile
+import tracemalloc
+from typing import List, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helpers import extract_links_from_txt, iter_links_from_txt
+
+logger = logging.getLogger(__name__)
+
+
+def legacy_extract_links(file_path: str) -> List[Dict[str, str]]:
+    """
+    Pre-streaming extract_links_from_txt (whole file in memory, up to 3 passes)
+    
+    Supported formats:
+    1. Title:URL (Classplus format)
+    2. Title: URL
+    3. https://youtube.com/watch?v=xxxxx
+       Title: My Video Title
+    4. Just URLs
+    """
+    links = []
+    
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        
+        # Split by lines
+        lines = content.strip().split('\n')
+        
+        for line in lines:
+            line = line.strip()
+            
+            if not line or line.startswith('#'):
+                continue
+            
+            # Format 1: Title:URL (Classplus style)
+            if ':https://' in line or ':http://' in line:
+                parts = line.split(':', 1)
+                if len(parts) == 2 and parts[1].startswith('http'):
+                    # Find the actual URL part
+                    url_start = line.find('http')
+                    title = line[:url_start-1].strip()
+                    url = line[url_start:].strip()
+                    
+                    links.append({
+                        'url': url,
+                        'title': title or f'Video_{len(links) + 1}'
+                    })
+                    continue
+            
+            # Format 2: Just URL
+            if line.startswith('http://') or line.startswith('https://'):
+                links.append({
+                    'url': line,
+                    'title': f'Video_{len(links) + 1}'
+                })
+        
+        # Fallback: Extract all URLs if no links found
+        if not links:
+            current_url = None
+            current_title = None
+            
+            for line in lines:
+                line = line.strip()
+                
+                # Check if line is a URL
+                if re.match(r'https?://', line):
+                    # Save previous entry if exists
+                    if current_url:
+                        links.append({
+                            'url': current_url,
+                            'title': current_title or f'Video_{len(links) + 1}'
+                        })
+                    
+                    current_url = line
+                    current_title = None
+                
+                # Check if line is a title
+                elif line.lower().startswith('title:'):
+                    current_title = line.split(':', 1)[1].strip()
+                
+                # If line contains both URL and might be title on same line
+                elif current_url and line and not line.startswith('#'):
+                    if not current_title:
+                        current_title = line
+            
+            # Add last entry
+            if current_url:
+                links.append({
+                    'url': current_url,
+                    'title': current_title or f'Video_{len(links) + 1}'
+                })
+        
+        # Final fallback: regex extraction
+        if not links:
+            urls = re.findall(r'https?://[^\s]+', content)
+            links = [{'url': url, 'title': f'Video_{i+1}'} for i, url in enumerate(urls)]
+        
+        logger.info(f"Extracted {len(links)} links from {file_path}")
+        return links
+    
+    except Exception as e:
+        logger.error(f"Error extracting links: {str(e)}")
+        return []
+
+
+def make_batch_file(path: str, lines: int, style: str = "classplus"):
+    """Write a synthetic .txt batch with roughly `lines` lines"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(lines):
+            if style == "classplus":
+                f.write(f"Lecture {i} - Chapter {i % 40}:https://media-cdn.classplusapp.com/{i}/master.m3u8\n")
+            elif style == "block":
+                if i % 3 == 0:
+                    f.write(f"https://www.youtube.com/watch?v={i:011d}\n")
+                elif i % 3 == 1:
+                    f.write(f"Title: Video number {i}\n")
+                else:
+                    f.write("\n")
+            else:
+                f.write(f"Some notes for part {i} see https://example.com/v/{i} for details\n")
+
+
+def measure(func, path: str, repeat: int = 3) -> Dict[str, float]:
+    """Best wall time and peak traced memory of func(path)"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(path)
+        best = min(best, time.perf_counter() - start)
+    
+    tracemalloc.start()
+    func(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    return {'seconds': best, 'peak_mb': peak / (1024 * 1024), 'links': len(result)}
+
+
+def count_streamed(path: str) -> list:
+    """Consume the generator without keeping the links (pipeline-style)"""
+    count = 0
+    for _ in iter_links_from_txt(path):
+        count += 1
+    return range(count)
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    logging.disable(logging.CRITICAL)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        for style in ("classplus", "block", "freetext"):
+            path = os.path.join(tmp, f"{style}.txt")
+            make_batch_file(path, lines, style)
+            
+            old = measure(legacy_extract_links, path)
+            new = measure(extract_links_from_txt, path)
+            streamed = measure(count_streamed, path)
+            
+            print(f"\n{style} ({lines} lines)")
+            for name, stats in (("legacy", old), ("list", new), ("streamed", streamed)):
+                print(
+                    f"  {name:<9} {stats['seconds'] * 1000:8.1f} ms  "
+                    f"peak {stats['peak_mb']:6.2f} MB  links {stats['links']}"
+                )
+
+
+if __name__ == "__main__":
+    main()
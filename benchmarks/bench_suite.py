@@ -0,0 +1,531 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Offline benchmark suite
+
+Serves synthetic MP4 files and HLS playlists (ffmpeg test patterns) from a
+local HTTP server and measures:
+    - download_video throughput per backend (yt-dlp, aria2, native HLS)
+    - extract_links_from_txt / iter_links_from_txt parse speed on large batches
+    - Database operation latency for the JSON and MongoDB backends
+
+Results are written as JSON; pass --compare to diff against an older report.
+
+Usage:
+    python benchmarks/bench_suite.py [--duration 60] [--runs 3] [--lines 100000]
+                                     [--mongodb-uri URI] [--output report.json]
+                                     [--compare old_report.json] [--only download,parse,db]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import platform
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+from datetime import datetime, timezone
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from helpers import download_video, cleanup_download, extract_links_from_txt, iter_links_from_txt
+from database import Database
+from bench_extract_links import make_batch_file
+import aria2
+import hls
+
+logger = logging.getLogger(__name__)
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# Relative change that counts as a regression in --compare
+REGRESSION_THRESHOLD = 0.10
+
+_RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+# -- Local media server --------------------------------------------------------
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Static file handler with single-range support (needed for aria2 splits)"""
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def end_headers(self):
+        self.send_header('Accept-Ranges', 'bytes')
+        super().end_headers()
+    
+    def send_head(self):
+        match = _RANGE_RE.match(self.headers.get('Range', '').strip())
+        path = self.translate_path(self.path)
+        
+        if not match or not os.path.isfile(path):
+            return super().send_head()
+        
+        size = os.path.getsize(path)
+        start, end = match.groups()
+        if start:
+            start, end = int(start), min(int(end) if end else size - 1, size - 1)
+        else:
+            start, end = max(0, size - int(end or 0)), size - 1
+        
+        if start > end:
+            self.send_error(416, "Requested Range Not Satisfiable")
+            return None
+        
+        f = open(path, 'rb')
+        f.seek(start)
+        self._range_remaining = end - start + 1
+        
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Length', str(self._range_remaining))
+        self.end_headers()
+        return f
+    
+    def copyfile(self, source, outputfile):
+        remaining = getattr(self, '_range_remaining', None)
+        if remaining is None:
+            return super().copyfile(source, outputfile)
+        
+        while remaining > 0:
+            chunk = source.read(min(64 * 1024, remaining))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            remaining -= len(chunk)
+        self._range_remaining = None
+
+
+class MediaServer:
+    """ThreadingHTTPServer on 127.0.0.1 serving a directory"""
+    
+    def __init__(self, directory: str):
+        handler = partial(RangeRequestHandler, directory=directory)
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="bench-media-server", daemon=True)
+    
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+    
+    def __enter__(self):
+        self.thread.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        return False
+
+
+def _ffmpeg(*args: str):
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', *args], check=True)
+
+
+def generate_media(directory: str, duration: int) -> Dict[str, str]:
+    """
+    Write the test pattern media (reused if already generated)
+    
+    Returns:
+        Dict of name -> path relative to the served directory
+    """
+    mp4_path = os.path.join(directory, f"pattern_{duration}s.mp4")
+    hls_dir = os.path.join(directory, f"hls_{duration}s")
+    master_path = os.path.join(hls_dir, "master.m3u8")
+    
+    if not os.path.exists(mp4_path):
+        logger.info(f"Generating {duration}s test pattern MP4...")
+        _ffmpeg(
+            '-f', 'lavfi', '-i', 'testsrc2=size=1280x720:rate=30',
+            '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=44100',
+            '-t', str(duration),
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', '-b:v', '4M',
+            '-c:a', 'aac', '-b:a', '128k',
+            '-movflags', '+faststart',
+            mp4_path
+        )
+    
+    if not os.path.exists(master_path):
+        logger.info("Segmenting HLS playlist...")
+        os.makedirs(hls_dir, exist_ok=True)
+        _ffmpeg(
+            '-i', mp4_path, '-c', 'copy',
+            '-f', 'hls', '-hls_time', '4', '-hls_playlist_type', 'vod',
+            '-hls_segment_filename', os.path.join(hls_dir, 'seg_%04d.ts'),
+            os.path.join(hls_dir, 'index.m3u8')
+        )
+        # Master playlist so variant selection is part of the measurement
+        with open(master_path, 'w') as f:
+            f.write(
+                "#EXTM3U\n"
+                '#EXT-X-STREAM-INF:BANDWIDTH=4200000,RESOLUTION=1280x720,CODECS="avc1.64001f,mp4a.40.2"\n'
+                "index.m3u8\n"
+            )
+    
+    return {
+        'mp4': os.path.relpath(mp4_path, directory),
+        'hls': os.path.relpath(master_path, directory),
+    }
+
+
+# -- Measurements --------------------------------------------------------------
+
+def _latency_stats(samples: List[float]) -> Dict[str, float]:
+    """Milliseconds: mean and percentiles of a list of seconds"""
+    values = sorted(samples)
+    
+    def percentile(fraction):
+        return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))] * 1000
+    
+    return {
+        'count': len(values),
+        'mean_ms': statistics.fmean(values) * 1000,
+        'p50_ms': percentile(0.5),
+        'p90_ms': percentile(0.9),
+        'p99_ms': percentile(0.99),
+    }
+
+
+def _download_cases(media: Dict[str, str], base_url: str) -> List[Dict]:
+    """(media, backend) combinations with the Config switches that select them"""
+    return [
+        {'media': 'mp4', 'backend': 'ytdlp', 'url': f"{base_url}/{media['mp4']}",
+         'config': {'ARIA2_ENABLED': False, 'HLS_NATIVE': False}},
+        {'media': 'mp4', 'backend': 'aria2', 'url': f"{base_url}/{media['mp4']}",
+         'config': {'ARIA2_ENABLED': True, 'HLS_NATIVE': False}},
+        {'media': 'hls', 'backend': 'ytdlp', 'url': f"{base_url}/{media['hls']}",
+         'config': {'ARIA2_ENABLED': False, 'HLS_NATIVE': False}},
+        {'media': 'hls', 'backend': 'native', 'url': f"{base_url}/{media['hls']}",
+         'config': {'ARIA2_ENABLED': False, 'HLS_NATIVE': True}},
+    ]
+
+
+async def bench_downloads(media: Dict[str, str], base_url: str, runs: int) -> List[Dict]:
+    """End-to-end download_video (download + remux) throughput"""
+    results = []
+    
+    for case in _download_cases(media, base_url):
+        for name, value in case['config'].items():
+            setattr(Config, name, value)
+        
+        name = f"{case['media']}/{case['backend']}"
+        if case['backend'] == 'aria2' and not (aria2.get_daemon() and aria2.get_daemon().ensure_started()):
+            logger.warning(f"{name}: aria2 unavailable, skipped")
+            results.append({'case': name, 'skipped': 'aria2 unavailable'})
+            continue
+        
+        timings = []
+        size = 0
+        for _ in range(runs):
+            started = time.perf_counter()
+            path = await download_video(case['url'], "720")
+            elapsed = time.perf_counter() - started
+            
+            if not path:
+                break
+            size = os.path.getsize(path)
+            cleanup_download(path)
+            timings.append(elapsed)
+        
+        if len(timings) < runs:
+            logger.warning(f"{name}: download failed")
+            results.append({'case': name, 'failed': True})
+            continue
+        
+        best = min(timings)
+        results.append({
+            'case': name,
+            'bytes': size,
+            'runs': runs,
+            'best_s': best,
+            'median_s': statistics.median(timings),
+            'best_mbps': size / best / (1024 * 1024),
+        })
+        logger.info(f"{name:<12} best {best:6.2f}s  {size / best / (1024 * 1024):7.1f} MB/s")
+    
+    return results
+
+
+def _best_time(function, *args, repeat: int = 3):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def bench_parse(lines: int) -> List[Dict]:
+    """Link parser speed on synthetic batch files of each supported layout"""
+    results = []
+    
+    def stream(path):
+        return sum(1 for _ in iter_links_from_txt(path))
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        for style in ("classplus", "block", "freetext"):
+            path = os.path.join(tmp, f"{style}.txt")
+            make_batch_file(path, lines, style)
+            
+            for name, function in (("list", extract_links_from_txt), ("stream", stream)):
+                best, result = _best_time(function, path)
+                links = result if isinstance(result, int) else len(result)
+                results.append({
+                    'case': f"{style}/{name}",
+                    'lines': lines,
+                    'links': links,
+                    'best_s': best,
+                    'lines_per_sec': lines / best,
+                })
+                logger.info(f"{style + '/' + name:<16} {best * 1000:8.1f} ms  {lines / best:12,.0f} lines/s")
+    
+    return results
+
+
+async def _bench_database(db: Database, users: int) -> Dict[str, Dict]:
+    """Latency of each Database call over `users` synthetic users"""
+    label = 'mongodb' if db.use_mongodb else 'json'
+    ops = {}
+    base = 10 ** 9
+    
+    async def measure(op, calls):
+        samples = []
+        for call in calls:
+            started = time.perf_counter()
+            await call()
+            samples.append(time.perf_counter() - started)
+        ops[op] = stats = _latency_stats(samples)
+        logger.info(f"{label + '/' + op:<28} p50 {stats['p50_ms']:8.3f} ms  p99 {stats['p99_ms']:8.3f} ms")
+    
+    ids = range(base, base + users)
+    await measure('add_user', [partial(db.add_user, user_id, f"bench{user_id}") for user_id in ids])
+    await measure('get_user', [partial(db.get_user, user_id) for user_id in ids])
+    await measure('increment_downloads', [partial(db.increment_downloads, user_id) for user_id in ids])
+    await measure('get_user_stats', [partial(db.get_user_stats, user_id) for user_id in ids[:200]])
+    await measure('get_total_users', [db.get_total_users for _ in range(50)])
+    await measure('flush', [db.flush])
+    await measure('delete_users', [partial(db.delete_users, list(ids))])
+    
+    return ops
+
+
+async def bench_database(users: int, mongodb_uri: Optional[str]) -> List[Dict]:
+    """JSON backend always, MongoDB when a URI is given"""
+    results = []
+    cwd = os.getcwd()
+    
+    # The JSON backend writes to the working directory
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        Config.MONGODB_URI = ""
+        db = Database()
+        try:
+            await db.connect()
+            ops = await _bench_database(db, users)
+            started = time.perf_counter()
+            await db.close()
+            ops['close'] = _latency_stats([time.perf_counter() - started])
+            results.append({'case': 'json', 'users': users, 'ops': ops})
+        finally:
+            os.chdir(cwd)
+    
+    if not mongodb_uri:
+        results.append({'case': 'mongodb', 'skipped': 'no --mongodb-uri'})
+        return results
+    
+    Config.MONGODB_URI = mongodb_uri
+    Config.DATABASE_NAME = f"{Config.DATABASE_NAME}_bench"
+    db = Database()
+    await db.connect()
+    
+    if not db.use_mongodb:
+        results.append({'case': 'mongodb', 'skipped': 'connection failed'})
+        await db.close()
+        return results
+    
+    try:
+        ops = await _bench_database(db, users)
+        results.append({'case': 'mongodb', 'users': users, 'ops': ops})
+    finally:
+        await db.db.client.drop_database(Config.DATABASE_NAME)
+        await db.close()
+    
+    return results
+
+
+# -- Report --------------------------------------------------------------------
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], cwd=ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _tool_version(command: List[str]) -> str:
+    try:
+        output = subprocess.run(command, capture_output=True, text=True).stdout
+        return output.splitlines()[0] if output else "unknown"
+    except OSError:
+        return "not installed"
+
+
+def summarize(results: Dict) -> Dict[str, float]:
+    """Flat metric -> value map used by --compare"""
+    summary = {}
+    
+    for item in results.get('download', []):
+        if 'best_mbps' in item:
+            summary[f"download.{item['case']}.best_mbps"] = item['best_mbps']
+    
+    for item in results.get('parse', []):
+        summary[f"parse.{item['case']}.lines_per_sec"] = item['lines_per_sec']
+    
+    for item in results.get('database', []):
+        for op, stats in item.get('ops', {}).items():
+            summary[f"db.{item['case']}.{op}.p50_ms"] = stats['p50_ms']
+            summary[f"db.{item['case']}.{op}.p99_ms"] = stats['p99_ms']
+    
+    return summary
+
+
+def compare(old: Dict, new: Dict) -> int:
+    """
+    Print the change of every shared metric
+    
+    Returns:
+        Number of metrics that regressed by more than REGRESSION_THRESHOLD
+    """
+    regressions = 0
+    print(f"\nComparing {old.get('revision')} -> {new.get('revision')}")
+    
+    for name, value in sorted(new['summary'].items()):
+        previous = old.get('summary', {}).get(name)
+        if previous is None or previous == 0:
+            continue
+        
+        change = (value - previous) / previous
+        higher_is_better = name.endswith(('_mbps', '_per_sec'))
+        worse = -change if higher_is_better else change
+        
+        flag = ""
+        if worse > REGRESSION_THRESHOLD:
+            flag = "  ⚠️ regression"
+            regressions += 1
+        
+        print(f"  {name:<48} {previous:12.3f} -> {value:12.3f}  {change:+7.1%}{flag}")
+    
+    return regressions
+
+
+async def run(args) -> Dict:
+    only = set(args.only.split(',')) if args.only else {'download', 'parse', 'db'}
+    results = {}
+    
+    if 'download' in only:
+        if not shutil.which('ffmpeg'):
+            logger.warning("ffmpeg not found, download benchmarks skipped")
+            results['download'] = []
+        else:
+            media_dir = args.media_dir or tempfile.mkdtemp(prefix="bench_media_")
+            download_dir = tempfile.mkdtemp(prefix="bench_downloads_")
+            Config.DOWNLOAD_PATH = download_dir
+            
+            try:
+                media = generate_media(media_dir, args.duration)
+                with MediaServer(media_dir) as server:
+                    results['download'] = await bench_downloads(media, server.base_url, args.runs)
+            finally:
+                await hls.close_session()
+                if aria2.get_daemon():
+                    aria2.get_daemon().stop()
+                shutil.rmtree(download_dir, ignore_errors=True)
+                if not args.media_dir:
+                    shutil.rmtree(media_dir, ignore_errors=True)
+    
+    if 'parse' in only:
+        results['parse'] = bench_parse(args.lines)
+    
+    if 'db' in only:
+        results['database'] = await bench_database(args.users, args.mongodb_uri)
+    
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite")
+    parser.add_argument('--duration', type=int, default=60, help="Test video length in seconds")
+    parser.add_argument('--runs', type=int, default=3, help="Downloads per case")
+    parser.add_argument('--lines', type=int, default=100000, help="Lines per batch file")
+    parser.add_argument('--users', type=int, default=2000, help="Synthetic users for DB latency")
+    parser.add_argument('--mongodb-uri', default=os.environ.get("BENCH_MONGODB_URI"), help="Also benchmark MongoDB")
+    parser.add_argument('--media-dir', help="Keep generated media here between runs")
+    parser.add_argument('--only', help="Comma-separated subset: download,parse,db")
+    parser.add_argument('--output', help="Report path (default benchmarks/results/)")
+    parser.add_argument('--compare', help="Older report to compare against")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    for name in ('helpers', 'database', 'hls', 'aria2', 'media', 'tracing'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    
+    # Spans would land in the bot's trace file
+    Config.TRACE_ENABLED = False
+    
+    started = time.time()
+    results = asyncio.run(run(args))
+    
+    revision = _git_revision()
+    report = {
+        'revision': revision,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'elapsed_s': time.time() - started,
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'ffmpeg': _tool_version(['ffmpeg', '-version']),
+            'aria2c': _tool_version(['aria2c', '--version']),
+        },
+        'parameters': vars(args) | {'mongodb_uri': bool(args.mongodb_uri)},
+        'results': results,
+        'summary': summarize(results),
+    }
+    
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"bench-{revision}-{int(started)}.json")
+    
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to {output}")
+    
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(json.load(f), report)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
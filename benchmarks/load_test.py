@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Load test: drive the bot's handlers with a fake Telegram client
+
+Simulated users run /start, a settings button, then send a direct link or
+a .txt batch; the owner runs /broadcast. Every Telegram call goes to an
+in-memory FakeClient that records it and can add latency and FloodWaits.
+Downloads and ffprobe are replaced by timed stand-ins, everything else
+(pipeline, job store, file_id cache, upload pool, progress reporter,
+broadcaster, JSON database) is the real code.
+
+Reports event loop lag, Telegram API calls per delivered video,
+throughput and per-handler latency.
+
+Usage:
+    python benchmarks/load_test.py [--users 2000] [--ramp 30] [--latency 80]
+                                   [--flood-rate 0.01] [--sessions 1] [--output report.json]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import contextvars
+import statistics
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+logger = logging.getLogger(__name__)
+
+# Handler whose call chain made an API call (copied into the tasks it starts)
+_handler: contextvars.ContextVar = contextvars.ContextVar('load_test_handler', default='other')
+
+CALLBACK_DATA = ["settings", "help", "about", "quality_480", "quality_720", "remove_thumb", "set_caption"]
+
+
+class FakeTelegram:
+    """Shared call log and fault injection for all fake clients"""
+    
+    def __init__(self, latency: float, flood_rate: float, flood_seconds: float, flood_methods: List[str]):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.flood_methods = set(flood_methods)
+        self.calls = Counter()
+        self.calls_by_handler = defaultdict(Counter)
+        self.flood_waits = Counter()
+        self.videos = 0
+        self.uploaded_bytes = 0
+        self._message_id = 0
+    
+    def next_message_id(self) -> int:
+        self._message_id += 1
+        return self._message_id
+    
+    async def call(self, method: str):
+        """Record one API call, wait the simulated round trip, maybe raise FloodWait"""
+        from pyrogram.errors import FloodWait
+        
+        self.calls[method] += 1
+        self.calls_by_handler[_handler.get()][method] += 1
+        
+        if self.latency:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        
+        if method in self.flood_methods and random.random() < self.flood_rate:
+            self.flood_waits[method] += 1
+            raise FloodWait(value=max(1, int(self.flood_seconds)))
+
+
+class FakeMessage:
+    """The parts of pyrogram.types.Message the handlers use"""
+    
+    def __init__(self, client: "FakeClient", chat_id: int, text: str = "", user_id: int = None,
+                 document: SimpleNamespace = None, batch: List[str] = None, video: SimpleNamespace = None):
+        self._client = client
+        self.id = client.telegram.next_message_id()
+        self.chat = SimpleNamespace(id=chat_id)
+        self.from_user = SimpleNamespace(id=user_id or chat_id, first_name=f"User{user_id or chat_id}")
+        self.text = text
+        self.command = text[1:].split() if text.startswith('/') else None
+        self.document = document
+        self.video = video
+        self._batch = batch
+    
+    async def reply_text(self, text: str, **kwargs) -> "FakeMessage":
+        return await self._client.send_message(self.chat.id, text, **kwargs)
+    
+    async def edit_text(self, text: str, **kwargs) -> "FakeMessage":
+        await self._client.telegram.call('edit_message_text')
+        self.text = text
+        return self
+    
+    async def delete(self):
+        await self._client.telegram.call('delete_messages')
+    
+    async def download(self) -> str:
+        """Write the simulated .txt batch"""
+        await self._client.telegram.call('download_media')
+        path = os.path.join(self._client.workdir, f"batch_{self.id}.txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            for index, url in enumerate(self._batch or []):
+                f.write(f"Lecture {index + 1}:{url}\n")
+        return path
+
+
+class FakeCallbackQuery:
+    def __init__(self, client: "FakeClient", user_id: int, data: str):
+        self._client = client
+        self.data = data
+        self.from_user = SimpleNamespace(id=user_id, first_name=f"User{user_id}")
+        self.message = FakeMessage(client, user_id, "⚙️ Settings", user_id)
+    
+    async def answer(self, text: str = None, **kwargs):
+        await self._client.telegram.call('answer_callback_query')
+
+
+class FakeClient:
+    """Stand-in for pyrogram.Client recording every call"""
+    
+    def __init__(self, telegram: FakeTelegram, workdir: str, name: str = "main"):
+        self.telegram = telegram
+        self.workdir = workdir
+        self.name = name
+        self.me = SimpleNamespace(id=1, username="load_test_bot")
+        self.is_connected = True
+    
+    def rnd_id(self) -> int:
+        return random.getrandbits(63)
+    
+    async def send_message(self, chat_id, text: str, **kwargs) -> FakeMessage:
+        await self.telegram.call('send_message')
+        return FakeMessage(self, chat_id, text)
+    
+    async def send_document(self, chat_id, document, **kwargs) -> FakeMessage:
+        await self.telegram.call('send_document')
+        return FakeMessage(self, chat_id)
+    
+    async def send_video(self, chat_id, video, caption: str = "", progress=None, **kwargs) -> FakeMessage:
+        await self.telegram.call('send_video')
+        
+        # A path is an upload, anything else a file_id re-send
+        if os.path.exists(str(video)):
+            size = os.path.getsize(video)
+            self.telegram.uploaded_bytes += size
+            if progress:
+                await progress(size, size)
+            file_id = f"{self.name}-{self.rnd_id()}"
+        else:
+            file_id = video
+        
+        self.telegram.videos += 1
+        return FakeMessage(self, chat_id, caption, video=SimpleNamespace(file_id=file_id))
+
+
+class LoopLagMonitor:
+    """Sample how late the event loop wakes up from a short sleep"""
+    
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - started - self.interval))
+    
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+    
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    """Milliseconds: mean, p50/p90/p99 and max of a list of seconds"""
+    if not samples:
+        return {'count': 0}
+    
+    values = sorted(samples)
+    
+    def percentile(fraction):
+        return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))] * 1000
+    
+    return {
+        'count': len(values),
+        'mean_ms': statistics.fmean(values) * 1000,
+        'p50_ms': percentile(0.5),
+        'p90_ms': percentile(0.9),
+        'p99_ms': percentile(0.99),
+        'max_ms': values[-1] * 1000,
+    }
+
+
+def _prepare_environment(workdir: str):
+    """Point every path of the bot into the scratch directory (before importing it)"""
+    os.environ.setdefault("API_ID", "1")
+    os.environ.setdefault("API_HASH", "load-test")
+    os.environ.setdefault("BOT_TOKEN", "0:load-test")
+    os.environ["DATA_PATH"] = os.path.join(workdir, "data")
+    os.environ["DOWNLOAD_PATH"] = os.path.join(workdir, "downloads")
+    os.environ["MONGODB_URI"] = ""
+    os.environ["PORT"] = "0"
+    os.environ["STREAM_UPLOAD"] = "False"
+    os.environ["UPLOAD_BOT_TOKENS"] = ""
+    os.environ["UPLOAD_SESSION_STRING"] = ""
+
+
+def _patch_bot(bot_module, telegram: FakeTelegram, client: FakeClient, args):
+    """Swap the network-facing parts of bot.py for fakes"""
+    from helpers import create_workspace
+    from progress import ProgressReporter
+    from session_pool import UploadPool, UploadSession
+    
+    async def fake_download(url: str, quality: str = "720", progress_message=None, stream=None) -> Optional[str]:
+        reporter = ProgressReporter.for_message(progress_message) if progress_message else None
+        duration = max(0.0, random.gauss(args.download_seconds, args.download_seconds / 4))
+        steps = 5
+        
+        for step in range(steps):
+            await asyncio.sleep(duration / steps)
+            if reporter:
+                reporter.update(f"📥 **Downloading...**\n\nProgress: {(step + 1) * 100 // steps}%")
+        
+        workspace = create_workspace()
+        path = os.path.join(workspace, f"video_{abs(hash(url)) % 10 ** 8}.mp4")
+        with open(path, 'wb') as f:
+            f.write(os.urandom(args.file_size))
+        return path
+    
+    async def fake_metadata(path: str) -> Dict:
+        return {'duration': 60, 'width': 1280, 'height': 720, 'thumb': None}
+    
+    bot_module.download_video = fake_download
+    bot_module.get_video_metadata = fake_metadata
+    bot_module.bot.me = client.me
+    
+    pool = UploadPool(client)
+    for index in range(1, args.sessions):
+        pool.sessions.append(UploadSession(f"bot{index}", FakeClient(telegram, client.workdir, f"bot{index}"), managed=False))
+    bot_module.upload_pool = pool
+
+
+async def _run_handler(name: str, stats: Dict, handler, *args):
+    token = _handler.set(name)
+    started = time.perf_counter()
+    try:
+        await handler(*args)
+    except Exception as e:
+        stats['errors'][name] += 1
+        logger.debug(f"{name} failed: {str(e)}")
+    finally:
+        stats['latency'][name].append(time.perf_counter() - started)
+        _handler.reset(token)
+
+
+async def run_load(args, workdir: str) -> Dict:
+    import bot as bot_module
+    from config import Config
+    
+    telegram = FakeTelegram(args.latency / 1000, args.flood_rate, args.flood_seconds, args.flood_methods.split(','))
+    client = FakeClient(telegram, workdir)
+    _patch_bot(bot_module, telegram, client, args)
+    
+    Config.OWNER_ID = 1
+    Config.AUTH_USERS = set(range(1000, 1000 + args.users))
+    if args.broadcast_rate:
+        Config.BROADCAST_RATE = args.broadcast_rate
+    if args.no_delay:
+        Config.DELAY_BETWEEN_DOWNLOADS = 0
+    
+    links = [f"https://cdn.example.com/videos/{index}.mp4" for index in range(args.unique_links)]
+    stats = {'latency': defaultdict(list), 'errors': Counter()}
+    
+    async def simulated_user(user_id: int):
+        await asyncio.sleep(random.uniform(0, args.ramp))
+        
+        await _run_handler('start_command', stats, bot_module.start_command,
+                           client, FakeMessage(client, user_id, "/start"))
+        await _run_handler('callback_handler', stats, bot_module.callback_handler,
+                           client, FakeCallbackQuery(client, user_id, random.choice(CALLBACK_DATA)))
+        
+        if random.random() < args.batch_ratio:
+            batch = random.choices(links, k=args.batch_size)
+            message = FakeMessage(
+                client, user_id, user_id=user_id, batch=batch,
+                document=SimpleNamespace(file_name="links.txt", file_size=0)
+            )
+            await _run_handler('handle_document', stats, bot_module.handle_document, client, message)
+        else:
+            message = FakeMessage(client, user_id, random.choice(links))
+            await _run_handler('handle_direct_link', stats, bot_module.handle_direct_link, client, message)
+    
+    async def owner_broadcast():
+        await asyncio.sleep(args.ramp / 2)
+        message = FakeMessage(client, Config.OWNER_ID, "/broadcast Load test announcement")
+        await _run_handler('broadcast_command', stats, bot_module.broadcast_command, client, message)
+    
+    await bot_module.db.connect()
+    monitor = LoopLagMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    
+    try:
+        tasks = [simulated_user(user_id) for user_id in Config.AUTH_USERS]
+        if not args.no_broadcast:
+            tasks.append(owner_broadcast())
+        await asyncio.gather(*tasks)
+        
+        # Broadcasts run in the background
+        while bot_module.background_tasks:
+            await asyncio.gather(*list(bot_module.background_tasks), return_exceptions=True)
+        
+        elapsed = time.perf_counter() - started
+    finally:
+        monitor.stop()
+        await bot_module.db.close()
+    
+    video_calls = sum(
+        sum(methods.values()) for handler, methods in telegram.calls_by_handler.items()
+        if handler != 'broadcast_command'
+    )
+    
+    return {
+        'elapsed_s': elapsed,
+        'users': args.users,
+        'videos_delivered': telegram.videos,
+        'videos_per_sec': telegram.videos / elapsed,
+        'handlers_per_sec': sum(len(v) for v in stats['latency'].values()) / elapsed,
+        'uploaded_mb': telegram.uploaded_bytes / (1024 * 1024),
+        'api_calls': dict(telegram.calls),
+        'api_calls_total': sum(telegram.calls.values()),
+        'api_calls_per_video': video_calls / telegram.videos if telegram.videos else None,
+        'api_calls_by_handler': {name: dict(methods) for name, methods in telegram.calls_by_handler.items()},
+        'flood_waits_injected': dict(telegram.flood_waits),
+        'handler_errors': dict(stats['errors']),
+        'handler_latency': {name: _percentiles(values) for name, values in stats['latency'].items()},
+        'loop_lag': _percentiles(monitor.samples),
+        'upload_sessions': bot_module.upload_pool.status(),
+    }
+
+
+def print_report(report: Dict):
+    print(f"\n{report['users']} users in {report['elapsed_s']:.1f}s")
+    print(f"  videos delivered   {report['videos_delivered']} ({report['videos_per_sec']:.2f}/s)")
+    print(f"  handlers           {report['handlers_per_sec']:.1f}/s")
+    if report['api_calls_per_video'] is not None:
+        print(f"  API calls / video  {report['api_calls_per_video']:.1f} (broadcast excluded)")
+    print(f"  API calls          {report['api_calls_total']}: " +
+          ", ".join(f"{name} {count}" for name, count in sorted(report['api_calls'].items())))
+    
+    if report['flood_waits_injected']:
+        print(f"  FloodWaits         {report['flood_waits_injected']}")
+    if report['handler_errors']:
+        print(f"  handler errors     {report['handler_errors']}")
+    
+    lag = report['loop_lag']
+    if lag['count']:
+        print(f"  loop lag           p50 {lag['p50_ms']:.1f} ms  p99 {lag['p99_ms']:.1f} ms  max {lag['max_ms']:.1f} ms")
+    
+    print("\n  handler latency")
+    for name, latency in sorted(report['handler_latency'].items()):
+        print(f"    {name:<20} n={latency['count']:<6} p50 {latency['p50_ms']:9.1f} ms  p99 {latency['p99_ms']:9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the handlers against a fake Telegram")
+    parser.add_argument('--users', type=int, default=2000, help="Simulated users")
+    parser.add_argument('--ramp', type=float, default=30, help="Seconds over which users arrive")
+    parser.add_argument('--latency', type=float, default=80, help="Mean simulated API round trip (ms)")
+    parser.add_argument('--flood-rate', type=float, default=0.0, help="Probability of a FloodWait per call")
+    parser.add_argument('--flood-seconds', type=float, default=1, help="FloodWait length")
+    parser.add_argument('--flood-methods', default="send_message,edit_message_text,send_video",
+                        help="Comma-separated methods that can FloodWait")
+    parser.add_argument('--sessions', type=int, default=1, help="Upload sessions in the pool")
+    parser.add_argument('--batch-ratio', type=float, default=0.2, help="Share of users sending a .txt batch")
+    parser.add_argument('--batch-size', type=int, default=5, help="Links per batch")
+    parser.add_argument('--unique-links', type=int, default=500, help="Distinct URLs (repeats hit the file_id cache)")
+    parser.add_argument('--download-seconds', type=float, default=2, help="Mean simulated download time")
+    parser.add_argument('--file-size', type=int, default=64 * 1024, help="Bytes written per simulated video")
+    parser.add_argument('--broadcast-rate', type=float, help="Override BROADCAST_RATE")
+    parser.add_argument('--no-broadcast', action='store_true', help="Skip the owner broadcast")
+    parser.add_argument('--no-delay', action='store_true', help="Set DELAY_BETWEEN_DOWNLOADS to 0")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true', help="Show the bot's log (injected FloodWaits log errors)")
+    parser.add_argument('--output', help="Write the report as JSON")
+    args = parser.parse_args()
+    
+    random.seed(args.seed)
+    logging.basicConfig(level=logging.WARNING if args.verbose else logging.CRITICAL, format='%(message)s')
+    
+    with tempfile.TemporaryDirectory(prefix="load_test_") as workdir:
+        _prepare_environment(workdir)
+        
+        # The JSON user database lives in the working directory
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            report = asyncio.run(run_load(args, workdir))
+        finally:
+            os.chdir(cwd)
+    
+    report['parameters'] = vars(args)
+    print_report(report)
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
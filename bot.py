@@ -9,13 +9,33 @@ import os
 import logging
 import asyncio
 import re
+import time
 from datetime import datetime
-from pyrogram import Client, filters
+from typing import Optional, Tuple
+from pyrogram import Client, filters, idle
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from pyrogram.errors import FloodWait
-from helpers import download_video, extract_links_from_txt, get_video_info
+from helpers import (
+    download_video, iter_links_from_txt, get_video_info, get_info_executor, cleanup_download, cleanup_downloads,
+    LinkCheckFailed
+)
 from config import Config
 from database import Database
+from pipeline import BatchPipeline
+from file_cache import FileIdCache
+from info_cache import info_cache
+from progress import ProgressReporter
+from preflight import format_size
+from broadcast import Broadcaster
+from uploader import StreamingUpload
+from session_pool import UploadPool, UploadSession, NO_ACCESS_ERRORS, MAIN_SESSION
+from media import get_video_metadata, split_video
+from scheduler import FairScheduler
+from jobs import JobStore
+import jobs
+import hls
+import metrics
+import tracing
 
 # Setup logging
 logging.basicConfig(
@@ -32,9 +52,32 @@ bot = Client(
     bot_token=Config.BOT_TOKEN
 )
 
-# Initialize Database
+# Initialize Database (connects in main())
 db = Database()
 
+# Persistent batch job store
+job_store = JobStore()
+
+# Telegram file_ids of delivered videos (skips download + upload on repeats)
+file_cache = FileIdCache()
+
+# Main bot plus optional extra upload sessions (started in main())
+upload_pool = UploadPool(bot)
+
+# Shares download slots fairly between users
+scheduler = FairScheduler()
+
+# /metrics and /health for the hosting platform (started in main())
+metrics_server = metrics.MetricsServer(health_check=lambda: bot.is_connected)
+metrics.ACTIVE_BATCHES.set_function(lambda: len(running_batches))
+metrics.PENDING_JOBS.set_function(job_store.pending_count)
+metrics.QUEUE_DEPTH.set_function(BatchPipeline.queue_depths)
+metrics.SCHEDULER_WAITING.set_function(scheduler.waiting)
+
+# Batches being processed right now / background tasks we must keep alive
+running_batches = set()
+background_tasks = set()
+
 # User settings storage (in-memory for free hosting)
 user_settings = {}
 
@@ -73,7 +116,7 @@ async def start_command(client: Client, message: Message):
     user_id = message.from_user.id
     
     # Add to database
-    db.add_user(user_id, message.from_user.first_name)
+    await db.add_user(user_id, message.from_user.first_name)
     
     welcome_text = f"""
 👋 **Welcome {message.from_user.first_name}!**
@@ -145,6 +188,10 @@ async def help_command(client: Client, message: Message):
 `/stats` - Detailed statistics
 `/add_user <user_id>` - Authorize user
 `/remove_user <user_id>` - Deauthorize user
+`/jobs` - List failed batch jobs
+`/uncache <url|all>` - Forget cached uploads
+`/retry <job_id|all>` - Retry failed jobs
+`/profile [jobs|next]` - Stage timings / profile next job
 
 **📝 Text File Format:**
 
@@ -222,7 +269,7 @@ async def stats_command(client: Client, message: Message):
         await message.reply_text("⚠️ This command is only for owner!")
         return
     
-    total_users = db.get_total_users()
+    total_users = await db.get_total_users()
     
     stats_text = f"""
 📊 **Bot Statistics**
@@ -238,6 +285,19 @@ async def stats_command(client: Client, message: Message):
 💾 **Storage:** Temporary (Auto-cleanup)
 """
     
+    if len(upload_pool.sessions) > 1:
+        stats_text += "\n📤 **Upload Sessions:**\n" + "\n".join(
+            f"• {s['name']}: {s['uploads']} sent, {s['active']} active, "
+            f"{s['flood_waits']} FloodWaits" + (f" (waiting {s['flood_remaining']}s)" if s['flood_remaining'] else "")
+            for s in upload_pool.status()
+        )
+    
+    waiting = scheduler.waiting()
+    stats_text += (
+        f"\n🚦 **Downloads:** {scheduler.active}/{scheduler.max_active} running, "
+        f"{sum(waiting.values())} waiting ({len(scheduler.users)} users)"
+    )
+    
     await message.reply_text(stats_text)
 
 
@@ -277,111 +337,515 @@ Made with ❤️ using Python
     await message.reply_text(about_text, reply_markup=keyboard)
 
 
-@bot.on_message(filters.document)
-async def handle_document(client: Client, message: Message):
-    """Handle text file uploads"""
-    user_id = message.from_user.id
+async def send_video_pooled(session: UploadSession = None, **kwargs) -> Tuple[Optional[Message], UploadSession]:
+    """send_video on the least busy upload session, moving on from FloodWaits"""
+    return await upload_pool.run(
+        kwargs['chat_id'],
+        lambda client: client.send_video(**kwargs),
+        session
+    )
+
+
+async def send_video_file(client: Client, stream: Optional[StreamingUpload], **kwargs) -> Tuple[Optional[Message], str]:
+    """
+    Post a downloaded video, finishing its streaming upload when there is one
     
-    if not is_authorized(user_id):
-        await message.reply_text("⚠️ You are not authorized to use this bot!\nContact admin for access.")
-        return
+    Duration, dimensions and (unless the user set one) the thumbnail come
+    from ffprobe/ffmpeg. Falls back to a regular send_video when nothing
+    was streamed.
     
-    file = message.document
+    Returns:
+        (sent message, name of the upload session that sent it)
+    """
+    with tracing.span('metadata'):
+        metadata = await get_video_metadata(kwargs['video'])
+    for key in ('duration', 'width', 'height'):
+        if metadata[key]:
+            kwargs.setdefault(key, metadata[key])
+    if not kwargs.get('thumb'):
+        kwargs['thumb'] = metadata['thumb']
     
-    # Check if it's a text file
-    if not file.file_name.endswith('.txt'):
-        await message.reply_text("⚠️ Please send a `.txt` file containing video links!")
+    size = os.path.getsize(kwargs['video'])
+    started = time.perf_counter()
+    metrics.ACTIVE_UPLOADS.inc()
+    try:
+        with tracing.span('upload', bytes=size) as fields:
+            sent, session_name, mode = await _send_video_file(client, stream, **kwargs)
+            fields.update(session=session_name, mode=mode)
+    finally:
+        metrics.ACTIVE_UPLOADS.dec()
+    
+    metrics.UPLOAD_SECONDS.observe(time.perf_counter() - started, session=session_name, mode=mode)
+    metrics.BYTES_UPLOADED.inc(size, session=session_name)
+    return sent, session_name
+
+
+async def deliver_video(client: Client, stream: Optional[StreamingUpload], **kwargs) -> Tuple[Optional[Message], str]:
+    """
+    Post a downloaded video, split into parts when it's over Config.MAX_FILE_SIZE
+    
+    Parts are cut at keyframes without re-encoding, and each one is sent
+    as soon as it is cut with a "Part i/n" caption.
+    
+    Returns:
+        (sent message, session name) like send_video_file; (None, '') for a
+        split video, whose parts aren't cached
+    """
+    if os.path.getsize(kwargs['video']) <= Config.MAX_FILE_SIZE:
+        return await send_video_file(client, stream, **kwargs)
+    
+    caption = kwargs.get('caption', '')
+    
+    async def send_part(index: int, total: int, part_path: str):
+        try:
+            await send_video_file(
+                client, None,
+                **{**kwargs, 'video': part_path, 'caption': f"📦 **Part {index}/{total}**\n{caption}"}
+            )
+        finally:
+            os.remove(part_path)
+    
+    await split_video(kwargs['video'], send_part)
+    return None, ''
+
+
+async def _send_video_file(client: Client, stream: Optional[StreamingUpload], **kwargs) -> Tuple[Optional[Message], str, str]:
+    if stream is not None:
+        session = upload_pool.session_of(stream.client)
+        try:
+            sent = await stream.send_video(
+                kwargs['chat_id'],
+                caption=kwargs.get('caption', ''),
+                thumb=kwargs.get('thumb'),
+                duration=kwargs.get('duration', 0),
+                width=kwargs.get('width', 0),
+                height=kwargs.get('height', 0),
+                progress=kwargs.get('progress')
+            )
+            if sent:
+                return sent, session.name, 'stream'
+        except NO_ACCESS_ERRORS:
+            if session.name == MAIN_SESSION:
+                raise
+            session.denied_chats.add(kwargs['chat_id'])
+    
+    sent, session = await send_video_pooled(**kwargs)
+    return sent, session.name, 'file'
+
+
+def new_stream(chat_id) -> Optional[StreamingUpload]:
+    """StreamingUpload for one download on a pooled session, if enabled"""
+    return StreamingUpload(upload_pool.pick(chat_id).client) if Config.STREAM_UPLOAD else None
+
+
+async def send_cached_video(client: Client, chat_id, cached: dict, caption: str) -> bool:
+    """
+    Re-send an already delivered video by its Telegram file_id
+    
+    file_ids only work for the session that uploaded them, so the same
+    session sends it again.
+    
+    Returns:
+        False if the file_id no longer works (caller should download again)
+    """
+    session = upload_pool.get(cached['client'])
+    if session is None:
+        return False
+    
+    try:
+        await send_video_pooled(session, chat_id=chat_id, video=cached['file_id'], caption=caption)
+        return True
+    except FloodWait:
+        raise
+    except Exception as e:
+        logger.warning(f"Cached file_id failed: {str(e)}")
+        return False
+
+
+def remember_upload(sent: Optional[Message], session_name: str, url: str, quality: str, title: str):
+    """Cache the file_id of an uploaded video (and its session) for later re-sends"""
+    media = sent and (sent.video or sent.document)
+    if media:
+        file_cache.put(url, quality, media.file_id, title, session_name)
+
+
+async def process_batch(client: Client, batch_id: int, status: Message = None, ingest_done: asyncio.Event = None):
+    """
+    Run a stored batch through the download pipeline
+    
+    Only pending jobs are processed, so a resumed or retried batch
+    never re-downloads videos that were already delivered.
+    While ingest_done is unset the links are still being parsed, and
+    new jobs are picked up as they are stored.
+    """
+    if batch_id in running_batches:
         return
     
-    # Download the file
-    status = await message.reply_text("📥 Downloading text file...")
+    batch = job_store.get_batch(batch_id)
+    if not batch:
+        return
+    
+    running_batches.add(batch_id)
+    finished = False
     
     try:
-        file_path = await message.download()
-        await status.edit_text("🔍 Extracting video links...")
+        chat_id = batch['chat_id']
+        settings = batch['settings']
         
-        # Extract links
-        links = extract_links_from_txt(file_path)
+        # User settings snapshot taken when the file was sent
+        thumbnail = settings.get('thumbnail')
+        channel = settings.get('channel')
+        caption_template = settings.get('caption')
+        quality = settings.get('quality', '720')
+        target_chat = channel if channel else chat_id
         
-        if not links:
-            await status.edit_text("❌ No valid video links found in the file!")
-            os.remove(file_path)
-            return
-        
-        await status.edit_text(f"✅ Found {len(links)} video link(s)!\n\n🎬 Starting download process...")
+        async def probe(job):
+            total = job_store.get_batch(batch_id)['total']
+            progress_msg = await client.send_message(
+                chat_id,
+                f"📥 **Processing {job['idx']}/{total}**\n"
+                f"🎬 **Title:** {job['title']}\n"
+                f"🔗 **URL:** {job['url'][:50]}...\n\n"
+                f"⏳ Queued..."
+            )
+            
+            return {**job, 'progress': ProgressReporter.for_message(progress_msg)}
         
-        # Get user settings
-        thumbnail = get_user_setting(user_id, 'thumbnail')
-        channel = get_user_setting(user_id, 'channel')
-        caption_template = get_user_setting(user_id, 'caption')
-        quality = get_user_setting(user_id, 'quality', '720')
+        async def download(job):
+            # Already delivered before: the upload stage re-sends it by file_id
+            job['cached'] = file_cache.get(job['url'], quality)
+            if job['cached']:
+                return None
+            
+            # Waits its turn behind other users' downloads
+            async with scheduler.slot(batch['user_id']):
+                job_store.set_state(job['id'], jobs.DOWNLOADING)
+                job['stream'] = new_stream(target_chat)
+                return await download_video(job['url'], quality, job['progress'], job['stream'])
         
-        # Process each link
-        for idx, link_data in enumerate(links, 1):
-            try:
-                url = link_data['url']
-                title = link_data.get('title', f'Video_{idx}')
-                
-                progress_msg = await message.reply_text(
-                    f"📥 **Processing {idx}/{len(links)}**\n"
-                    f"🎬 **Title:** {title}\n"
-                    f"🔗 **URL:** {url[:50]}...\n\n"
-                    f"⏳ Downloading..."
-                )
+        async def upload(job, video_path):
+            idx, title, progress = job['idx'], job['title'], job['progress']
+            
+            # Prepare caption
+            if caption_template:
+                caption = caption_template.replace('{title}', title).replace('{index}', str(idx))
+            else:
+                caption = f"🎬 **{title}**\n\n📥 Downloaded by @{bot.me.username}\n💝 Made by {Config.DEVELOPER_NAME}"
+            
+            if job['cached']:
+                if await send_cached_video(client, target_chat, job['cached'], caption):
+                    job_store.set_state(job['id'], jobs.DONE)
+                    await progress.finish(f"⚡ Sent from cache: {title}")
+                    stats['total_videos'] += 1
+                    metrics.VIDEOS.inc(source='cache')
+                    return
                 
-                # Download video
-                video_path = await download_video(url, quality, progress_msg)
-                
-                if not video_path:
-                    await progress_msg.edit_text(f"❌ Failed to download: {title}")
-                    continue
-                
-                # Prepare caption
-                if caption_template:
-                    caption = caption_template.replace('{title}', title).replace('{index}', str(idx))
-                else:
-                    caption = f"🎬 **{title}**\n\n📥 Downloaded by @{bot.me.username}\n💝 Made by {Config.DEVELOPER_NAME}"
+                # Stale file_id: fall back to a normal download
+                file_cache.invalidate(job['url'])
+                async with scheduler.slot(batch['user_id']):
+                    job_store.set_state(job['id'], jobs.DOWNLOADING)
+                    job['stream'] = new_stream(target_chat)
+                    video_path = await download_video(job['url'], quality, progress, job['stream'])
+            
+            if not video_path:
+                job_store.set_state(job['id'], jobs.FAILED, "Download failed")
+                await progress.finish(f"❌ Failed to download: {title}")
+                return
+            
+            try:
+                job_store.set_state(job['id'], jobs.UPLOADING)
                 
                 # Upload video
-                await progress_msg.edit_text(f"📤 Uploading {title}...")
+                await progress.set(f"📤 Uploading {title}...")
                 
-                target_chat = channel if channel else message.chat.id
-                
-                await client.send_video(
+                sent, session_name = await deliver_video(
+                    client,
+                    job.get('stream'),
                     chat_id=target_chat,
                     video=video_path,
                     caption=caption,
                     thumb=thumbnail,
                     supports_streaming=True,
-                    progress=lambda current, total: asyncio.create_task(
-                        upload_progress(current, total, progress_msg, title)
-                    )
+                    progress=progress.upload_callback(title)
                 )
+                remember_upload(sent, session_name, job['url'], quality, title)
                 
-                await progress_msg.edit_text(f"✅ Uploaded: {title}")
-                
-                # Cleanup
-                if os.path.exists(video_path):
-                    os.remove(video_path)
+                job_store.set_state(job['id'], jobs.DONE)
+                await progress.finish(f"✅ Uploaded: {title}")
                 
                 # Update stats
                 stats['total_videos'] += 1
                 stats['total_downloads'] += 1
+                metrics.VIDEOS.inc(source='batch')
+                await db.increment_downloads(batch['user_id'])
+            finally:
+                # Cleanup (the whole job workspace)
+                cleanup_download(video_path)
+                if job.get('stream'):
+                    job['stream'].abort()
+            
+            # Small delay to avoid flood
+            await asyncio.sleep(Config.DELAY_BETWEEN_DOWNLOADS)
+        
+        async def on_error(job, error):
+            try:
+                job_store.set_state(job['id'], jobs.FAILED, str(error))
+                if 'progress' in job:
+                    await job['progress'].finish()
+                await client.send_message(chat_id, f"❌ Error processing video {job['idx']}: {str(error)}")
+            finally:
+                # Closes the job's trace (and its profile, if one was running)
+                with tracing.job(job['id'], job.get('url')):
+                    pass
+        
+        # Spans of both stages are attributed to the job
+        async def traced_download(job):
+            with tracing.job(job['id'], job['url'], final=False):
+                return await download(job)
+        
+        async def traced_upload(job, video_path):
+            with tracing.job(job['id'], job['url']):
+                await upload(job, video_path)
+        
+        # Process links as a pipeline: the next video downloads while
+        # the current one uploads, uploads stay in file order.
+        # Loop so jobs re-queued by /retry during the run are picked up.
+        async def pending_source():
+            """Page through pending jobs, following the file while it is parsed"""
+            last_idx = 0
+            while True:
+                parsing = ingest_done is not None and not ingest_done.is_set()
+                page = job_store.pending_jobs(batch_id, after_idx=last_idx, limit=100)
                 
-                # Small delay to avoid flood
-                await asyncio.sleep(2)
+                if page:
+                    for job in page:
+                        yield job
+                    last_idx = page[-1]['idx']
+                elif parsing:
+                    await asyncio.sleep(0.2)
+                else:
+                    break
+        
+        while True:
+            pipeline = BatchPipeline(probe, traced_download, traced_upload, on_error=on_error)
+            await pipeline.run(pending_source())
+            
+            if not job_store.has_pending(batch_id):
+                break
+        
+        job_store.set_batch_status(batch_id, jobs.BATCH_FINISHED)
+        finished = True
+        total = job_store.get_batch(batch_id)['total']
+        
+        counts = job_store.batch_counts(batch_id)
+        summary = (
+            f"✅ **Process Complete!**\n\n"
+            f"🎉 Successfully processed {counts.get(jobs.DONE, 0)}/{total} video(s)!"
+        )
+        if counts.get(jobs.FAILED):
+            summary += f"\n❌ Failed: {counts[jobs.FAILED]}"
+        
+        if status:
+            await status.edit_text(summary)
+        else:
+            await client.send_message(chat_id, summary)
+        
+    except Exception as e:
+        logger.error(f"Error processing batch {batch_id}: {str(e)}")
+        try:
+            await client.send_message(batch['chat_id'], f"❌ Batch error: {str(e)}")
+        except:
+            pass
+    finally:
+        running_batches.discard(batch_id)
+        
+        # A /retry landing after the batch finished found it still running and left
+        # the re-queued jobs to us
+        if finished and job_store.has_pending(batch_id):
+            start_batch(client, batch_id)
+
+
+def run_in_background(coro) -> asyncio.Task:
+    """Run a coroutine as a task that is kept alive until it finishes"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+def start_batch(client: Client, batch_id: int, status: Message = None):
+    """Process a batch in the background"""
+    return run_in_background(process_batch(client, batch_id, status))
+
+
+def estimated_download_speed() -> float:
+    """Average bytes/s of one download so far (Config.PREVALIDATE_DEFAULT_SPEED before any)"""
+    seconds, _ = metrics.DOWNLOAD_SECONDS.total(result='ok')
+    downloaded = metrics.BYTES_DOWNLOADED.total()
+    if seconds > 0 and downloaded:
+        return downloaded / seconds
+    return Config.PREVALIDATE_DEFAULT_SPEED
+
+
+def format_eta(seconds: float) -> str:
+    """Rough duration like 1h 20m"""
+    minutes = max(1, int(seconds // 60))
+    if minutes < 60:
+        return f"{minutes}m"
+    return f"{minutes // 60}h {minutes % 60}m"
+
+
+async def prevalidate_batch(client: Client, batch_id: int, status: Message):
+    """
+    Resolve every pending link of a batch before downloading starts
+    
+    get_video_info runs for all links at once in the info worker pool
+    (Config.PREVALIDATE_WORKERS threads), then one summary is posted:
+    valid and dead links, estimated total size and time. With
+    Config.PREVALIDATE_DROP_DEAD dead links are marked failed, so they
+    never take a download slot (/retry queues them again). Links that
+    could not be checked (timeouts, rate limits) stay queued.
+    """
+    batch = job_store.get_batch(batch_id)
+    quality = batch['settings'].get('quality', '720')
+    pending = job_store.pending_jobs(batch_id)
+    if not pending:
+        return
+    
+    loop = asyncio.get_running_loop()
+    executor = get_info_executor()
+    progress = ProgressReporter.for_message(status)
+    checked = 0
+    unchecked = 0
+    
+    async def check(job):
+        nonlocal checked, unchecked
+        # Delivered before: alive, and re-sent without downloading
+        if file_cache.get(job['url'], quality):
+            info = {'filesize': 0}
+        else:
+            try:
+                info = await loop.run_in_executor(executor, get_video_info, job['url'], quality)
+            except LinkCheckFailed:
+                # Not known to be dead: the download gets its own chance
+                unchecked += 1
+                info = {'filesize': None}
+        
+        checked += 1
+        progress.update(f"🔍 Checking links... {checked}/{len(pending)}")
+        return job, info
+    
+    with tracing.job(f"batch-{batch_id}"), tracing.span('prevalidate', links=len(pending)) as fields:
+        results = await asyncio.gather(*(check(job) for job in pending))
+        dead = [job for job, info in results if info is None]
+        fields['dead'] = len(dead)
+        fields['unchecked'] = unchecked
+    
+    await progress.finish()
+    
+    if dead and Config.PREVALIDATE_DROP_DEAD:
+        for job in dead:
+            job_store.set_state(job['id'], jobs.FAILED, "Link is dead, private or protected (pre-check)")
+    
+    # Links without a size estimate are assumed to be average
+    valid = [info for _, info in results if info is not None]
+    sizes = [info['filesize'] for info in valid if info.get('filesize')]
+    unknown = sum(1 for info in valid if info.get('filesize') is None)
+    total_size = sum(sizes) + (unknown * sum(sizes) / len(sizes) if sizes else 0)
+    parallel = min(scheduler.per_user, scheduler.max_active)
+    
+    summary = (
+        f"📋 **Batch check**\n\n"
+        f"✅ Valid: {len(valid) - unchecked}\n"
+        f"❌ Dead: {len(dead)}" + (" (skipped)" if dead and Config.PREVALIDATE_DROP_DEAD else "") + "\n"
+    )
+    if unchecked:
+        summary += f"⚠️ Unchecked: {unchecked} (will be tried anyway)\n"
+    
+    if total_size:
+        summary += (
+            f"💾 Estimated size: ~{format_size(total_size)}\n"
+            f"⏱ Estimated time: ~{format_eta(total_size / (estimated_download_speed() * parallel))}"
+        )
+    else:
+        summary += "💾 Estimated size: unknown"
+    
+    if dead:
+        summary += "\n\n**Dead links:**\n" + "\n".join(
+            f"{job['idx']}. {job['title'][:40]}" for job in dead[:10]
+        )
+        if len(dead) > 10:
+            summary += f"\n... and {len(dead) - 10} more"
+    
+    await client.send_message(batch['chat_id'], summary)
+
+
+@bot.on_message(filters.document)
+async def handle_document(client: Client, message: Message):
+    """Handle text file uploads"""
+    user_id = message.from_user.id
+    
+    if not is_authorized(user_id):
+        await message.reply_text("⚠️ You are not authorized to use this bot!\nContact admin for access.")
+        return
+    
+    file = message.document
+    
+    # Check if it's a text file
+    if not file.file_name.endswith('.txt'):
+        await message.reply_text("⚠️ Please send a `.txt` file containing video links!")
+        return
+    
+    # Download the file
+    status = await message.reply_text("📥 Downloading text file...")
+    
+    try:
+        file_path = await message.download()
+        await status.edit_text("🔍 Extracting video links...")
+        
+        # Store the batch so it survives restarts
+        settings = {
+            'thumbnail': get_user_setting(user_id, 'thumbnail'),
+            'channel': get_user_setting(user_id, 'channel'),
+            'caption': get_user_setting(user_id, 'caption'),
+            'quality': get_user_setting(user_id, 'quality', '720'),
+        }
+        batch_id = job_store.create_batch(user_id, message.chat.id, settings, streamed=True)
+        ingest_done = asyncio.Event()
+        
+        async def ingest():
+            """Parse the file line by line, queueing links as they are found"""
+            try:
+                with tracing.job(f"batch-{batch_id}"), tracing.span('ingest') as fields:
+                    count = await asyncio.get_running_loop().run_in_executor(
+                        None, job_store.ingest, batch_id, iter_links_from_txt(file_path)
+                    )
+                    fields['links'] = count
+                if count:
+                    await status.edit_text(f"✅ Found {count} video link(s)!\n\n🎬 Starting download process...")
+                return count
+            finally:
+                ingest_done.set()
                 
-            except FloodWait as e:
-                await asyncio.sleep(e.value)
-            except Exception as e:
-                logger.error(f"Error processing link {idx}: {str(e)}")
-                await message.reply_text(f"❌ Error processing video {idx}: {str(e)}")
+                # Cleanup text file
+                if os.path.exists(file_path):
+                    os.remove(file_path)
         
-        # Cleanup text file
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        if Config.BATCH_PREVALIDATE:
+            # Every link is checked first, so dead ones never reach a download slot
+            count = await ingest()
+            if count:
+                await prevalidate_batch(client, batch_id, status)
+                await process_batch(client, batch_id, status)
+            else:
+                # Nothing to run: don't leave it for resume_batches after a restart
+                job_store.set_batch_status(batch_id, jobs.BATCH_FINISHED)
+        else:
+            # Downloads start while the rest of the file is still being parsed
+            count, _ = await asyncio.gather(ingest(), process_batch(client, batch_id, status, ingest_done))
         
-        await status.edit_text(f"✅ **Process Complete!**\n\n🎉 Successfully processed {len(links)} video(s)!")
+        if not count:
+            await status.edit_text("❌ No valid video links found in the file!")
         
     except Exception as e:
         logger.error(f"Error handling document: {str(e)}")
@@ -399,7 +863,18 @@ async def handle_direct_link(client: Client, message: Message):
     
     url = message.text.strip()
     
+    with tracing.job(f"direct-{message.chat.id}-{message.id}", url):
+        await process_direct_link(client, message, url)
+
+
+async def process_direct_link(client: Client, message: Message, url: str):
+    """Download and deliver one directly sent link"""
+    user_id = message.from_user.id
+    
     status = await message.reply_text("🔍 Analyzing link...")
+    progress = ProgressReporter.for_message(status)
+    video_path = None
+    stream = None
     
     try:
         # Get user settings
@@ -407,13 +882,36 @@ async def handle_direct_link(client: Client, message: Message):
         channel = get_user_setting(user_id, 'channel')
         caption_template = get_user_setting(user_id, 'caption')
         quality = get_user_setting(user_id, 'quality', '720')
+        target_chat = channel if channel else message.chat.id
+        
+        # Already delivered before? Re-send by file_id
+        cached = file_cache.get(url, quality)
+        if cached:
+            title = cached['title'] or 'Video'
+            if caption_template:
+                caption = caption_template.replace('{title}', title)
+            else:
+                caption = f"🎬 **{title}**\n\n📥 Downloaded by @{bot.me.username}\n💝 Made by {Config.DEVELOPER_NAME}"
+            
+            if await send_cached_video(client, target_chat, cached, caption):
+                await progress.finish("⚡ Video sent from cache!")
+                stats['total_videos'] += 1
+                metrics.VIDEOS.inc(source='cache')
+                return
+            
+            file_cache.invalidate(url)
+        
+        # Download video (single links skip ahead of queued batch downloads)
+        if not scheduler.has_capacity(user_id):
+            await progress.set("⏳ Waiting for a free download slot...")
         
-        # Download video
-        await status.edit_text("📥 Downloading video...")
-        video_path = await download_video(url, quality, status)
+        async with scheduler.slot(user_id, interactive=True):
+            await progress.set("📥 Downloading video...")
+            stream = new_stream(target_chat)
+            video_path = await download_video(url, quality, progress, stream)
         
         if not video_path:
-            await status.edit_text("❌ Failed to download video!")
+            await progress.finish("❌ Failed to download video!")
             return
         
         # Get video info
@@ -426,31 +924,38 @@ async def handle_direct_link(client: Client, message: Message):
             caption = f"🎬 **{title}**\n\n📥 Downloaded by @{bot.me.username}\n💝 Made by {Config.DEVELOPER_NAME}"
         
         # Upload video
-        await status.edit_text("📤 Uploading video...")
+        await progress.set("📤 Uploading video...")
         
-        target_chat = channel if channel else message.chat.id
-        
-        await client.send_video(
+        sent, session_name = await deliver_video(
+            client,
+            stream,
             chat_id=target_chat,
             video=video_path,
             caption=caption,
             thumb=thumbnail,
-            supports_streaming=True
+            supports_streaming=True,
+            progress=progress.upload_callback(title)
         )
+        remember_upload(sent, session_name, url, quality, title)
         
-        await status.edit_text("✅ Video uploaded successfully!")
+        await progress.finish("✅ Video uploaded successfully!")
         
-        # Cleanup
-        if os.path.exists(video_path):
-            os.remove(video_path)
+        # Cleanup (the whole job workspace)
+        cleanup_download(video_path)
+        video_path = None
         
         # Update stats
         stats['total_videos'] += 1
         stats['total_downloads'] += 1
+        metrics.VIDEOS.inc(source='direct')
+        await db.increment_downloads(user_id)
         
     except Exception as e:
         logger.error(f"Error handling direct link: {str(e)}")
-        await status.edit_text(f"❌ Error: {str(e)}")
+        await progress.finish(f"❌ Error: {str(e)}")
+        cleanup_download(video_path)
+        if stream is not None:
+            stream.abort()
 
 
 @bot.on_callback_query()
@@ -522,24 +1027,6 @@ async def callback_handler(client: Client, callback: CallbackQuery):
         await callback.answer(f"✅ Quality set to {quality}p", show_alert=True)
 
 
-async def upload_progress(current, total, message, title):
-    """Upload progress callback"""
-    try:
-        percentage = (current / total) * 100
-        bar_length = 20
-        filled = int(bar_length * current // total)
-        bar = '█' * filled + '░' * (bar_length - filled)
-        
-        await message.edit_text(
-            f"📤 **Uploading: {title}**\n\n"
-            f"Progress: {percentage:.1f}%\n"
-            f"{bar}\n"
-            f"📊 {current / (1024*1024):.1f} MB / {total / (1024*1024):.1f} MB"
-        )
-    except:
-        pass
-
-
 # Owner commands
 @bot.on_message(filters.command("broadcast") & filters.user(Config.OWNER_ID))
 async def broadcast_command(client: Client, message: Message):
@@ -549,30 +1036,189 @@ async def broadcast_command(client: Client, message: Message):
         return
     
     broadcast_msg = message.text.split(None, 1)[1]
-    users = db.get_all_users()
+    total = await db.get_total_users()
     
-    success = 0
-    failed = 0
+    status = await message.reply_text(f"📡 Broadcasting to {total} users...")
     
-    status = await message.reply_text(f"📡 Broadcasting to {len(users)} users...")
+    # Checkpointed in the job store so a restart resumes it
+    broadcast_id = job_store.create_broadcast(message.chat.id, broadcast_msg)
+    run_in_background(Broadcaster(client, db, job_store).run(broadcast_id, status))
+
+
+@bot.on_message(filters.command("uncache") & filters.user(Config.OWNER_ID))
+async def uncache_command(client: Client, message: Message):
+    """Invalidate cached file_ids (and extractor info)"""
+    if len(message.command) < 2:
+        await message.reply_text(
+            f"Usage: /uncache <url|all>\n\n📦 Cached videos: {file_cache.count()}\n"
+            f"🔎 Cached link info: {len(info_cache)}"
+        )
+        return
     
-    for user_id in users:
-        try:
-            await client.send_message(user_id, broadcast_msg)
-            success += 1
-        except:
-            failed += 1
+    arg = message.command[1]
+    removed = file_cache.invalidate(None if arg.lower() == "all" else arg)
+    info_cache.invalidate(None if arg.lower() == "all" else arg)
+    
+    await message.reply_text(f"🗑️ Removed {removed} cache entr{'y' if removed == 1 else 'ies'}")
+
+
+@bot.on_message(filters.command("jobs") & filters.user(Config.OWNER_ID))
+async def jobs_command(client: Client, message: Message):
+    """List recently failed batch jobs"""
+    failed = job_store.failed_jobs(limit=20)
+    
+    if not failed:
+        await message.reply_text("✅ No failed jobs!")
+        return
+    
+    lines = ["❌ **Failed Jobs**\n"]
+    for job in failed:
+        error = (job['error'] or 'Unknown error')[:60]
+        lines.append(f"`{job['id']}` • Batch {job['batch_id']} #{job['idx']} • {job['title'][:40]}\n   └ {error}")
+    
+    lines.append("\nUse `/retry <job_id>` or `/retry all`")
+    await message.reply_text("\n".join(lines))
+
+
+@bot.on_message(filters.command("retry") & filters.user(Config.OWNER_ID))
+async def retry_command(client: Client, message: Message):
+    """Re-queue failed batch jobs"""
+    if len(message.command) < 2:
+        await message.reply_text("Usage: /retry <job_id|all>")
+        return
+    
+    arg = message.command[1].lower()
+    
+    if arg == "all":
+        batch_ids = job_store.retry_jobs()
+    elif arg.isdigit():
+        batch_ids = job_store.retry_jobs(int(arg))
+    else:
+        await message.reply_text("Usage: /retry <job_id|all>")
+        return
+    
+    if not batch_ids:
+        await message.reply_text("⚠️ No matching failed jobs!")
+        return
+    
+    # Running batches pick re-queued jobs up on their own
+    for batch_id in batch_ids:
+        start_batch(client, batch_id)
+    
+    await message.reply_text(f"♻️ Re-queued failed jobs in {len(batch_ids)} batch(es)")
+
+
+@bot.on_message(filters.command("profile") & filters.user(Config.OWNER_ID))
+async def profile_command(client: Client, message: Message):
+    """Stage timing percentiles, or cProfile the next job"""
+    arg = message.command[1].lower() if len(message.command) > 1 else ""
+    
+    if arg == "next":
+        async def send_report(path: str):
+            try:
+                await client.send_document(Config.OWNER_ID, path, caption="🔬 cProfile of the profiled job")
+            except Exception as e:
+                logger.error(f"Error sending profile: {str(e)}")
         
-        await asyncio.sleep(0.5)
+        if tracing.arm_profile(send_report):
+            await message.reply_text("🔬 The next job will be profiled, the report is sent here when it finishes")
+        else:
+            await message.reply_text("⚠️ A profile is already armed or running!")
+        return
     
-    await status.edit_text(
-        f"✅ Broadcast Complete!\n\n"
-        f"Success: {success}\n"
-        f"Failed: {failed}"
+    if arg and not arg.isdigit():
+        await message.reply_text("Usage: /profile [jobs|next]")
+        return
+    
+    summary = await asyncio.get_running_loop().run_in_executor(
+        None, tracing.summarize, int(arg) if arg else None
     )
+    
+    if not summary['jobs']:
+        await message.reply_text("📭 No traces yet!" if Config.TRACE_ENABLED else "⚠️ Tracing is disabled (TRACE_ENABLED)")
+        return
+    
+    def describe(name, row):
+        return (f"`{name}` • {row['count']}× • p50 {row['p50']:.2f}s • "
+                f"p90 {row['p90']:.2f}s • p99 {row['p99']:.2f}s • Σ {row['total']:.0f}s")
+    
+    lines = [f"⏱️ **Stage Timings** (last {summary['jobs']} jobs)\n"]
+    for name, row in sorted(summary['stages'].items(), key=lambda item: -item[1]['total']):
+        lines.append(describe(name, row))
+    
+    if summary['hosts']:
+        lines.append("\n🌐 **Downloads by Host**\n")
+        hosts = sorted(summary['hosts'].items(), key=lambda item: -item[1]['total'])[:10]
+        for name, row in hosts:
+            lines.append(describe(name, row))
+    
+    lines.append("\nUse `/profile next` to cProfile the next job")
+    await message.reply_text("\n".join(lines))
+
+
+async def resume_batches(client: Client):
+    """Pick up batches that were interrupted by a restart"""
+    for batch in job_store.unfinished_batches():
+        if not batch['ingested']:
+            # The restart cut the file short and the file itself is gone: running
+            # what was queued would report the batch complete with links missing
+            failed = job_store.fail_pending(batch['id'], "Batch file was not fully read before a restart")
+            job_store.set_batch_status(batch['id'], jobs.BATCH_FINISHED)
+            logger.error(f"Batch {batch['id']} was interrupted while its file was read, failed {failed} job(s)")
+            
+            try:
+                await client.send_message(
+                    batch['chat_id'],
+                    f"❌ Bot restarted while reading your file, so only part of batch {batch['id']} "
+                    f"was queued. Please send the file again."
+                )
+            except Exception as e:
+                logger.warning(f"Could not notify chat {batch['chat_id']}: {str(e)}")
+            continue
+        
+        logger.info(f"Resuming batch {batch['id']}")
+        
+        try:
+            await client.send_message(batch['chat_id'], "♻️ Bot restarted, resuming your batch...")
+        except Exception as e:
+            logger.warning(f"Could not notify chat {batch['chat_id']}: {str(e)}")
+        
+        start_batch(client, batch['id'])
+
+
+async def resume_broadcasts(client: Client):
+    """Continue broadcasts that were interrupted by a restart"""
+    for broadcast in job_store.unfinished_broadcasts():
+        logger.info(f"Resuming broadcast {broadcast['id']} after user {broadcast['last_user_id']}")
+        
+        try:
+            status = await client.send_message(broadcast['chat_id'], "♻️ Bot restarted, resuming broadcast...")
+        except Exception as e:
+            logger.warning(f"Could not notify chat {broadcast['chat_id']}: {str(e)}")
+            status = None
+        
+        run_in_background(Broadcaster(client, db, job_store).run(broadcast['id'], status))
+
+
+async def main():
+    """Start the bot, resume unfinished work and run until stopped"""
+    # Workspaces left by a crash are useless: resumed jobs download again
+    cleanup_downloads()
+    await metrics_server.start()
+    await db.connect()
+    await bot.start()
+    await upload_pool.start()
+    await resume_batches(bot)
+    await resume_broadcasts(bot)
+    await idle()
+    await upload_pool.stop()
+    await bot.stop()
+    await hls.close_session()
+    await db.close()
+    await metrics_server.stop()
 
 
 # Start the bot
 if __name__ == "__main__":
     logger.info("🚀 Bot starting...")
-    bot.run()
+    bot.run(main())
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Broadcast engine
+Streams user IDs from the database and sends concurrently under a token bucket
+"""
+
+import time
+import asyncio
+import logging
+from typing import List
+from pyrogram import Client
+from pyrogram.errors import FloodWait, UserIsBlocked, InputUserDeactivated, PeerIdInvalid
+from config import Config
+from progress import ProgressReporter
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Users that can never receive messages again (pruned from the database)
+UNREACHABLE_ERRORS = (UserIsBlocked, InputUserDeactivated, PeerIdInvalid)
+
+
+class TokenBucket:
+    """
+    Async token bucket with a global pause for FloodWait
+    
+    A FloodWait on any request pauses every sender, since Telegram
+    applies the limit to the whole bot.
+    """
+    
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+    
+    def pause(self, seconds: float):
+        """Stop handing out tokens for a while"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.updated = self.paused_until
+    
+    async def acquire(self):
+        """Wait for one token"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                
+                elapsed = max(0.0, now - self.updated)
+                self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+                self.updated = now
+                
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Broadcaster:
+    """
+    Send one message to every user
+    
+    Users are processed in ascending ID order in chunks. After each chunk
+    the last user ID is checkpointed in the job store, so an interrupted
+    broadcast resumes where it stopped. Unreachable users are pruned in
+    batches.
+    """
+    
+    def __init__(self, client: Client, db, job_store):
+        self.client = client
+        self.db = db
+        self.job_store = job_store
+        self.bucket = TokenBucket(Config.BROADCAST_RATE)
+        self.concurrency = max(1, Config.BROADCAST_CONCURRENCY)
+        self.chunk_size = max(1, Config.BROADCAST_CHUNK_SIZE)
+        self.flood_waits = 0
+    
+    async def _send(self, user_id: int, text: str) -> str:
+        """Send to one user: 'sent', 'failed' or 'unreachable'"""
+        for _ in range(3):
+            await self.bucket.acquire()
+            
+            try:
+                await self.client.send_message(user_id, text)
+                return 'sent'
+            except FloodWait as e:
+                self.flood_waits += 1
+                metrics.record_flood_wait('broadcast', e.value)
+                logger.warning(f"Broadcast FloodWait: pausing {e.value}s")
+                self.bucket.pause(e.value)
+            except UNREACHABLE_ERRORS:
+                return 'unreachable'
+            except Exception as e:
+                logger.debug(f"Broadcast to {user_id} failed: {str(e)}")
+                return 'failed'
+        
+        return 'failed'
+    
+    async def _send_chunk(self, user_ids: List[int], text: str) -> List[str]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async def worker(user_id):
+            async with semaphore:
+                return await self._send(user_id, text)
+        
+        return await asyncio.gather(*(worker(user_id) for user_id in user_ids))
+    
+    async def run(self, broadcast_id: int, status=None) -> dict:
+        """
+        Run (or resume) a stored broadcast
+        
+        Args:
+            broadcast_id: ID from JobStore.create_broadcast
+            status: Optional Telegram message for progress updates
+        
+        Returns:
+            Final counters
+        """
+        broadcast = self.job_store.get_broadcast(broadcast_id)
+        text = broadcast['text']
+        counts = {key: broadcast[key] for key in ('sent', 'failed', 'pruned')}
+        total = await self.db.get_total_users()
+        progress = ProgressReporter.for_message(status) if status else None
+        started = time.monotonic()
+        already_done = sum(counts.values())
+        
+        chunk: List[int] = []
+        users = self.db.iter_user_ids(after=broadcast['last_user_id'])
+        
+        async def flush_chunk():
+            results = await self._send_chunk(chunk, text)
+            
+            unreachable = [uid for uid, result in zip(chunk, results) if result == 'unreachable']
+            counts['sent'] += results.count('sent')
+            counts['failed'] += results.count('failed')
+            counts['pruned'] += len(unreachable)
+            
+            if unreachable:
+                await self.db.delete_users(unreachable)
+            
+            self.job_store.checkpoint_broadcast(broadcast_id, chunk[-1], **counts)
+            
+            if progress:
+                done = counts['sent'] + counts['failed'] + counts['pruned']
+                rate = (done - already_done) / max(1e-6, time.monotonic() - started)
+                progress.update(
+                    f"📡 **Broadcasting...**\n\n"
+                    f"Progress: {done}/{total}\n"
+                    f"✅ Sent: {counts['sent']}\n"
+                    f"❌ Failed: {counts['failed']}\n"
+                    f"🗑️ Pruned: {counts['pruned']}\n"
+                    f"⚡ {rate:.1f} msg/s"
+                )
+        
+        try:
+            async for user_id in users:
+                chunk.append(user_id)
+                if len(chunk) >= self.chunk_size:
+                    await flush_chunk()
+                    chunk = []
+            
+            if chunk:
+                await flush_chunk()
+        except Exception as e:
+            # Left unfinished so it resumes from the last checkpoint on restart
+            logger.error(f"Broadcast {broadcast_id} interrupted: {str(e)}")
+            if progress:
+                await progress.finish(f"❌ Broadcast interrupted: {str(e)}\nIt will resume after a restart.")
+            return counts
+        
+        self.job_store.finish_broadcast(broadcast_id)
+        
+        if progress:
+            await progress.finish(
+                f"✅ Broadcast Complete!\n\n"
+                f"Success: {counts['sent']}\n"
+                f"Failed: {counts['failed']}\n"
+                f"Pruned (blocked/deleted): {counts['pruned']}"
+            )
+        
+        return counts
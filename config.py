@@ -21,14 +21,55 @@ class Config:
     # Authorized Users (comma-separated user IDs)
     AUTH_USERS: List[int] = [int(x) for x in os.environ.get("AUTH_USERS", "").split(",") if x.strip()]
     
+    # Extra upload sessions: more bot tokens (comma-separated) and/or a
+    # premium user session string; they must be able to post in the target chats
+    UPLOAD_BOT_TOKENS: List[str] = [x.strip() for x in os.environ.get("UPLOAD_BOT_TOKENS", "").split(",") if x.strip()]
+    UPLOAD_SESSION_STRING: str = os.environ.get("UPLOAD_SESSION_STRING", "")
+    
     # Bot Settings
     DEVELOPER_NAME: str = os.environ.get("DEVELOPER_NAME", "Your Name")
     SUPPORT_CONTACT: str = os.environ.get("SUPPORT_CONTACT", "@yourusername")
     
     # Download Settings
     DOWNLOAD_PATH: str = os.environ.get("DOWNLOAD_PATH", "./downloads/")
+    DATA_PATH: str = os.environ.get("DATA_PATH", "./data/")
     MAX_FILE_SIZE: int = int(os.environ.get("MAX_FILE_SIZE", "2147483648"))  # 2GB in bytes
     
+    # Splitting (larger videos are cut at keyframes into parts instead of stepping the quality down)
+    AUTO_SPLIT: bool = os.environ.get("AUTO_SPLIT", "True").lower() == "true"
+    SPLIT_PART_SIZE: int = int(os.environ.get("SPLIT_PART_SIZE", "0"))  # 0 = 95% of MAX_FILE_SIZE
+    SPLIT_CONCURRENCY: int = int(os.environ.get("SPLIT_CONCURRENCY", "2"))  # parts cut at once
+    
+    # Disk space admission (jobs reserve their estimated size before downloading)
+    DISK_RESERVE_FACTOR: float = float(os.environ.get("DISK_RESERVE_FACTOR", "2"))  # download + remuxed copy
+    DISK_UNKNOWN_SIZE: int = int(os.environ.get("DISK_UNKNOWN_SIZE", "536870912"))  # reserved when the size is unknown
+    DISK_FREE_MARGIN: int = int(os.environ.get("DISK_FREE_MARGIN", "209715200"))  # always left free
+    DISK_WAIT_TIMEOUT: int = int(os.environ.get("DISK_WAIT_TIMEOUT", "1800"))  # seconds a job waits for space
+    
+    # Transcoding (only used when the codecs can't be remuxed into MP4)
+    TRANSCODE_WORKERS: int = int(os.environ.get("TRANSCODE_WORKERS", str(os.cpu_count() or 1)))
+    TRANSCODE_PRESET: str = os.environ.get("TRANSCODE_PRESET", "veryfast")
+    
+    # aria2 RPC backend for direct file links (segmented, multi-connection)
+    ARIA2_ENABLED: bool = os.environ.get("ARIA2_ENABLED", "True").lower() == "true"
+    ARIA2_RPC_PORT: int = int(os.environ.get("ARIA2_RPC_PORT", "6800"))
+    ARIA2_RPC_SECRET: str = os.environ.get("ARIA2_RPC_SECRET", "")  # random per run if empty
+    ARIA2_CONNECTIONS: int = int(os.environ.get("ARIA2_CONNECTIONS", "16"))  # connections per file
+    ARIA2_MIN_SPLIT_SIZE: str = os.environ.get("ARIA2_MIN_SPLIT_SIZE", "4M")
+    
+    # Native HLS engine for M3U8 links (aiohttp, AES-128 aware)
+    HLS_NATIVE: bool = os.environ.get("HLS_NATIVE", "True").lower() == "true"
+    HLS_CONCURRENT_SEGMENTS: int = int(os.environ.get("HLS_CONCURRENT_SEGMENTS", "8"))  # segments in flight per download
+    HLS_CONNECTIONS_PER_HOST: int = int(os.environ.get("HLS_CONNECTIONS_PER_HOST", "8"))  # shared across all downloads
+    
+    # Streaming uploads (send parts to Telegram while the download runs)
+    STREAM_UPLOAD: bool = os.environ.get("STREAM_UPLOAD", "True").lower() == "true"
+    STREAM_UPLOAD_WORKERS: int = int(os.environ.get("STREAM_UPLOAD_WORKERS", "4"))  # parts in flight
+    
+    # Video metadata/thumbnails cache (keyed by file fingerprint)
+    METADATA_CACHE_PATH: str = os.environ.get("METADATA_CACHE_PATH", os.path.join(DATA_PATH, "thumbs"))
+    METADATA_CACHE_MAX_ENTRIES: int = int(os.environ.get("METADATA_CACHE_MAX_ENTRIES", "2000"))
+    
     # Video Quality Options
     QUALITY_OPTIONS = {
         "360": "bestvideo[height<=360]+bestaudio/best[height<=360]",
@@ -44,10 +85,59 @@ class Config:
     # Database (Optional - MongoDB)
     MONGODB_URI: str = os.environ.get("MONGODB_URI", "")
     DATABASE_NAME: str = os.environ.get("DATABASE_NAME", "video_bot")
+    DB_FLUSH_INTERVAL: float = float(os.environ.get("DB_FLUSH_INTERVAL", "2"))  # seconds between MongoDB bulk writes
+    DB_FLUSH_BATCH_SIZE: int = int(os.environ.get("DB_FLUSH_BATCH_SIZE", "500"))  # flush early at this many pending users
+    
+    # JSON database fallback (write-behind journal)
+    JSON_DB_FLUSH_INTERVAL: float = float(os.environ.get("JSON_DB_FLUSH_INTERVAL", "2"))  # seconds
+    JSON_DB_COMPACT_ENTRIES: int = int(os.environ.get("JSON_DB_COMPACT_ENTRIES", "10000"))
+    JSON_DB_COMPACT_INTERVAL: int = int(os.environ.get("JSON_DB_COMPACT_INTERVAL", "900"))  # seconds
+    
+    # Batch job store (SQLite, survives restarts)
+    JOBS_DB_PATH: str = os.environ.get("JOBS_DB_PATH", os.path.join(DATA_PATH, "jobs.db"))
+    
+    # Telegram file_id cache (re-send delivered videos without downloading)
+    FILE_CACHE_DB_PATH: str = os.environ.get("FILE_CACHE_DB_PATH", os.path.join(DATA_PATH, "file_cache.db"))
+    FILE_CACHE_MAX_ENTRIES: int = int(os.environ.get("FILE_CACHE_MAX_ENTRIES", "50000"))
+    FILE_CACHE_TTL_DAYS: int = int(os.environ.get("FILE_CACHE_TTL_DAYS", "180"))
+    
+    # Extractor info cache (yt-dlp metadata reused by pre-checks, retries and other users)
+    INFO_CACHE_ENTRIES: int = int(os.environ.get("INFO_CACHE_ENTRIES", "256"))  # kept in memory, 0 disables
+    INFO_CACHE_TTL: int = int(os.environ.get("INFO_CACHE_TTL", "21600"))  # seconds metadata is reused
+    INFO_CACHE_URL_TTL: int = int(os.environ.get("INFO_CACHE_URL_TTL", "1200"))  # seconds format URLs are trusted
+    INFO_CACHE_DISK: bool = os.environ.get("INFO_CACHE_DISK", "False").lower() == "true"  # survive restarts
+    INFO_CACHE_DB_PATH: str = os.environ.get("INFO_CACHE_DB_PATH", os.path.join(DATA_PATH, "info_cache.db"))
+    INFO_CACHE_DISK_MAX_ENTRIES: int = int(os.environ.get("INFO_CACHE_DISK_MAX_ENTRIES", "5000"))
     
     # Rate Limiting
-    MAX_CONCURRENT_DOWNLOADS: int = 3
+    MAX_CONCURRENT_DOWNLOADS: int = int(os.environ.get("MAX_CONCURRENT_DOWNLOADS", "3"))
     DELAY_BETWEEN_DOWNLOADS: int = 2  # seconds
+    PROGRESS_UPDATE_INTERVAL: float = float(os.environ.get("PROGRESS_UPDATE_INTERVAL", "5"))  # seconds between status edits
+    BROADCAST_RATE: float = float(os.environ.get("BROADCAST_RATE", "25"))  # messages per second (Telegram allows ~30)
+    BROADCAST_CONCURRENCY: int = int(os.environ.get("BROADCAST_CONCURRENCY", "20"))
+    BROADCAST_CHUNK_SIZE: int = int(os.environ.get("BROADCAST_CHUNK_SIZE", "500"))  # users per checkpoint
+    PIPELINE_PREFETCH: int = int(os.environ.get("PIPELINE_PREFETCH", "2"))  # Links downloaded ahead of the upload
+    
+    # Fair download scheduler (per-user queues, single links go first)
+    SCHEDULER_MAX_ACTIVE: int = int(os.environ.get("SCHEDULER_MAX_ACTIVE", "0"))  # 0 = MAX_CONCURRENT_DOWNLOADS
+    SCHEDULER_PER_USER: int = int(os.environ.get("SCHEDULER_PER_USER", "2"))  # downloads one user may run at once
+    SCHEDULER_OWNER_WEIGHT: int = int(os.environ.get("SCHEDULER_OWNER_WEIGHT", "4"))  # batch downloads per round
+    SCHEDULER_AUTH_WEIGHT: int = int(os.environ.get("SCHEDULER_AUTH_WEIGHT", "2"))  # other users get 1
+    
+    # Batch pre-validation (resolve every link of a file before downloading)
+    BATCH_PREVALIDATE: bool = os.environ.get("BATCH_PREVALIDATE", "False").lower() == "true"
+    PREVALIDATE_WORKERS: int = int(os.environ.get("PREVALIDATE_WORKERS", "8"))  # links resolved at once
+    PREVALIDATE_DROP_DEAD: bool = os.environ.get("PREVALIDATE_DROP_DEAD", "True").lower() == "true"
+    PREVALIDATE_DEFAULT_SPEED: int = int(os.environ.get("PREVALIDATE_DEFAULT_SPEED", "5242880"))  # bytes/s per download until one was measured
+    
+    # Metrics / health check HTTP server (the platform's web PORT, 0 disables)
+    PORT: int = int(os.environ.get("PORT", "8080"))
+    
+    # Per-job stage timing traces (JSONL, summarized by /profile)
+    TRACE_ENABLED: bool = os.environ.get("TRACE_ENABLED", "True").lower() == "true"
+    TRACE_PATH: str = os.environ.get("TRACE_PATH", os.path.join(DATA_PATH, "traces.jsonl"))
+    TRACE_MAX_BYTES: int = int(os.environ.get("TRACE_MAX_BYTES", "5242880"))  # rotated to .1 past this size
+    TRACE_SUMMARY_JOBS: int = int(os.environ.get("TRACE_SUMMARY_JOBS", "200"))  # jobs /profile looks at by default
     
     # Logging
     LOG_CHANNEL: int = int(os.environ.get("LOG_CHANNEL", "0"))  # Optional log channel ID
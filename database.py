@@ -2,19 +2,42 @@
 # -*- coding: utf-8 -*-
 """
 Database handler for user management
-Supports both MongoDB (cloud) and local JSON (fallback)
+Supports both MongoDB (cloud, async via motor) and local JSON (fallback)
+
+All public methods are coroutines. MongoDB hot-path writes (last_seen,
+download counters) are buffered and sent as periodic bulk_write batches.
+The JSON backend is write-behind: changes go to an append-only journal
+that a background thread flushes in batches and periodically compacts
+into the users_db.json snapshot.
 """
 
 import os
 import json
+import time
+import asyncio
+import atexit
 import logging
+import functools
+import threading
 from datetime import datetime
-from typing import List, Optional
+from typing import AsyncIterator, Dict, List, Optional
 from config import Config
+import metrics
 
 logger = logging.getLogger(__name__)
 
 
+def _timed(method):
+    """Record the latency of a Database call in the metrics"""
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        backend = 'mongodb' if self.use_mongodb else 'json'
+        with metrics.DB_SECONDS.time(backend=backend, op=method.__name__):
+            return await method(self, *args, **kwargs)
+    
+    return wrapper
+
+
 class Database:
     """Database handler with MongoDB and JSON fallback"""
     
@@ -23,20 +46,42 @@ class Database:
         self.db = None
         self.collection = None
         self.json_file = "users_db.json"
+        self.journal_file = "users_db.journal"
         self.users_data = {}
         
+        # JSON write-behind journal state
+        self._journal_lock = threading.Lock()
+        self._journal_buffer: List[str] = []
+        self._journal_handle = None
+        self._writer = None
+        
+        # MongoDB write buffer: user_id -> merged update document
+        self._pending: Dict[int, dict] = {}
+        self._flush_wakeup: Optional[asyncio.Event] = None
+        self._flush_task: Optional[asyncio.Task] = None
+    
+    async def connect(self):
+        """Connect to MongoDB, falling back to the JSON database"""
         # Try MongoDB first
         if Config.MONGODB_URI:
             try:
-                from pymongo import MongoClient
+                from motor.motor_asyncio import AsyncIOMotorClient
                 
-                client = MongoClient(Config.MONGODB_URI, serverSelectionTimeoutMS=5000)
-                client.server_info()  # Test connection
+                client = AsyncIOMotorClient(Config.MONGODB_URI, serverSelectionTimeoutMS=5000)
+                await client.server_info()  # Test connection
                 
                 self.db = client[Config.DATABASE_NAME]
                 self.collection = self.db['users']
                 self.use_mongodb = True
                 
+                try:
+                    await self.collection.create_index('user_id', unique=True)
+                except Exception as e:
+                    logger.warning(f"Could not create user_id index: {str(e)}")
+                
+                self._flush_wakeup = asyncio.Event()
+                self._flush_task = asyncio.create_task(self._flush_loop())
+                
                 logger.info("✅ Connected to MongoDB")
             except Exception as e:
                 logger.warning(f"MongoDB connection failed: {str(e)}")
@@ -46,48 +91,250 @@ class Database:
         if not self.use_mongodb:
             self._load_json_db()
     
+    # MongoDB write batching
+    
+    def _queue_update(self, user_id: int, set_fields: dict = None, set_on_insert: dict = None, inc: dict = None):
+        """Merge a write into the pending bulk batch for this user"""
+        update = self._pending.setdefault(user_id, {})
+        
+        if set_fields:
+            update.setdefault('$set', {}).update(set_fields)
+        if set_on_insert:
+            update.setdefault('$setOnInsert', {}).update(set_on_insert)
+        if inc:
+            increments = update.setdefault('$inc', {})
+            for key, value in inc.items():
+                increments[key] = increments.get(key, 0) + value
+        
+        if len(self._pending) >= Config.DB_FLUSH_BATCH_SIZE:
+            self._flush_wakeup.set()
+    
+    @_timed
+    async def flush(self):
+        """Send buffered writes to MongoDB as one unordered bulk_write"""
+        if not self.use_mongodb or not self._pending:
+            return
+        
+        from pymongo import UpdateOne
+        from pymongo.errors import BulkWriteError
+        
+        pending, self._pending = self._pending, {}
+        user_ids = list(pending)
+        operations = []
+        
+        for user_id in user_ids:
+            # Built from a copy: the queued update may have to be retried as it is
+            update = {operator: dict(fields) for operator, fields in pending[user_id].items()}
+            upsert = '$setOnInsert' in update
+            
+            # $inc and $setOnInsert can't both touch total_downloads
+            if upsert and '$inc' in update:
+                for key in update['$inc']:
+                    update['$setOnInsert'].pop(key, None)
+                if not update['$setOnInsert']:
+                    del update['$setOnInsert']
+            
+            operations.append(UpdateOne({'user_id': user_id}, update, upsert=upsert))
+        
+        try:
+            await self.collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Unordered: everything but the listed writes was applied
+            failed = {error['index'] for error in e.details.get('writeErrors', [])}
+            logger.error(f"Error flushing {len(failed)}/{len(operations)} user updates: {str(e)}")
+            self._requeue({user_ids[index]: pending[user_ids[index]] for index in failed})
+        except Exception as e:
+            # Unknown how much was applied: retry the fields, but never count a download twice
+            logger.error(f"Error flushing {len(operations)} user updates: {str(e)}")
+            retry = {}
+            for user_id, update in pending.items():
+                update = {operator: fields for operator, fields in update.items() if operator != '$inc'}
+                if update:
+                    retry[user_id] = update
+            self._requeue(retry)
+    
+    def _requeue(self, pending: Dict[int, dict]):
+        """
+        Put writes that failed to flush back in front of newer writes
+        
+        Increments add up, fields written since the failed flush win.
+        Only pass writes that are known not to have been applied.
+        """
+        for user_id, update in pending.items():
+            newer = self._pending.get(user_id)
+            if newer:
+                for operator, fields in newer.items():
+                    if operator == '$inc':
+                        increments = update.setdefault('$inc', {})
+                        for key, value in fields.items():
+                            increments[key] = increments.get(key, 0) + value
+                    else:
+                        update.setdefault(operator, {}).update(fields)
+            self._pending[user_id] = update
+    
+    async def _flush_loop(self):
+        """Flush the write buffer every interval, or early when it fills up"""
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_wakeup.wait(), Config.DB_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            
+            self._flush_wakeup.clear()
+            await self.flush()
+    
     def _load_json_db(self):
-        """Load users from JSON file"""
+        """Load users from the JSON snapshot and replay the journal on top"""
         try:
             if os.path.exists(self.json_file):
                 with open(self.json_file, 'r') as f:
                     self.users_data = json.load(f)
-                logger.info(f"Loaded {len(self.users_data)} users from JSON")
             else:
                 self.users_data = {}
         except Exception as e:
             logger.error(f"Error loading JSON database: {str(e)}")
             self.users_data = {}
+        
+        # A leftover rotated journal means we stopped mid-compaction
+        replayed = self._replay_journal(self.journal_file + ".compacting")
+        replayed += self._replay_journal(self.journal_file)
+        
+        logger.info(f"Loaded {len(self.users_data)} users from JSON ({replayed} journal entries replayed)")
+        
+        self._journal_handle = open(self.journal_file, 'a')
+        self._journal_entries = replayed
+        self._last_compaction = time.time()
+        
+        # Background writer: flushes the journal and compacts it
+        self._writer_stop = threading.Event()
+        self._writer = threading.Thread(target=self._writer_loop, name="json-db-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self._close_json)
+    
+    def _replay_journal(self, path: str) -> int:
+        """Apply journal entries (last write wins, so replay is idempotent)"""
+        if not os.path.exists(path):
+            return 0
+        
+        count = 0
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn last line from a crash
+                    continue
+                
+                if entry.get('d') is None:
+                    self.users_data.pop(entry['u'], None)
+                else:
+                    self.users_data[entry['u']] = entry['d']
+                count += 1
+        
+        return count
+    
+    def _save_json_db(self, user_id_str: str):
+        """Queue one user's record for the journal (O(1), no disk I/O)"""
+        entry = json.dumps({'u': user_id_str, 'd': self.users_data.get(user_id_str)})
+        
+        with self._journal_lock:
+            self._journal_buffer.append(entry)
+    
+    def _flush_journal(self):
+        """Append buffered records to the journal file"""
+        with self._journal_lock:
+            if not self._journal_buffer:
+                return
+            
+            lines, self._journal_buffer = self._journal_buffer, []
+            self._journal_handle.write("\n".join(lines) + "\n")
+            self._journal_handle.flush()
+            self._journal_entries += len(lines)
     
-    def _save_json_db(self):
-        """Save users to JSON file"""
+    def _compact(self):
+        """Write a fresh snapshot and drop the journal entries it covers"""
+        rotated = self.journal_file + ".compacting"
+        
+        with self._journal_lock:
+            # Everything up to now goes into the snapshot
+            lines, self._journal_buffer = self._journal_buffer, []
+            if lines:
+                self._journal_handle.write("\n".join(lines) + "\n")
+            self._journal_handle.close()
+            
+            snapshot = json.dumps(self.users_data, separators=(',', ':'))
+            
+            os.replace(self.journal_file, rotated)
+            self._journal_handle = open(self.journal_file, 'a')
+            self._journal_entries = 0
+            self._last_compaction = time.time()
+        
+        # Slow part runs without the lock
+        tmp_file = self.json_file + ".tmp"
+        with open(tmp_file, 'w') as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        
+        os.replace(tmp_file, self.json_file)
+        os.remove(rotated)
+        
+        logger.info(f"Compacted JSON database ({len(self.users_data)} users)")
+    
+    def _writer_loop(self):
+        """Flush the journal every few seconds, compact it now and then"""
+        while not self._writer_stop.wait(Config.JSON_DB_FLUSH_INTERVAL):
+            try:
+                self._flush_journal()
+                
+                if self._journal_entries >= Config.JSON_DB_COMPACT_ENTRIES or (
+                    self._journal_entries
+                    and time.time() - self._last_compaction >= Config.JSON_DB_COMPACT_INTERVAL
+                ):
+                    self._compact()
+            except Exception as e:
+                logger.error(f"Error writing JSON database: {str(e)}")
+    
+    def _close_json(self):
+        """Flush the JSON journal (also called automatically at exit)"""
+        if self._writer is None:
+            return
+        
+        self._writer_stop.set()
         try:
-            with open(self.json_file, 'w') as f:
-                json.dump(self.users_data, f, indent=2)
+            self._flush_journal()
         except Exception as e:
-            logger.error(f"Error saving JSON database: {str(e)}")
+            logger.error(f"Error flushing JSON database: {str(e)}")
     
-    def add_user(self, user_id: int, username: str = None) -> bool:
+    async def close(self):
+        """Flush pending writes"""
+        if self.use_mongodb:
+            if self._flush_task:
+                self._flush_task.cancel()
+                self._flush_task = None
+            await self.flush()
+        else:
+            self._close_json()
+    
+    @_timed
+    async def add_user(self, user_id: int, username: str = None) -> bool:
         """Add or update user"""
         try:
             user_id_str = str(user_id)
             
             if self.use_mongodb:
-                # MongoDB
-                self.collection.update_one(
-                    {'user_id': user_id},
-                    {
-                        '$set': {
-                            'user_id': user_id,
-                            'username': username,
-                            'last_seen': datetime.now(),
-                        },
-                        '$setOnInsert': {
-                            'joined_date': datetime.now(),
-                            'total_downloads': 0,
-                        }
+                # MongoDB (buffered)
+                self._queue_update(
+                    user_id,
+                    set_fields={
+                        'user_id': user_id,
+                        'username': username,
+                        'last_seen': datetime.now(),
                     },
-                    upsert=True
+                    set_on_insert={
+                        'joined_date': datetime.now(),
+                        'total_downloads': 0,
+                    }
                 )
             else:
                 # JSON
@@ -102,91 +349,137 @@ class Database:
                 self.users_data[user_id_str]['last_seen'] = datetime.now().isoformat()
                 self.users_data[user_id_str]['username'] = username
                 
-                self._save_json_db()
+                self._save_json_db(user_id_str)
             
             return True
         except Exception as e:
             logger.error(f"Error adding user: {str(e)}")
             return False
     
-    def get_user(self, user_id: int) -> Optional[dict]:
+    @_timed
+    async def get_user(self, user_id: int) -> Optional[dict]:
         """Get user data"""
         try:
             user_id_str = str(user_id)
             
             if self.use_mongodb:
-                return self.collection.find_one({'user_id': user_id})
+                # Make sure buffered writes for this user are visible
+                if user_id in self._pending:
+                    await self.flush()
+                return await self.collection.find_one({'user_id': user_id})
             else:
                 return self.users_data.get(user_id_str)
         except Exception as e:
             logger.error(f"Error getting user: {str(e)}")
             return None
     
-    def get_all_users(self) -> List[int]:
+    async def get_all_users(self) -> List[int]:
         """Get all user IDs"""
         try:
-            if self.use_mongodb:
-                users = self.collection.find({}, {'user_id': 1})
-                return [user['user_id'] for user in users]
-            else:
-                return [int(uid) for uid in self.users_data.keys()]
+            return [user_id async for user_id in self.iter_user_ids()]
         except Exception as e:
             logger.error(f"Error getting all users: {str(e)}")
             return []
     
-    def get_total_users(self) -> int:
+    async def iter_user_ids(self, after: int = None, batch_size: int = 1000) -> AsyncIterator[int]:
+        """
+        Stream user IDs in ascending order without loading them all
+        
+        Args:
+            after: Only yield IDs greater than this (for resuming)
+            batch_size: Cursor batch size
+        
+        Raises:
+            Exception: The cursor failed; callers must not take a partial walk
+            for a complete one
+        """
+        if self.use_mongodb:
+            query = {'user_id': {'$gt': after}} if after is not None else {}
+            cursor = self.collection.find(query, {'user_id': 1, '_id': 0}).sort('user_id', 1).batch_size(batch_size)
+            async for user in cursor:
+                yield user['user_id']
+        else:
+            for user_id in sorted(int(uid) for uid in list(self.users_data.keys())):
+                if after is None or user_id > after:
+                    yield user_id
+    
+    @_timed
+    async def get_total_users(self) -> int:
         """Get total user count"""
         try:
             if self.use_mongodb:
-                return self.collection.count_documents({})
+                return await self.collection.estimated_document_count()
             else:
                 return len(self.users_data)
         except Exception as e:
             logger.error(f"Error getting total users: {str(e)}")
             return 0
     
-    def increment_downloads(self, user_id: int) -> bool:
+    @_timed
+    async def increment_downloads(self, user_id: int) -> bool:
         """Increment user download count"""
         try:
             user_id_str = str(user_id)
             
             if self.use_mongodb:
-                self.collection.update_one(
-                    {'user_id': user_id},
-                    {'$inc': {'total_downloads': 1}}
-                )
+                self._queue_update(user_id, inc={'total_downloads': 1})
             else:
                 if user_id_str in self.users_data:
                     self.users_data[user_id_str]['total_downloads'] = \
                         self.users_data[user_id_str].get('total_downloads', 0) + 1
-                    self._save_json_db()
+                    self._save_json_db(user_id_str)
             
             return True
         except Exception as e:
             logger.error(f"Error incrementing downloads: {str(e)}")
             return False
     
-    def delete_user(self, user_id: int) -> bool:
+    @_timed
+    async def delete_user(self, user_id: int) -> bool:
         """Delete user"""
         try:
             user_id_str = str(user_id)
             
             if self.use_mongodb:
-                self.collection.delete_one({'user_id': user_id})
+                self._pending.pop(user_id, None)
+                await self.collection.delete_one({'user_id': user_id})
             else:
                 if user_id_str in self.users_data:
                     del self.users_data[user_id_str]
-                    self._save_json_db()
+                    self._save_json_db(user_id_str)
             
             return True
         except Exception as e:
             logger.error(f"Error deleting user: {str(e)}")
             return False
     
-    def get_user_stats(self, user_id: int) -> dict:
+    @_timed
+    async def delete_users(self, user_ids: List[int]) -> int:
+        """Delete many users at once (e.g. users who blocked the bot)"""
+        try:
+            if self.use_mongodb:
+                for user_id in user_ids:
+                    self._pending.pop(user_id, None)
+                result = await self.collection.delete_many({'user_id': {'$in': list(user_ids)}})
+                return result.deleted_count
+            else:
+                deleted = 0
+                for user_id in user_ids:
+                    user_id_str = str(user_id)
+                    if user_id_str in self.users_data:
+                        del self.users_data[user_id_str]
+                        self._save_json_db(user_id_str)
+                        deleted += 1
+                return deleted
+        except Exception as e:
+            logger.error(f"Error deleting users: {str(e)}")
+            return 0
+    
+    @_timed
+    async def get_user_stats(self, user_id: int) -> dict:
         """Get user statistics"""
         try:
-            user = self.get_user(user_id)
+            user = await self.get_user(user_id)
             
             if user:
                 return {
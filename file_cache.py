@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Telegram file_id cache
+Lets already-delivered videos be re-sent without downloading or uploading
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Query parameters that never change which video a URL points to
+TRACKING_PARAMS = {'fbclid', 'gclid', 'igshid', 'si', 'feature', 'ref', 'ref_src'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_ids (
+    url TEXT NOT NULL,
+    quality TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    title TEXT,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    client TEXT NOT NULL DEFAULT 'main',
+    PRIMARY KEY (url, quality)
+);
+CREATE INDEX IF NOT EXISTS file_ids_last_used ON file_ids(last_used);
+"""
+
+
+def canonical_url(url: str) -> str:
+    """
+    Normalize a URL so the same video always maps to the same key
+    
+    Lowercases scheme/host, drops fragments, default ports and tracking
+    parameters, sorts the query and folds youtu.be links into youtube.com.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    
+    if host.startswith('www.'):
+        host = host[4:]
+    if host == 'm.youtube.com':
+        host = 'youtube.com'
+    
+    port = parts.port
+    netloc = host if port in (None, 80, 443) else f"{host}:{port}"
+    
+    path = parts.path or '/'
+    query = [
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key not in TRACKING_PARAMS and not key.startswith('utm_')
+    ]
+    
+    # youtu.be/<id> -> youtube.com/watch?v=<id>
+    if host == 'youtu.be' and len(path) > 1:
+        query.append(('v', path.lstrip('/')))
+        netloc, path = 'youtube.com', '/watch'
+    
+    return urlunsplit((scheme, netloc, path, urlencode(sorted(query)), ''))
+
+
+class FileIdCache:
+    """SQLite cache of Telegram file_ids keyed by canonical URL + quality"""
+    
+    def __init__(self, path: str = None):
+        self.path = path or Config.FILE_CACHE_DB_PATH
+        self.max_entries = Config.FILE_CACHE_MAX_ENTRIES
+        self.ttl = Config.FILE_CACHE_TTL_DAYS * 86400
+        
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+    
+    def _migrate(self):
+        """Add columns missing from caches created by older versions"""
+        columns = {row['name'] for row in self.conn.execute("PRAGMA table_info(file_ids)")}
+        
+        # file_ids belong to the session that uploaded them
+        if 'client' not in columns:
+            self.conn.execute("ALTER TABLE file_ids ADD COLUMN client TEXT NOT NULL DEFAULT 'main'")
+    
+    def get(self, url: str, quality: str) -> Optional[Dict]:
+        """Look up a cached upload (None on miss or expired entry)"""
+        key = canonical_url(url)
+        now = time.time()
+        
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT * FROM file_ids WHERE url = ? AND quality = ?",
+                (key, quality)
+            ).fetchone()
+            
+            if row is None:
+                return None
+            
+            if self.ttl and now - row['created_at'] > self.ttl:
+                self.conn.execute("DELETE FROM file_ids WHERE url = ? AND quality = ?", (key, quality))
+                return None
+            
+            self.conn.execute(
+                "UPDATE file_ids SET last_used = ?, hits = hits + 1 WHERE url = ? AND quality = ?",
+                (now, key, quality)
+            )
+            return dict(row)
+    
+    def put(self, url: str, quality: str, file_id: str, title: str = None, client: str = "main"):
+        """Remember the file_id of a delivered video and the upload session it belongs to"""
+        key = canonical_url(url)
+        now = time.time()
+        
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO file_ids (url, quality, file_id, title, created_at, last_used, client) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, quality, file_id, title, now, now, client)
+            )
+            self._evict()
+    
+    def _evict(self):
+        """Drop least recently used entries above the size limit"""
+        count = self.conn.execute("SELECT COUNT(*) FROM file_ids").fetchone()[0]
+        excess = count - self.max_entries
+        
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM file_ids WHERE rowid IN "
+                "(SELECT rowid FROM file_ids ORDER BY last_used LIMIT ?)",
+                (excess,)
+            )
+    
+    def invalidate(self, url: str = None) -> int:
+        """
+        Remove cached entries
+        
+        Args:
+            url: Remove all qualities of this URL, or everything if None
+        
+        Returns:
+            Number of entries removed
+        """
+        with self._lock:
+            if url is None:
+                cursor = self.conn.execute("DELETE FROM file_ids")
+            else:
+                cursor = self.conn.execute("DELETE FROM file_ids WHERE url = ?", (canonical_url(url),))
+            return cursor.rowcount
+    
+    def count(self) -> int:
+        """Number of cached entries"""
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM file_ids").fetchone()[0]
@@ -6,18 +6,150 @@ Helper functions for video downloading and processing
 
 import os
 import re
+import time
 import asyncio
 import logging
-from typing import List, Dict, Optional
+import shutil
+import tempfile
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
 from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadError
 from config import Config
+from progress import ProgressReporter
+from media import ensure_mp4
+from preflight import FileTooLarge, NotEnoughDiskSpace, disk_reservations, estimate_size, fit_quality, format_size
+from info_cache import info_cache
+import aria2
+import hls
+import metrics
+import tracing
 
 logger = logging.getLogger(__name__)
 
+# Per-job download directories inside Config.DOWNLOAD_PATH
+WORKSPACE_PREFIX = "job_"
+TRASH_SUFFIX = ".trash"
 
-def extract_links_from_txt(file_path: str) -> List[Dict[str, str]]:
+# Headers for encrypted streams (Classplus, etc.)
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': '*/*',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Referer': 'https://web.classplusapp.com/',
+    'Origin': 'https://web.classplusapp.com',
+}
+
+# yt-dlp errors that mean the link will never work (anything else may pass on a retry)
+_DEAD_LINK_RE = re.compile(
+    r'unavailable|not available|private|members[- ]only|drm|removed|deleted|terminated|'
+    r'does not exist|unsupported url|HTTP Error (?:404|410)',
+    re.IGNORECASE
+)
+
+# Pause before a link check that failed for another reason is tried again
+LINK_CHECK_RETRY_DELAY = 3
+
+
+class LinkCheckFailed(Exception):
+    """A link could not be checked right now (timeout, rate limit, extractor hiccup)"""
+    pass
+
+
+# Worker pools for blocking yt-dlp jobs (created lazily)
+_download_executor: Optional[ThreadPoolExecutor] = None
+_info_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_download_executor() -> ThreadPoolExecutor:
     """
-    Extract video links from text file
+    Get the shared download worker pool
+    
+    yt-dlp is fully blocking, so every download runs in one of these
+    threads while the event loop keeps serving other users.
+    The pool size is Config.MAX_CONCURRENT_DOWNLOADS.
+    """
+    global _download_executor
+    
+    if _download_executor is None:
+        _download_executor = ThreadPoolExecutor(
+            max_workers=max(1, Config.MAX_CONCURRENT_DOWNLOADS),
+            thread_name_prefix="download"
+        )
+    
+    return _download_executor
+
+
+def get_info_executor() -> ThreadPoolExecutor:
+    """
+    Get the worker pool for metadata lookups
+    
+    Kept apart from the download pool so validating a batch never takes
+    a download slot. The pool size is Config.PREVALIDATE_WORKERS.
+    """
+    global _info_executor
+    
+    if _info_executor is None:
+        _info_executor = ThreadPoolExecutor(
+            max_workers=max(1, Config.PREVALIDATE_WORKERS),
+            thread_name_prefix="info"
+        )
+    
+    return _info_executor
+
+
+# Precompiled patterns for the link parser
+_TITLE_LINE_RE = re.compile(r'^title\s*:\s*(.*)$', re.IGNORECASE)
+_ANY_URL_RE = re.compile(r'https?://[^\s]+')
+_URL_PREFIXES = ('http://', 'https://')
+
+# Lines inspected to detect the file format
+FORMAT_DETECT_LINES = 50
+
+
+def _split_title_url(line: str):
+    """Split a "Title:URL" / "Title: URL" line, or return None"""
+    pos = line.find('http')
+    if pos <= 0 or not line.startswith(_URL_PREFIXES, pos):
+        return None
+    
+    title = line[:pos].rstrip()
+    if not title.endswith(':'):
+        return None
+    
+    return title[:-1].strip(), line[pos:].strip()
+
+
+def _detect_link_format(lines: List[str]) -> str:
+    """
+    Guess the .txt format from its first lines
+    
+    Returns:
+        'block' - URL line followed by a "Title: ..." line
+        'line'  - one link per line (Title:URL or bare URL)
+        'regex' - URLs embedded in free text
+    """
+    has_links = False
+    
+    for line in lines:
+        if not line or line.startswith('#'):
+            continue
+        
+        if line.startswith(_URL_PREFIXES) or _split_title_url(line):
+            has_links = True
+        elif _TITLE_LINE_RE.match(line):
+            return 'block'
+    
+    return 'line' if has_links else 'regex'
+
+
+def iter_links_from_txt(file_path: str) -> Iterator[Dict[str, str]]:
+    """
+    Stream video links from a text file in a single pass
+    
+    Reads line by line (bounded memory), detects the format from the
+    first lines and yields links as soon as they are parsed.
     
     Supported formats:
     1. Title:URL (Classplus format)
@@ -25,88 +157,77 @@ def extract_links_from_txt(file_path: str) -> List[Dict[str, str]]:
     3. https://youtube.com/watch?v=xxxxx
        Title: My Video Title
     4. Just URLs
+    5. URLs anywhere in free text
     """
-    links = []
+    count = 0
     
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+    def make_link(url: str, title: Optional[str]) -> Dict[str, str]:
+        return {'url': url, 'title': title or f'Video_{count + 1}'}
+    
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        # Sniff the first lines, then continue with the rest of the file
+        head = [line.strip() for line in itertools.islice(f, FORMAT_DETECT_LINES)]
+        mode = _detect_link_format(head)
+        lines = itertools.chain(head, (line.strip() for line in f))
         
-        # Split by lines
-        lines = content.strip().split('\n')
+        # Block format: a URL waits for its title on the following lines
+        pending_url = None
+        pending_title = None
         
         for line in lines:
-            line = line.strip()
-            
             if not line or line.startswith('#'):
                 continue
             
-            # Format 1: Title:URL (Classplus style)
-            if ':https://' in line or ':http://' in line:
-                parts = line.split(':', 1)
-                if len(parts) == 2 and parts[1].startswith('http'):
-                    # Find the actual URL part
-                    url_start = line.find('http')
-                    title = line[:url_start-1].strip()
-                    url = line[url_start:].strip()
-                    
-                    links.append({
-                        'url': url,
-                        'title': title or f'Video_{len(links) + 1}'
-                    })
-                    continue
+            if mode == 'regex':
+                for url in _ANY_URL_RE.findall(line):
+                    yield make_link(url, None)
+                    count += 1
+                continue
             
-            # Format 2: Just URL
-            if line.startswith('http://') or line.startswith('https://'):
-                links.append({
-                    'url': line,
-                    'title': f'Video_{len(links) + 1}'
-                })
-        
-        # Fallback: Extract all URLs if no links found
-        if not links:
-            current_url = None
-            current_title = None
+            # Bare URL
+            if line.startswith(_URL_PREFIXES):
+                if mode == 'block':
+                    if pending_url:
+                        yield make_link(pending_url, pending_title)
+                        count += 1
+                    pending_url, pending_title = line, None
+                else:
+                    yield make_link(line, None)
+                    count += 1
+                continue
             
-            for line in lines:
-                line = line.strip()
+            # Title:URL on one line
+            title_url = _split_title_url(line)
+            if title_url:
+                if pending_url:
+                    yield make_link(pending_url, pending_title)
+                    count += 1
+                    pending_url, pending_title = None, None
                 
-                # Check if line is a URL
-                if re.match(r'https?://', line):
-                    # Save previous entry if exists
-                    if current_url:
-                        links.append({
-                            'url': current_url,
-                            'title': current_title or f'Video_{len(links) + 1}'
-                        })
-                    
-                    current_url = line
-                    current_title = None
-                
-                # Check if line is a title
-                elif line.lower().startswith('title:'):
-                    current_title = line.split(':', 1)[1].strip()
-                
-                # If line contains both URL and might be title on same line
-                elif current_url and line and not line.startswith('#'):
-                    if not current_title:
-                        current_title = line
+                yield make_link(title_url[1], title_url[0])
+                count += 1
+                continue
             
-            # Add last entry
-            if current_url:
-                links.append({
-                    'url': current_url,
-                    'title': current_title or f'Video_{len(links) + 1}'
-                })
-        
-        # Final fallback: regex extraction
-        if not links:
-            urls = re.findall(r'https?://[^\s]+', content)
-            links = [{'url': url, 'title': f'Video_{i+1}'} for i, url in enumerate(urls)]
+            # Title line belonging to the previous URL
+            if mode == 'block' and pending_url and not pending_title:
+                match = _TITLE_LINE_RE.match(line)
+                pending_title = (match.group(1) if match else line).strip()
         
+        if pending_url:
+            yield make_link(pending_url, pending_title)
+            count += 1
+
+
+def extract_links_from_txt(file_path: str) -> List[Dict[str, str]]:
+    """
+    Extract video links from text file
+    
+    See iter_links_from_txt for the supported formats.
+    """
+    try:
+        links = list(iter_links_from_txt(file_path))
         logger.info(f"Extracted {len(links)} links from {file_path}")
         return links
-        
     except Exception as e:
         logger.error(f"Error extracting links: {str(e)}")
         return []
@@ -122,30 +243,263 @@ def sanitize_filename(filename: str) -> str:
     return filename
 
 
-async def download_video(url: str, quality: str = "720", progress_message=None) -> Optional[str]:
+def create_workspace() -> str:
+    """Create a private temp directory for one download job"""
+    os.makedirs(Config.DOWNLOAD_PATH, exist_ok=True)
+    return tempfile.mkdtemp(prefix=WORKSPACE_PREFIX, dir=Config.DOWNLOAD_PATH)
+
+
+def _workspace_of(file_path: str) -> Optional[str]:
+    """Job workspace a downloaded file lives in (None if it isn't in one)"""
+    parent = os.path.dirname(os.path.abspath(file_path))
+    
+    if (os.path.basename(parent).startswith(WORKSPACE_PREFIX)
+            and os.path.dirname(parent) == os.path.abspath(Config.DOWNLOAD_PATH)):
+        return parent
+    
+    return None
+
+
+def remove_workspace(workspace: str):
+    """Delete a job workspace (rename first so it vanishes atomically)"""
+    if not workspace:
+        return
+    
+    disk_reservations.release(workspace)
+    if not os.path.isdir(workspace):
+        return
+    
+    trash = workspace + TRASH_SUFFIX
+    try:
+        os.rename(workspace, trash)
+    except OSError:
+        trash = workspace
+    
+    shutil.rmtree(trash, ignore_errors=True)
+
+
+def cleanup_download(file_path: str):
+    """Remove a downloaded video together with its job workspace"""
+    if not file_path:
+        return
+    
+    workspace = _workspace_of(file_path)
+    if workspace:
+        remove_workspace(workspace)
+    elif os.path.exists(file_path):
+        os.remove(file_path)
+
+
+def _extract_info(ydl: YoutubeDL, url: str, fresh_urls: bool = True) -> Optional[Dict]:
     """
-    Download video using yt-dlp
+    extract_info(download=False) through the info cache
+    
+    The cache holds the raw extractor result (no format selection), so
+    every caller selects formats for its own quality with this ydl's
+    options, which needs no request to the site.
+    
+    Args:
+        fresh_urls: The info is used to download (see InfoCache.get)
+    """
+    info = info_cache.get(url, fresh_urls)
+    if info is None:
+        info = ydl.extract_info(url, download=False, process=False)
+        if not info:
+            return None
+        info_cache.put(url, info)
+    
+    return ydl.process_ie_result(info, download=False)
+
+
+def _preflight(url: str, ydl_opts: Dict, quality: str) -> Tuple[Optional[Dict], str, Optional[int]]:
+    """
+    Extract the info dict and step the quality down until it fits (blocking)
+    
+    Returns:
+        (info dict or None, quality to download, estimated size or None)
+    """
+    with YoutubeDL(ydl_opts) as ydl:
+        with tracing.span('extract', backend='ytdlp'):
+            info = _extract_info(ydl, url)
+        
+        if not info:
+            return None, quality, None
+        
+        with tracing.span('preflight') as fields:
+            info, quality, size = fit_quality(ydl, info, quality)
+            fields.update(quality=quality, size=size)
+    
+    return info, quality, size
+
+
+def _run_download(url: str, ydl_opts: Dict, workspace: str, info: Dict) -> Optional[str]:
+    """
+    Blocking part of download_video, runs inside the download worker pool
+    
+    Args:
+        info: Info dict from _preflight (formats are selected again with ydl_opts)
+    
+    Returns:
+        Path of the downloaded file as reported by yt-dlp, or None
+    """
+    with YoutubeDL(ydl_opts) as ydl:
+        with tracing.span('download', backend='ytdlp'):
+            info = ydl.process_ie_result(info, download=True)
+        
+        # Final path after merging/post-processing, as yt-dlp reports it
+        for download in info.get('requested_downloads') or [info]:
+            file_path = download.get('filepath') or download.get('_filename')
+            if file_path and os.path.exists(file_path):
+                return file_path
+    
+    # Fallback: the largest finished file in the job's own workspace
+    candidates = [
+        os.path.join(workspace, name) for name in os.listdir(workspace)
+        if not name.endswith(('.part', '.ytdl', '.temp'))
+    ]
+    return max(candidates, key=os.path.getsize) if candidates else None
+
+
+def _run_aria2(url: str, ydl_opts: Dict, workspace: str, quality: str, stream=None) -> Optional[str]:
+    """Blocking aria2 download with the same options/hooks as yt-dlp"""
+    hooks = ydl_opts.get('progress_hooks') or [None]
+    return aria2.download(url, workspace, headers=ydl_opts.get('http_headers'), progress_hook=hooks[0])
+
+
+async def _run_hls(url: str, ydl_opts: Dict, workspace: str, quality: str, stream=None) -> Optional[str]:
+    """Native HLS download with the same options/hooks as yt-dlp"""
+    hooks = ydl_opts.get('progress_hooks') or [None]
+    return await hls.download(
+        url, workspace, quality,
+        headers=ydl_opts.get('http_headers'), progress_hook=hooks[0], stream=stream
+    )
+
+
+# Pluggable downloader backends, tried in order: (name, accepts(url), runner).
+# Runners may be coroutines (run on the loop) or blocking (run in the
+# download pool); the ones that write the final file sequentially may
+# feed a StreamingUpload. Anything no backend accepts, or that a backend
+# fails on, goes to yt-dlp.
+DOWNLOAD_BACKENDS = [
+    ('aria2', aria2.accepts, _run_aria2),
+    ('hls', hls.accepts, _run_hls),
+]
+
+
+def _record_download(backend: str, started: float, file_path: Optional[str]):
+    """Download metrics for one finished backend run"""
+    result = 'ok' if file_path else 'failed'
+    metrics.DOWNLOAD_SECONDS.observe(time.perf_counter() - started, backend=backend, result=result)
+    if file_path and os.path.exists(file_path):
+        metrics.BYTES_DOWNLOADED.inc(os.path.getsize(file_path), backend=backend)
+
+
+async def _download(url: str, ydl_opts: Dict, workspace: str, quality: str, stream=None,
+                    reporter: ProgressReporter = None) -> Optional[str]:
+    """
+    Run the first matching backend, falling back to yt-dlp
+    
+    Disk space is reserved in the workspace's name before the transfer
+    starts: a flat guess for the backends, which reserve the real size and
+    check the limit once they know it, and the estimate for yt-dlp.
+    """
+    for name, accepts, runner in DOWNLOAD_BACKENDS:
+        if not accepts(url):
+            continue
+        
+        await disk_reservations.reserve(workspace, None)
+        started = time.perf_counter()
+        try:
+            with tracing.span('download', backend=name):
+                if asyncio.iscoroutinefunction(runner):
+                    file_path = await runner(url, ydl_opts, workspace, quality, stream)
+                else:
+                    file_path = await tracing.run_in_executor(
+                        get_download_executor(), runner, url, ydl_opts, workspace, quality
+                    )
+            
+            if file_path:
+                _record_download(name, started, file_path)
+                return file_path
+        except FileTooLarge:
+            # yt-dlp would fetch the same file
+            metrics.DOWNLOAD_SECONDS.observe(time.perf_counter() - started, backend=name, result='too_large')
+            raise
+        except NotEnoughDiskSpace:
+            metrics.DOWNLOAD_SECONDS.observe(time.perf_counter() - started, backend=name, result='no_space')
+            raise
+        except Exception as e:
+            metrics.DOWNLOAD_SECONDS.observe(time.perf_counter() - started, backend=name, result='fallback')
+            logger.warning(f"{runner.__name__} failed for {url}, using yt-dlp: {str(e)}")
+            if stream is not None:
+                stream.abort()
+            # Start yt-dlp from an empty workspace (backends may leave directories)
+            shutil.rmtree(workspace, ignore_errors=True)
+            os.makedirs(workspace, exist_ok=True)
+        break
+    
+    started = time.perf_counter()
+    file_path = None
+    try:
+        info, fitted, size = await tracing.run_in_executor(
+            get_download_executor(), _preflight, url, ydl_opts, quality
+        )
+        if not info:
+            return None
+        
+        if fitted != quality:
+            metrics.QUALITY_STEPDOWNS.inc()
+            if reporter:
+                await reporter.set(f"📉 Too large at {quality}p, downloading {fitted}p ({format_size(size)})...")
+            ydl_opts = {**ydl_opts, 'format': Config.QUALITY_OPTIONS[fitted]}
+        
+        await disk_reservations.reserve(workspace, size)
+        file_path = await tracing.run_in_executor(
+            get_download_executor(), _run_download, url, ydl_opts, workspace, info
+        )
+        return file_path
+    except FileTooLarge:
+        raise
+    except Exception:
+        # The cached format URLs may have stopped working, extract again next time
+        info_cache.invalidate(url)
+        raise
+    finally:
+        _record_download('ytdlp', started, file_path)
+
+
+async def download_video(url: str, quality: str = "720", progress_message=None, stream=None) -> Optional[str]:
+    """
+    Download video using yt-dlp (direct files go through aria2, M3U8 through the native HLS engine)
     Supports M3U8/HLS streams including Classplus encrypted links
     
     Args:
         url: Video URL
         quality: Video quality (360/480/720/1080)
-        progress_message: Telegram message for progress updates
+        progress_message: Telegram message (or ProgressReporter) for progress updates
+        stream: Optional uploader.StreamingUpload that uploads while downloading
     
     Returns:
         Path to downloaded video file or None if failed
     """
+    workspace = None
+    metrics.ACTIVE_DOWNLOADS.inc()
+    
     try:
         # Prepare download options
         quality_format = Config.QUALITY_OPTIONS.get(quality, Config.QUALITY_OPTIONS["720"])
         
-        # Output template
-        output_template = os.path.join(Config.DOWNLOAD_PATH, '%(title)s.%(ext)s')
+        # Every job gets its own workspace, so equal titles can't collide
+        workspace = create_workspace()
+        output_template = os.path.join(workspace, '%(title).150B.%(ext)s')
         
         ydl_opts = {
             'format': quality_format,
             'outtmpl': output_template,
-            'merge_output_format': 'mp4',
+            'merge_output_format': 'mp4/mkv',
+            
+            # Among equal resolutions prefer codecs that fit MP4 without re-encoding
+            'format_sort': ['res', 'vcodec:h264', 'acodec:aac'],
             'quiet': True,
             'no_warnings': True,
             
@@ -168,20 +522,8 @@ async def download_video(url: str, quality: str = "720", progress_message=None)
                 '-protocol_whitelist', 'file,http,https,tcp,tls,crypto'
             ],
             
-            # Post-processing
-            'postprocessors': [{
-                'key': 'FFmpegVideoConvertor',
-                'preferedformat': 'mp4',
-            }],
-            
             # Headers for encrypted streams (Classplus, etc.)
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                'Accept': '*/*',
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Referer': 'https://web.classplusapp.com/',
-                'Origin': 'https://web.classplusapp.com',
-            },
+            'http_headers': dict(HTTP_HEADERS),
             
             # Allow extraction from encrypted platforms
             'nocheckcertificate': True,
@@ -189,109 +531,118 @@ async def download_video(url: str, quality: str = "720", progress_message=None)
             'ignoreerrors': False,
         }
         
-        # Add progress hook
-        if progress_message:
-            def progress_hook(d):
-                if d['status'] == 'downloading':
-                    try:
-                        percentage = d.get('_percent_str', '0%')
-                        speed = d.get('_speed_str', 'N/A')
-                        eta = d.get('_eta_str', 'N/A')
-                        
-                        asyncio.create_task(
-                            progress_message.edit_text(
-                                f"📥 **Downloading...**\n\n"
-                                f"Progress: {percentage}\n"
-                                f"Speed: {speed}\n"
-                                f"ETA: {eta}"
-                            )
-                        )
-                    except:
-                        pass
-            
-            ydl_opts['progress_hooks'] = [progress_hook]
+        # Add progress hook (the reporter is thread-safe and rate-limited)
+        reporter = ProgressReporter.for_message(progress_message) if progress_message else None
+        if reporter:
+            ydl_opts['progress_hooks'] = [reporter.download_hook()]
         
-        # Download video
-        with YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            
-            # Get downloaded file path
-            if info:
-                title = sanitize_filename(info.get('title', 'video'))
-                file_path = os.path.join(Config.DOWNLOAD_PATH, f"{title}.mp4")
-                
-                # Check if file exists
-                if os.path.exists(file_path):
-                    # Check file size
-                    file_size = os.path.getsize(file_path)
-                    
-                    if file_size > Config.MAX_FILE_SIZE:
-                        os.remove(file_path)
-                        raise Exception(f"File size ({file_size / (1024**3):.2f} GB) exceeds limit (2 GB)")
-                    
-                    logger.info(f"Downloaded: {file_path} ({file_size / (1024**2):.2f} MB)")
-                    return file_path
-                
-                # Try alternative extensions
-                for ext in ['mkv', 'webm', 'mp4', 'ts']:
-                    alt_path = os.path.join(Config.DOWNLOAD_PATH, f"{title}.{ext}")
-                    if os.path.exists(alt_path):
-                        # Convert to mp4 if needed
-                        if ext != 'mp4':
-                            new_path = os.path.join(Config.DOWNLOAD_PATH, f"{title}.mp4")
-                            os.rename(alt_path, new_path)
-                            return new_path
-                        return alt_path
+        # Download with the matching backend (yt-dlp runs in the worker pool)
+        file_path = await _download(url, ydl_opts, workspace, quality, stream, reporter)
         
-        return None
+        if not file_path:
+            if stream is not None:
+                stream.abort()
+            remove_workspace(workspace)
+            return None
+        
+        # Remux (stream copy) to MP4, transcoding only when the codecs require it
+        with tracing.span('postprocess'):
+            file_path, rewritten = await ensure_mp4(file_path)
+        
+        # Check file size (larger files are split into parts when uploading)
+        file_size = os.path.getsize(file_path)
+        oversized = file_size > Config.MAX_FILE_SIZE
+        
+        if oversized and not Config.AUTO_SPLIT:
+            raise FileTooLarge(f"File size ({format_size(file_size)}) exceeds limit ({format_size(Config.MAX_FILE_SIZE)})")
+        
+        # The streamed upload is only valid if the file was kept as written and is sent whole
+        if stream is not None:
+            if stream.active and not rewritten and not oversized:
+                stream.complete()
+            else:
+                stream.abort()
+        
+        logger.info(f"Downloaded: {file_path} ({file_size / (1024**2):.2f} MB)")
+        return file_path
         
     except Exception as e:
         logger.error(f"Error downloading {url}: {str(e)}")
+        remove_workspace(workspace)
+        
+        if stream is not None:
+            stream.abort()
         
         if progress_message:
             try:
-                await progress_message.edit_text(f"❌ Download failed: {str(e)}")
+                await ProgressReporter.for_message(progress_message).set(f"❌ Download failed: {str(e)}")
             except:
                 pass
         
         return None
+    finally:
+        metrics.ACTIVE_DOWNLOADS.dec()
 
 
-def get_video_info(url: str) -> Optional[Dict]:
+def get_video_info(url: str, quality: str = None) -> Optional[Dict]:
     """
     Get video information without downloading
     
+    A failure that doesn't say the link is gone is tried once more
+    after LINK_CHECK_RETRY_DELAY seconds.
+    
     Args:
         url: Video URL
+        quality: Also estimate the download size at this quality
     
     Returns:
-        Video information dict or None
+        Video information dict or None (dead, private or DRM-protected link)
+    
+    Raises:
+        LinkCheckFailed: The link could not be checked, it may still work
     """
-    try:
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-        }
-        
-        with YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'http_headers': dict(HTTP_HEADERS),
+    }
+    if quality:
+        ydl_opts['format'] = Config.QUALITY_OPTIONS.get(quality, Config.QUALITY_OPTIONS["720"])
+        ydl_opts['format_sort'] = ['res', 'vcodec:h264', 'acodec:aac']
+    
+    for attempt in range(2):
+        try:
+            with YoutubeDL(ydl_opts) as ydl:
+                info = _extract_info(ydl, url, fresh_urls=False)
+            break
             
-            if info:
-                return {
-                    'title': info.get('title', 'Unknown'),
-                    'duration': info.get('duration', 0),
-                    'uploader': info.get('uploader', 'Unknown'),
-                    'thumbnail': info.get('thumbnail', ''),
-                    'description': info.get('description', '')[:500],
-                    'view_count': info.get('view_count', 0),
-                    'like_count': info.get('like_count', 0),
-                }
+        except DownloadError as e:
+            if _DEAD_LINK_RE.search(str(e)):
+                logger.info(f"Dead link {url}: {str(e)}")
+                return None
+            error = e
+        except Exception as e:
+            error = e
         
+        logger.warning(f"Error getting video info (attempt {attempt + 1}): {str(error)}")
+        if attempt == 0:
+            time.sleep(LINK_CHECK_RETRY_DELAY)
+    else:
+        raise LinkCheckFailed(str(error)) from error
+    
+    if not info:
         return None
-        
-    except Exception as e:
-        logger.error(f"Error getting video info: {str(e)}")
-        return None
+    
+    return {
+        'title': info.get('title', 'Unknown'),
+        'duration': info.get('duration', 0),
+        'uploader': info.get('uploader', 'Unknown'),
+        'thumbnail': info.get('thumbnail', ''),
+        'description': (info.get('description') or '')[:500],
+        'view_count': info.get('view_count', 0),
+        'like_count': info.get('like_count', 0),
+        'filesize': estimate_size(info) if quality else None,
+    }
 
 
 def cleanup_downloads():
@@ -303,6 +654,9 @@ def cleanup_downloads():
                 try:
                     if os.path.isfile(file_path):
                         os.remove(file_path)
+                    elif file.startswith(WORKSPACE_PREFIX):
+                        # Leftover job workspaces from an interrupted run
+                        shutil.rmtree(file_path, ignore_errors=True)
                 except Exception as e:
                     logger.error(f"Error deleting {file_path}: {str(e)}")
         
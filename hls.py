@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Native HLS downloader
+Parses M3U8 playlists and fetches segments concurrently over a shared
+aiohttp keep-alive pool, decrypting AES-128 segments on the fly
+"""
+
+import os
+import re
+import shutil
+import asyncio
+import logging
+from collections import deque
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urljoin, urlsplit
+from config import Config
+from preflight import FileTooLarge, disk_reservations, format_size
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# #EXT-X-... attribute lists: KEY=value or KEY="quoted, value"
+_ATTRIBUTE_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+SEGMENT_RETRIES = 5
+
+# Shared connection pool (created lazily on the running loop)
+_session = None
+
+
+class HLSUnsupported(Exception):
+    """Playlist feature this engine doesn't handle (left to yt-dlp)"""
+
+
+def is_hls_url(url: str) -> bool:
+    """Whether a URL points at an M3U8 playlist"""
+    parts = urlsplit(url.strip())
+    return parts.scheme in ('http', 'https') and parts.path.lower().endswith('.m3u8')
+
+
+def accepts(url: str) -> bool:
+    """Backend selector: M3U8 links while the native engine is enabled"""
+    return Config.HLS_NATIVE and is_hls_url(url)
+
+
+def _attributes(line: str) -> Dict[str, str]:
+    _, _, attrs = line.partition(':')
+    return {key: value.strip('"') for key, value in _ATTRIBUTE_RE.findall(attrs)}
+
+
+def parse_master(text: str, base_url: str) -> List[Dict]:
+    """
+    Read the variant streams of a master playlist
+    
+    Returns:
+        List of dicts with 'url', 'width', 'height', 'bandwidth' and 'codecs'
+        (empty for a media playlist)
+    """
+    variants = []
+    audio_groups = set()
+    attrs = None
+    
+    for line in text.splitlines():
+        line = line.strip()
+        
+        if line.startswith('#EXT-X-MEDIA:'):
+            media = _attributes(line)
+            if media.get('TYPE') == 'AUDIO' and media.get('URI'):
+                audio_groups.add(media.get('GROUP-ID'))
+        elif line.startswith('#EXT-X-STREAM-INF:'):
+            attrs = _attributes(line)
+        elif line and not line.startswith('#') and attrs is not None:
+            resolution = attrs.get('RESOLUTION', '')
+            width, height = (int(n) for n in resolution.split('x')) if 'x' in resolution else (0, 0)
+            
+            variants.append({
+                'url': urljoin(base_url, line),
+                'width': width,
+                'height': height,
+                'bandwidth': int(attrs.get('BANDWIDTH', 0) or 0),
+                'codecs': attrs.get('CODECS', ''),
+                'separate_audio': attrs.get('AUDIO') in audio_groups,
+            })
+            attrs = None
+    
+    return variants
+
+
+def pick_variant(variants: List[Dict], quality: str) -> Dict:
+    """Best variant not above the requested height (lowest one if all are)"""
+    limit = int(quality) if str(quality).isdigit() else 720
+    fitting = [v for v in variants if v['height'] <= limit]
+    
+    if fitting:
+        return max(fitting, key=lambda v: (v['height'], v['bandwidth']))
+    
+    return min(variants, key=lambda v: (v['height'], v['bandwidth']))
+
+
+def parse_media(text: str, base_url: str) -> Dict:
+    """
+    Read the segments of a media playlist
+    
+    Returns:
+        Dict with 'segments' (url, key dict or None, media sequence, duration)
+        and 'init' (URL of the fMP4 init section or None)
+    """
+    segments = []
+    key = None
+    init = None
+    sequence = 0
+    duration = 0.0
+    
+    for line in text.splitlines():
+        line = line.strip()
+        
+        if line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            sequence = int(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-KEY:'):
+            attrs = _attributes(line)
+            method = attrs.get('METHOD', 'NONE')
+            
+            if method == 'NONE':
+                key = None
+            elif method == 'AES-128':
+                key = {'uri': urljoin(base_url, attrs['URI']), 'iv': attrs.get('IV')}
+            else:
+                raise HLSUnsupported(f"encryption method {method}")
+        elif line.startswith('#EXT-X-MAP:'):
+            attrs = _attributes(line)
+            if 'BYTERANGE' in attrs:
+                raise HLSUnsupported("byte-range init section")
+            init = urljoin(base_url, attrs['URI'])
+        elif line.startswith('#EXT-X-BYTERANGE'):
+            raise HLSUnsupported("byte-range segments")
+        elif line.startswith('#EXTINF:'):
+            duration = float(line[8:].split(',', 1)[0] or 0)
+        elif line and not line.startswith('#'):
+            segments.append({
+                'url': urljoin(base_url, line), 'key': key,
+                'sequence': sequence, 'duration': duration
+            })
+            sequence += 1
+            duration = 0.0
+    
+    return {'segments': segments, 'init': init}
+
+
+def _decrypt(data: bytes, key: bytes, iv: bytes) -> bytes:
+    from yt_dlp.aes import aes_cbc_decrypt_bytes, unpad_pkcs7
+    return unpad_pkcs7(aes_cbc_decrypt_bytes(data, key, iv))
+
+
+def _segment_iv(segment: Dict) -> bytes:
+    """IV from the playlist, or the media sequence number (RFC 8216 5.2)"""
+    iv = segment['key'].get('iv')
+    if iv:
+        return bytes.fromhex(iv[2:] if iv.lower().startswith('0x') else iv).rjust(16, b'\0')
+    return segment['sequence'].to_bytes(16, 'big')
+
+
+def get_session():
+    """Get the shared keep-alive session, limited per host"""
+    global _session
+    
+    if _session is None or _session.closed:
+        import aiohttp
+        
+        connector = aiohttp.TCPConnector(
+            limit=0,
+            limit_per_host=max(1, Config.HLS_CONNECTIONS_PER_HOST),
+            ttl_dns_cache=300,
+            ssl=False  # Same as nocheckcertificate for yt-dlp
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=30)
+        )
+    
+    return _session
+
+
+async def close_session():
+    """Close the shared session (on shutdown)"""
+    global _session
+    
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def _fetch(url: str, headers: Dict[str, str]) -> bytes:
+    """GET a URL with retries"""
+    session = get_session()
+    
+    for attempt in range(SEGMENT_RETRIES):
+        try:
+            async with session.get(url, headers=headers) as response:
+                response.raise_for_status()
+                return await response.read()
+        except Exception as e:
+            if attempt == SEGMENT_RETRIES - 1:
+                raise
+            logger.debug(f"Retrying {url}: {str(e)}")
+            await asyncio.sleep(2 ** attempt)
+
+
+async def _fetch_text(url: str, headers: Dict[str, str]) -> str:
+    return (await _fetch(url, headers)).decode('utf-8', errors='ignore')
+
+
+class _FileSink:
+    """Writes the segments into one file as they are"""
+    
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._file = open(file_path, 'wb')
+    
+    async def write(self, data: bytes):
+        await asyncio.get_running_loop().run_in_executor(None, self._file.write, data)
+    
+    async def close(self):
+        self._file.close()
+    
+    async def abort(self):
+        self._file.close()
+
+
+class _FragmentedMP4Sink:
+    """
+    Remuxes MPEG-TS into fragmented MP4 on the fly (ffmpeg, stream copy)
+    
+    ffmpeg writes to a pipe, so the output file only ever grows at the end
+    and can be uploaded while it is being written. The ADTS to MP4 AAC
+    filter is only requested when the playlist says the audio is AAC
+    (mp4a); for unknown codecs the muxer inserts it itself if needed.
+    """
+    
+    def __init__(self, file_path: str, aac_audio: bool = False):
+        self.file_path = file_path
+        self.aac_audio = aac_audio
+        self._file = open(file_path, 'wb')
+        self._process = None
+        self._pump = None
+    
+    async def start(self):
+        filters = ['-bsf:a', 'aac_adtstoasc'] if self.aac_audio else []
+        self._process = await asyncio.create_subprocess_exec(
+            'ffmpeg', '-v', 'error', '-f', 'mpegts', '-i', 'pipe:0',
+            '-map', '0:v:0?', '-map', '0:a:0?', '-c', 'copy', *filters,
+            '-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov+default_base_moof', 'pipe:1',
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        self._pump = asyncio.ensure_future(self._copy_output())
+        return self
+    
+    async def _copy_output(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            data = await self._process.stdout.read(1024 * 1024)
+            if not data:
+                return
+            await loop.run_in_executor(None, self._file.write, data)
+            await loop.run_in_executor(None, self._file.flush)
+    
+    async def write(self, data: bytes):
+        self._process.stdin.write(data)
+        await self._process.stdin.drain()
+    
+    async def close(self):
+        self._process.stdin.close()
+        await self._pump
+        self._file.close()
+        
+        if await self._process.wait() != 0:
+            raise Exception("ffmpeg could not remux the stream to MP4")
+    
+    async def abort(self):
+        if self._process.returncode is None:
+            self._process.kill()
+            await self._process.wait()
+        if self._pump:
+            self._pump.cancel()
+        self._file.close()
+
+
+def estimate_size(variant: Dict, playlist: Dict) -> Optional[int]:
+    """Expected size of a variant: its BANDWIDTH over the playlist duration"""
+    if not variant or not variant['bandwidth']:
+        return None
+    return int(variant['bandwidth'] / 8 * sum(segment['duration'] for segment in playlist['segments']))
+
+
+async def _pick_fitting_variant(variants: List[Dict], quality: str, headers: Dict[str, str]):
+    """
+    Variant for the quality, stepping down while it's over Config.MAX_FILE_SIZE
+    (kept as is with Config.AUTO_SPLIT, the file is split later)
+    
+    Returns:
+        (variant, parsed media playlist)
+    
+    Raises:
+        FileTooLarge: Even the smallest variant is over the limit
+    """
+    variant = pick_variant(variants, quality)
+    
+    while True:
+        if variant['separate_audio']:
+            raise HLSUnsupported("separate audio rendition")
+        
+        text = await _fetch_text(variant['url'], headers)
+        playlist = parse_media(text, variant['url'])
+        size = estimate_size(variant, playlist)
+        
+        if size is None or size <= Config.MAX_FILE_SIZE or Config.AUTO_SPLIT:
+            return variant, playlist
+        
+        smaller = [v for v in variants if (v['height'], v['bandwidth']) < (variant['height'], variant['bandwidth'])]
+        if not smaller:
+            raise FileTooLarge(
+                f"Video is too large: {format_size(size)} at the lowest quality "
+                f"(limit {format_size(Config.MAX_FILE_SIZE)})"
+            )
+        
+        logger.info(f"HLS variant {variant['height']}p is {format_size(size)}, stepping down")
+        metrics.QUALITY_STEPDOWNS.inc()
+        variant = max(smaller, key=lambda v: (v['height'], v['bandwidth']))
+
+
+def _output_name(url: str, extension: str) -> str:
+    stem = os.path.splitext(os.path.basename(urlsplit(url).path))[0] or 'video'
+    stem = re.sub(r'[<>:"/\\|?*]', '', stem)[:150]
+    return f"{stem}.{extension}"
+
+
+async def download(url: str, workspace: str, quality: str = "720",
+                   headers: Dict[str, str] = None,
+                   progress_hook: Callable[[dict], None] = None, stream=None) -> Optional[str]:
+    """
+    Download an HLS stream into one file without re-encoding
+    
+    Segments are fetched concurrently (Config.HLS_CONCURRENT_SEGMENTS,
+    at most Config.HLS_CONNECTIONS_PER_HOST connections per host) and
+    written in playlist order, so only a small window stays in memory.
+    
+    With a StreamingUpload, MPEG-TS streams are remuxed to fragmented MP4
+    while downloading and the file is handed to the uploader right away.
+    
+    Args:
+        url: M3U8 URL (master or media playlist)
+        workspace: Directory the file is written to
+        quality: Maximum variant height
+        headers: HTTP request headers
+        progress_hook: Called with yt-dlp style progress dicts
+        stream: Optional uploader.StreamingUpload to feed
+    
+    Returns:
+        Path of the .ts (or .mp4 for fMP4 streams) file
+    
+    Raises:
+        HLSUnsupported: Stream needs yt-dlp (separate audio, byte ranges, DRM)
+        FileTooLarge: No variant fits under Config.MAX_FILE_SIZE
+        NotEnoughDiskSpace: The variant's size can't be reserved on disk
+    """
+    headers = headers or {}
+    loop = asyncio.get_running_loop()
+    
+    text = await _fetch_text(url, headers)
+    if not text.lstrip().startswith('#EXTM3U'):
+        raise HLSUnsupported("not an M3U8 playlist")
+    
+    variants = parse_master(text, url)
+    variant = None
+    if variants:
+        variant, playlist = await _pick_fitting_variant(variants, quality, headers)
+        
+        # The job reserved a flat guess, now the variant's size is known
+        size = estimate_size(variant, playlist)
+        if size:
+            await disk_reservations.reserve(workspace, size)
+    else:
+        playlist = parse_media(text, url)
+    
+    segments = playlist['segments']
+    if not segments:
+        raise HLSUnsupported("empty playlist")
+    
+    keys: Dict[str, asyncio.Task] = {}
+    
+    async def fetch_segment(segment: Dict) -> bytes:
+        data = await _fetch(segment['url'], headers)
+        
+        if segment['key']:
+            uri = segment['key']['uri']
+            if uri not in keys:
+                keys[uri] = asyncio.ensure_future(_fetch(uri, headers))
+            key = await keys[uri]
+            data = await loop.run_in_executor(None, _decrypt, data, key, _segment_iv(segment))
+        
+        return data
+    
+    # Streaming needs the final container now; fMP4 playlists already are one
+    remux_live = stream is not None and not playlist['init'] and shutil.which('ffmpeg')
+    
+    extension = 'mp4' if playlist['init'] or remux_live else 'ts'
+    file_path = os.path.join(workspace, _output_name(url, extension))
+    window = max(1, Config.HLS_CONCURRENT_SEGMENTS)
+    pending = deque()
+    queued = iter(segments)
+    written = 0
+    done = 0
+    started = loop.time()
+    
+    def fill():
+        while len(pending) < window:
+            segment = next(queued, None)
+            if segment is None:
+                return
+            pending.append(asyncio.ensure_future(fetch_segment(segment)))
+    
+    if remux_live:
+        aac_audio = bool(variant) and 'mp4a' in variant['codecs']
+        sink = await _FragmentedMP4Sink(file_path, aac_audio).start()
+    else:
+        sink = _FileSink(file_path)
+    
+    if stream is not None and (remux_live or playlist['init']):
+        stream.duration = sum(segment['duration'] for segment in segments)
+        if variant and variant['height']:
+            stream.width, stream.height = variant['width'], variant['height']
+        stream.attach(file_path)
+    
+    try:
+        if playlist['init']:
+            await sink.write(await _fetch(playlist['init'], headers))
+        
+        fill()
+        while pending:
+            data = await pending.popleft()
+            fill()
+            
+            await sink.write(data)
+            written += len(data)
+            done += 1
+            
+            if progress_hook:
+                elapsed = max(1e-6, loop.time() - started)
+                speed = written / elapsed
+                eta = (len(segments) - done) * elapsed / done
+                progress_hook({
+                    'status': 'downloading',
+                    'downloaded_bytes': written,
+                    '_percent_str': f"{done * 100 / len(segments):.1f}%",
+                    '_speed_str': f"{speed / (1024 * 1024):.2f}MiB/s",
+                    '_eta_str': f"{int(eta) // 60:02d}:{int(eta) % 60:02d}",
+                })
+        
+        await sink.close()
+    except BaseException:
+        await sink.abort()
+        raise
+    finally:
+        for task in pending:
+            task.cancel()
+        for task in keys.values():
+            task.cancel()
+    
+    logger.info(f"HLS: {len(segments)} segments, {written / (1024**2):.2f} MB -> {os.path.basename(file_path)}")
+    return file_path
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Extractor info cache
+Keeps yt-dlp info dicts so pre-checks, retries and users sending the same
+link don't hit the site again
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from yt_dlp import YoutubeDL
+from config import Config
+from file_cache import canonical_url
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Signed media URLs carry their own expiry (YouTube: expire=, CloudFront: Expires=)
+_EXPIRE_RE = re.compile(r'[?&/](?:expire|expires|Expires)[=/](\d{9,11})')
+
+# Signed URLs are not trusted right up to their expiry
+EXPIRY_MARGIN = 120
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS infos (
+    url TEXT PRIMARY KEY,
+    info BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    urls_expire_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS infos_last_used ON infos(last_used);
+"""
+
+
+def urls_expire_at(info: Dict, created_at: float) -> float:
+    """
+    When the format URLs of an info dict stop being usable
+    
+    Config.INFO_CACHE_URL_TTL after extraction, or earlier if a signed
+    URL says it expires sooner.
+    """
+    expires = created_at + Config.INFO_CACHE_URL_TTL
+    
+    for fmt in info.get('formats') or [info]:
+        match = _EXPIRE_RE.search(fmt.get('url') or '')
+        if match:
+            expires = min(expires, int(match.group(1)) - EXPIRY_MARGIN)
+    
+    return expires
+
+
+class InfoCache:
+    """
+    LRU cache of extracted info dicts keyed by canonical URL
+    
+    Metadata (title, duration, the format list and sizes) is reused for
+    Config.INFO_CACHE_TTL. Format URLs are signed and expire much sooner,
+    so an entry only serves downloads until urls_expire_at(); after that
+    it still answers metadata lookups while downloads extract again.
+    
+    Entries are stored as JSON, so every get() returns a private copy that
+    yt-dlp may modify. With Config.INFO_CACHE_DISK they are also written to
+    SQLite and survive restarts; entries evicted from memory are read back
+    from there.
+    """
+    
+    def __init__(self, max_entries: int = None, path: str = None):
+        self.max_entries = Config.INFO_CACHE_ENTRIES if max_entries is None else max_entries
+        self.ttl = Config.INFO_CACHE_TTL
+        
+        # canonical URL -> (JSON text, created_at, urls_expire_at)
+        self._entries: "OrderedDict[str, Tuple[str, float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.conn: Optional[sqlite3.Connection] = None
+        
+        if Config.INFO_CACHE_DISK and self.max_entries > 0:
+            self.path = path or Config.INFO_CACHE_DB_PATH
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SCHEMA)
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+    
+    def get(self, url: str, fresh_urls: bool = True) -> Optional[Dict]:
+        """
+        Look up the info dict of a URL
+        
+        Args:
+            url: Video URL
+            fresh_urls: The caller downloads, so the format URLs must still work
+        
+        Returns:
+            A copy of the info dict, or None on miss / expired entry
+        """
+        if self.max_entries <= 0:
+            return None
+        
+        key = canonical_url(url)
+        now = time.time()
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        
+        if entry is None:
+            entry = self._load(key)
+        
+        if entry is None or now - entry[1] > self.ttl:
+            metrics.INFO_CACHE_REQUESTS.inc(result='miss')
+            return None
+        
+        if fresh_urls and now >= entry[2]:
+            metrics.INFO_CACHE_REQUESTS.inc(result='stale')
+            return None
+        
+        metrics.INFO_CACHE_REQUESTS.inc(result='hit')
+        return json.loads(entry[0])
+    
+    def put(self, url: str, info: Dict):
+        """
+        Remember the info dict of a single video (playlists aren't cached)
+        
+        Pass the unprocessed extractor result (extract_info(process=False)):
+        a format selection stored here would be served to callers asking for
+        another quality. Selection results (requested_formats etc.) and
+        private keys are dropped either way.
+        """
+        if self.max_entries <= 0 or not info or info.get('_type', 'video') != 'video':
+            return
+        
+        try:
+            text = json.dumps(YoutubeDL.sanitize_info(info, remove_private_keys=True))
+        except Exception as e:
+            logger.debug(f"Info dict of {url} not cacheable: {str(e)}")
+            return
+        
+        key = canonical_url(url)
+        now = time.time()
+        entry = (text, now, urls_expire_at(info, now))
+        
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            
+            if self.conn is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO infos (url, info, created_at, urls_expire_at, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, zlib.compress(text.encode()), now, entry[2], now)
+                )
+                self._evict_disk(now)
+    
+    def _load(self, key: str) -> Optional[Tuple[str, float, float]]:
+        """Read an entry back from disk into memory"""
+        if self.conn is None:
+            return None
+        
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT info, created_at, urls_expire_at FROM infos WHERE url = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            
+            self.conn.execute("UPDATE infos SET last_used = ? WHERE url = ?", (time.time(), key))
+            entry = (zlib.decompress(row[0]).decode(), row[1], row[2])
+            
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        
+        return entry
+    
+    def _evict_disk(self, now: float):
+        """Drop expired entries and the least recently used ones above the disk limit"""
+        self.conn.execute("DELETE FROM infos WHERE created_at < ?", (now - self.ttl,))
+        
+        count = self.conn.execute("SELECT COUNT(*) FROM infos").fetchone()[0]
+        excess = count - Config.INFO_CACHE_DISK_MAX_ENTRIES
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM infos WHERE rowid IN "
+                "(SELECT rowid FROM infos ORDER BY last_used LIMIT ?)",
+                (excess,)
+            )
+    
+    def invalidate(self, url: str = None) -> int:
+        """
+        Remove cached entries
+        
+        Args:
+            url: Remove this URL, or everything if None
+        
+        Returns:
+            Number of in-memory entries removed
+        """
+        with self._lock:
+            if url is None:
+                removed = len(self._entries)
+                self._entries.clear()
+                if self.conn is not None:
+                    self.conn.execute("DELETE FROM infos")
+                return removed
+            
+            key = canonical_url(url)
+            removed = 1 if self._entries.pop(key, None) is not None else 0
+            if self.conn is not None:
+                self.conn.execute("DELETE FROM infos WHERE url = ?", (key,))
+            return removed
+
+
+# Shared by downloads and link checks
+info_cache = InfoCache()
+metrics.INFO_CACHE_ENTRIES.set_function(lambda: len(info_cache))
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent job store for batch downloads
+Keeps every link's state in SQLite so batches survive restarts
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import itertools
+import threading
+from typing import Dict, Iterable, List, Optional
+from config import Config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = "queued"
+DOWNLOADING = "downloading"
+UPLOADING = "uploading"
+DONE = "done"
+FAILED = "failed"
+
+# States that still need work (downloading/uploading means we were interrupted)
+PENDING_STATES = (QUEUED, DOWNLOADING, UPLOADING)
+
+# Batch states
+BATCH_RUNNING = "running"
+BATCH_FINISHED = "finished"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    settings TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'running',
+    total INTEGER NOT NULL DEFAULT 0,
+    ingested INTEGER NOT NULL DEFAULT 1,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch_id INTEGER NOT NULL REFERENCES batches(id),
+    idx INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    title TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_batch_state ON jobs(batch_id, state);
+CREATE INDEX IF NOT EXISTS jobs_batch_idx ON jobs(batch_id, idx);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs(state);
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'running',
+    last_user_id INTEGER,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    pruned INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class JobStore:
+    """SQLite backed store of batches and their link jobs"""
+    
+    def __init__(self, path: str = None):
+        self.path = path or Config.JOBS_DB_PATH
+        
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+        
+        logger.info(f"Job store ready at {self.path}")
+    
+    def _migrate(self):
+        """Add columns missing from stores created by older versions"""
+        columns = {row['name'] for row in self.conn.execute("PRAGMA table_info(batches)")}
+        
+        # Older batches were queued in one go, so they count as fully read
+        if 'ingested' not in columns:
+            self.conn.execute("ALTER TABLE batches ADD COLUMN ingested INTEGER NOT NULL DEFAULT 1")
+    
+    @metrics.timed(metrics.DB_SECONDS, backend='sqlite', op='jobs_execute')
+    def _execute(self, query: str, params: Iterable = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self.conn.execute(query, tuple(params))
+    
+    @metrics.timed(metrics.DB_SECONDS, backend='sqlite', op='jobs_fetchall')
+    def _fetchall(self, query: str, params: Iterable = ()) -> List[Dict]:
+        with self._lock:
+            return [dict(row) for row in self.conn.execute(query, tuple(params)).fetchall()]
+    
+    # Batches
+    
+    def create_batch(self, user_id: int, chat_id: int, settings: Dict, links: List[Dict[str, str]] = (),
+                     streamed: bool = False) -> int:
+        """
+        Create a batch and queue its links
+        
+        Args:
+            user_id: Telegram user who sent the file
+            chat_id: Chat to report progress in
+            settings: User settings snapshot (quality, channel, caption, thumbnail)
+            links: Links as returned by extract_links_from_txt
+            streamed: Links will follow through ingest(); the batch is marked
+                ingested only once that has read the whole file
+        
+        Returns:
+            New batch ID
+        """
+        cursor = self._execute(
+            "INSERT INTO batches (user_id, chat_id, settings, ingested, created_at) VALUES (?, ?, ?, ?, ?)",
+            (user_id, chat_id, json.dumps(settings), 0 if streamed else 1, time.time())
+        )
+        batch_id = cursor.lastrowid
+        
+        if links:
+            self.add_jobs(batch_id, links)
+        
+        return batch_id
+    
+    def add_jobs(self, batch_id: int, links: List[Dict[str, str]], start_idx: int = 1):
+        """Queue links for a batch"""
+        now = time.time()
+        rows = [
+            (batch_id, idx, link['url'], link.get('title') or f'Video_{idx}', now)
+            for idx, link in enumerate(links, start_idx)
+        ]
+        
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(
+                    "INSERT INTO jobs (batch_id, idx, url, title, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+                self.conn.execute(
+                    "UPDATE batches SET total = total + ? WHERE id = ?",
+                    (len(rows), batch_id)
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+    
+    def ingest(self, batch_id: int, links: Iterable[Dict[str, str]], chunk_size: int = 200) -> int:
+        """
+        Queue links from a (possibly lazy) iterable in chunks
+        
+        Each chunk is committed right away, so a pipeline reading the
+        batch can start before the whole file has been parsed. The batch
+        is flagged as ingested once the iterable is exhausted.
+        
+        Returns:
+            Number of links queued
+        """
+        links = iter(links)
+        count = 0
+        
+        while True:
+            chunk = list(itertools.islice(links, chunk_size))
+            if not chunk:
+                self._execute("UPDATE batches SET ingested = 1 WHERE id = ?", (batch_id,))
+                return count
+            
+            self.add_jobs(batch_id, chunk, start_idx=count + 1)
+            count += len(chunk)
+    
+    def get_batch(self, batch_id: int) -> Optional[Dict]:
+        """Get a batch with its settings decoded"""
+        rows = self._fetchall("SELECT * FROM batches WHERE id = ?", (batch_id,))
+        if not rows:
+            return None
+        
+        batch = rows[0]
+        batch['settings'] = json.loads(batch['settings'] or '{}')
+        return batch
+    
+    def unfinished_batches(self) -> List[Dict]:
+        """Batches that were still running (e.g. before a restart)"""
+        rows = self._fetchall("SELECT id FROM batches WHERE status = ? ORDER BY id", (BATCH_RUNNING,))
+        return [self.get_batch(row['id']) for row in rows]
+    
+    def set_batch_status(self, batch_id: int, status: str):
+        """Mark a batch running/finished"""
+        self._execute("UPDATE batches SET status = ? WHERE id = ?", (status, batch_id))
+    
+    def batch_counts(self, batch_id: int) -> Dict[str, int]:
+        """Number of jobs per state in a batch"""
+        rows = self._fetchall(
+            "SELECT state, COUNT(*) AS n FROM jobs WHERE batch_id = ? GROUP BY state",
+            (batch_id,)
+        )
+        return {row['state']: row['n'] for row in rows}
+    
+    # Jobs
+    
+    def pending_jobs(self, batch_id: int, after_idx: int = 0, limit: int = -1) -> List[Dict]:
+        """
+        Jobs of a batch that are not done or failed, in file order
+        
+        Args:
+            batch_id: Batch to look at
+            after_idx: Only jobs after this position in the file (for paging)
+            limit: Page size (-1 for all)
+        """
+        placeholders = ", ".join("?" for _ in PENDING_STATES)
+        return self._fetchall(
+            f"SELECT * FROM jobs WHERE batch_id = ? AND idx > ? AND state IN ({placeholders}) "
+            f"ORDER BY idx LIMIT ?",
+            (batch_id, after_idx, *PENDING_STATES, limit)
+        )
+    
+    def has_pending(self, batch_id: int) -> bool:
+        """Whether a batch still has work left"""
+        return bool(self.pending_jobs(batch_id, limit=1))
+    
+    def pending_count(self) -> int:
+        """Jobs not finished yet across all batches"""
+        placeholders = ", ".join("?" for _ in PENDING_STATES)
+        return self._execute(
+            f"SELECT COUNT(*) FROM jobs WHERE state IN ({placeholders})", PENDING_STATES
+        ).fetchone()[0]
+    
+    def set_state(self, job_id: int, state: str, error: str = None):
+        """Update a job's state"""
+        self._execute(
+            "UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE id = ?",
+            (state, error, time.time(), job_id)
+        )
+    
+    def failed_jobs(self, limit: int = 20) -> List[Dict]:
+        """Most recent failed jobs"""
+        return self._fetchall(
+            "SELECT * FROM jobs WHERE state = ? ORDER BY updated_at DESC LIMIT ?",
+            (FAILED, limit)
+        )
+    
+    def fail_pending(self, batch_id: int, error: str) -> int:
+        """
+        Mark every job of a batch that still needs work as failed
+        
+        Returns:
+            Number of jobs failed
+        """
+        placeholders = ", ".join("?" for _ in PENDING_STATES)
+        cursor = self._execute(
+            f"UPDATE jobs SET state = ?, error = ?, updated_at = ? "
+            f"WHERE batch_id = ? AND state IN ({placeholders})",
+            (FAILED, error, time.time(), batch_id, *PENDING_STATES)
+        )
+        return cursor.rowcount
+    
+    def retry_jobs(self, job_id: int = None) -> List[int]:
+        """
+        Re-queue failed jobs
+        
+        Args:
+            job_id: Single job to retry, or None for every failed job
+        
+        Returns:
+            IDs of the batches that got work re-queued
+        """
+        if job_id is None:
+            rows = self._fetchall("SELECT DISTINCT batch_id FROM jobs WHERE state = ?", (FAILED,))
+            self._execute(
+                "UPDATE jobs SET state = ?, error = NULL, updated_at = ? WHERE state = ?",
+                (QUEUED, time.time(), FAILED)
+            )
+        else:
+            rows = self._fetchall(
+                "SELECT batch_id FROM jobs WHERE id = ? AND state = ?",
+                (job_id, FAILED)
+            )
+            self._execute(
+                "UPDATE jobs SET state = ?, error = NULL, updated_at = ? WHERE id = ? AND state = ?",
+                (QUEUED, time.time(), job_id, FAILED)
+            )
+        
+        batch_ids = [row['batch_id'] for row in rows]
+        for batch_id in batch_ids:
+            self.set_batch_status(batch_id, BATCH_RUNNING)
+        
+        return batch_ids
+    
+    # Broadcasts
+    
+    def create_broadcast(self, chat_id: int, text: str) -> int:
+        """Store a new broadcast and return its ID"""
+        now = time.time()
+        cursor = self._execute(
+            "INSERT INTO broadcasts (chat_id, text, created_at, updated_at) VALUES (?, ?, ?, ?)",
+            (chat_id, text, now, now)
+        )
+        return cursor.lastrowid
+    
+    def get_broadcast(self, broadcast_id: int) -> Optional[Dict]:
+        """Get a broadcast with its checkpoint"""
+        rows = self._fetchall("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,))
+        return rows[0] if rows else None
+    
+    def checkpoint_broadcast(self, broadcast_id: int, last_user_id: int, sent: int, failed: int, pruned: int):
+        """Record how far a broadcast got"""
+        self._execute(
+            "UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ?, pruned = ?, updated_at = ? WHERE id = ?",
+            (last_user_id, sent, failed, pruned, time.time(), broadcast_id)
+        )
+    
+    def finish_broadcast(self, broadcast_id: int):
+        """Mark a broadcast complete"""
+        self._execute(
+            "UPDATE broadcasts SET status = ?, updated_at = ? WHERE id = ?",
+            (BATCH_FINISHED, time.time(), broadcast_id)
+        )
+    
+    def unfinished_broadcasts(self) -> List[Dict]:
+        """Broadcasts interrupted before they reached every user"""
+        return self._fetchall("SELECT * FROM broadcasts WHERE status = ? ORDER BY id", (BATCH_RUNNING,))
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Media post-processing with ffprobe/ffmpeg
+Remuxes (stream copy) whenever the codecs fit in MP4, transcodes only when needed
+and splits oversized videos at keyframes
+"""
+
+import os
+import json
+import hashlib
+import asyncio
+import logging
+import subprocess
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Codecs Telegram can stream from an MP4 container as-is
+MP4_VIDEO_CODECS = {'h264', 'hevc'}
+MP4_AUDIO_CODECS = {'aac', 'mp3'}
+
+# Bytes hashed from each end of a file to fingerprint it
+FINGERPRINT_BLOCK = 1024 * 1024
+
+# Telegram thumbnails: JPEG, at most 320px on the longest side
+THUMB_SIZE = 320
+
+# Caps concurrent re-encodes (created lazily on the running loop)
+_transcode_slots: Optional[asyncio.Semaphore] = None
+
+
+def get_transcode_slots() -> asyncio.Semaphore:
+    """
+    Get the semaphore that limits concurrent re-encodes
+    
+    Sized to the CPU cores (Config.TRANSCODE_WORKERS) so re-encodes never
+    oversubscribe the machine. ffmpeg is already its own process, so it
+    runs straight from the event loop.
+    """
+    global _transcode_slots
+    
+    if _transcode_slots is None:
+        _transcode_slots = asyncio.Semaphore(max(1, Config.TRANSCODE_WORKERS))
+    
+    return _transcode_slots
+
+
+async def _run(*args: str) -> subprocess.CompletedProcess:
+    """Run a command without blocking the event loop"""
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+
+
+async def probe_streams(file_path: str) -> Optional[Dict]:
+    """
+    Read container and codec information with ffprobe
+    
+    Returns:
+        Dict with 'format', 'video' and 'audio' codec names, or None if probing failed
+    """
+    try:
+        result = await _run(
+            'ffprobe', '-v', 'error',
+            '-show_entries', 'format=format_name:stream=codec_type,codec_name',
+            '-of', 'json', file_path
+        )
+    except FileNotFoundError:
+        logger.warning("ffprobe not found, skipping codec check")
+        return None
+    
+    if result.returncode != 0:
+        logger.warning(f"ffprobe failed on {file_path}: {result.stderr.decode(errors='ignore')[:200]}")
+        return None
+    
+    data = json.loads(result.stdout or b'{}')
+    info = {'format': data.get('format', {}).get('format_name', ''), 'video': None, 'audio': None}
+    
+    for stream in data.get('streams', []):
+        kind = stream.get('codec_type')
+        if kind in ('video', 'audio') and info[kind] is None:
+            info[kind] = stream.get('codec_name')
+    
+    return info
+
+
+def is_mp4_compatible(streams: Dict) -> bool:
+    """Whether the streams can be copied into MP4 without re-encoding"""
+    video_ok = streams.get('video') is None or streams['video'] in MP4_VIDEO_CODECS
+    audio_ok = streams.get('audio') is None or streams['audio'] in MP4_AUDIO_CODECS
+    return video_ok and audio_ok and streams.get('video') is not None
+
+
+def _ffmpeg_mp4_args(src: str, dst: str, streams: Dict, copy: bool) -> List[str]:
+    args = ['ffmpeg', '-y', '-v', 'error', '-i', src, '-map', '0:v:0?', '-map', '0:a:0?']
+    
+    if copy:
+        args += ['-c', 'copy']
+        if streams.get('video') == 'hevc':
+            args += ['-tag:v', 'hvc1']  # Needed for playback on Apple clients
+        if streams.get('audio') == 'aac' and 'mpegts' in streams.get('format', ''):
+            args += ['-bsf:a', 'aac_adtstoasc']
+    else:
+        args += [
+            '-c:v', 'libx264', '-preset', Config.TRANSCODE_PRESET, '-crf', '23',
+            '-pix_fmt', 'yuv420p',
+            '-c:a', 'aac', '-b:a', '128k',
+        ]
+    
+    return args + ['-movflags', '+faststart', dst]
+
+
+def _mp4_path(file_path: str) -> str:
+    base, ext = os.path.splitext(file_path)
+    return base + ('.remux.mp4' if ext.lower() == '.mp4' else '.mp4')
+
+
+async def remux_to_mp4(file_path: str, streams: Dict) -> Optional[str]:
+    """Copy the streams into an MP4 container (no re-encode)"""
+    output = _mp4_path(file_path)
+    result = await _run(*_ffmpeg_mp4_args(file_path, output, streams, copy=True))
+    
+    if result.returncode != 0:
+        logger.warning(f"Remux failed on {file_path}: {result.stderr.decode(errors='ignore')[:200]}")
+        if os.path.exists(output):
+            os.remove(output)
+        return None
+    
+    return output
+
+
+async def transcode_to_mp4(file_path: str, streams: Dict) -> Optional[str]:
+    """Re-encode to H.264/AAC MP4, at most Config.TRANSCODE_WORKERS at once"""
+    output = _mp4_path(file_path)
+    
+    async with get_transcode_slots():
+        result = await _run(*_ffmpeg_mp4_args(file_path, output, streams, copy=False))
+    
+    if result.returncode != 0:
+        logger.error(f"Transcode failed: {result.stderr.decode(errors='ignore')[:500]}")
+        if os.path.exists(output):
+            os.remove(output)
+        return None
+    
+    return output
+
+
+async def ensure_mp4(file_path: str) -> Tuple[str, bool]:
+    """
+    Make a downloaded file a Telegram-friendly MP4
+    
+    - MP4 with H.264/H.265 + AAC: used as-is
+    - Other container with those codecs: remuxed with stream copy
+    - Anything else: transcoded (Config.TRANSCODE_WORKERS at a time)
+    
+    Returns:
+        (path of the MP4, whether the file was rewritten). The original file
+        is removed when replaced, even if the new one keeps its name.
+        The original path is returned unchanged if ffmpeg is unavailable.
+    """
+    streams = await probe_streams(file_path)
+    if streams is None:
+        return file_path, False
+    
+    compatible = is_mp4_compatible(streams)
+    is_mp4 = file_path.lower().endswith('.mp4') and 'mp4' in streams['format']
+    
+    if compatible and is_mp4:
+        return file_path, False
+    
+    output = None
+    if compatible:
+        logger.info(f"Remuxing {os.path.basename(file_path)} ({streams['video']}/{streams['audio']})")
+        output = await remux_to_mp4(file_path, streams)
+    
+    if output is None:
+        logger.info(f"Transcoding {os.path.basename(file_path)} ({streams['video']}/{streams['audio']})")
+        output = await transcode_to_mp4(file_path, streams)
+    
+    if output is None:
+        return file_path, False
+    
+    os.remove(file_path)
+    
+    # Keep the plain .mp4 name when we had to write next to an existing .mp4
+    if output.endswith('.remux.mp4'):
+        os.replace(output, file_path)
+        return file_path, True
+    
+    return output, True
+
+
+def file_fingerprint(file_path: str) -> str:
+    """
+    Partial content hash: size plus the first and last megabyte
+    
+    Cheap enough for 2 GB files and stable across renames and workspaces.
+    """
+    size = os.path.getsize(file_path)
+    digest = hashlib.sha1(str(size).encode())
+    
+    with open(file_path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BLOCK))
+        if size > 2 * FINGERPRINT_BLOCK:
+            f.seek(-FINGERPRINT_BLOCK, os.SEEK_END)
+            digest.update(f.read(FINGERPRINT_BLOCK))
+    
+    return digest.hexdigest()
+
+
+async def _probe_metadata(file_path: str, thumb_path: str) -> Dict:
+    """ffprobe + thumbnail frame (short, so never queued behind transcodes)"""
+    metadata = {'duration': 0, 'width': 0, 'height': 0, 'thumb': None}
+    
+    result = await _run(
+        'ffprobe', '-v', 'error',
+        '-show_entries', 'format=duration:stream=codec_type,width,height,duration',
+        '-of', 'json', file_path
+    )
+    if result.returncode != 0:
+        return metadata
+    
+    data = json.loads(result.stdout or b'{}')
+    duration = data.get('format', {}).get('duration')
+    
+    for stream in data.get('streams', []):
+        if stream.get('codec_type') == 'video':
+            metadata['width'] = int(stream.get('width') or 0)
+            metadata['height'] = int(stream.get('height') or 0)
+            duration = duration or stream.get('duration')
+            break
+    
+    metadata['duration'] = int(float(duration or 0))
+    
+    if metadata['width']:
+        # A frame from 10% in skips black intros
+        result = await _run(
+            'ffmpeg', '-y', '-v', 'error',
+            '-ss', str(metadata['duration'] * 0.1), '-i', file_path,
+            '-frames:v', '1',
+            '-vf', f"scale={THUMB_SIZE}:{THUMB_SIZE}:force_original_aspect_ratio=decrease",
+            '-q:v', '4', thumb_path
+        )
+        if result.returncode == 0 and os.path.exists(thumb_path):
+            metadata['thumb'] = thumb_path
+    
+    return metadata
+
+
+def _prune_metadata_cache(directory: str):
+    """Keep the newest Config.METADATA_CACHE_MAX_ENTRIES entries"""
+    entries = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.endswith('.json')),
+        key=lambda entry: entry.stat().st_mtime
+    )
+    
+    for entry in entries[:max(0, len(entries) - Config.METADATA_CACHE_MAX_ENTRIES)]:
+        base = entry.path[:-len('.json')]
+        for path in (entry.path, base + '.jpg'):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+async def get_video_metadata(file_path: str) -> Dict:
+    """
+    Duration, dimensions and a generated thumbnail for send_video
+    
+    Results are cached on disk by file fingerprint, so a video is only
+    probed once.
+    
+    Returns:
+        Dict with 'duration', 'width', 'height' and 'thumb' (path or None);
+        zeros/None when ffmpeg is unavailable
+    """
+    loop = asyncio.get_running_loop()
+    directory = Config.METADATA_CACHE_PATH
+    os.makedirs(directory, exist_ok=True)
+    
+    fingerprint = await loop.run_in_executor(None, file_fingerprint, file_path)
+    cache_path = os.path.join(directory, fingerprint + '.json')
+    
+    try:
+        with open(cache_path) as f:
+            metadata = json.load(f)
+        if metadata.get('thumb') is None or os.path.exists(metadata['thumb']):
+            os.utime(cache_path)
+            return metadata
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        # Unreadable entry (e.g. cut short by a crash): probe again and overwrite it
+        logger.warning(f"Ignoring metadata cache entry {cache_path}: {str(e)}")
+    
+    try:
+        metadata = await _probe_metadata(file_path, os.path.join(directory, fingerprint + '.jpg'))
+    except FileNotFoundError:
+        logger.warning("ffprobe not found, sending without metadata")
+        return {'duration': 0, 'width': 0, 'height': 0, 'thumb': None}
+    except Exception as e:
+        logger.error(f"Error reading metadata of {file_path}: {str(e)}")
+        return {'duration': 0, 'width': 0, 'height': 0, 'thumb': None}
+    
+    if metadata['width']:
+        # Written aside and renamed, so a reader never sees a partial entry
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(metadata, f)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Could not cache metadata of {file_path}: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        _prune_metadata_cache(directory)
+    
+    return metadata
+
+
+def _split_part_size() -> int:
+    """Target size of a split part, leaving room for container overhead"""
+    limit = int(Config.MAX_FILE_SIZE * 0.95)
+    return min(Config.SPLIT_PART_SIZE, limit) if Config.SPLIT_PART_SIZE > 0 else limit
+
+
+async def _plan_split(file_path: str, part_size: int) -> List[Tuple[float, Optional[float]]]:
+    """
+    Pick keyframes to cut at
+    
+    Only the video packet index is read (no decoding), so this is a short
+    probe that never waits behind transcodes.
+    
+    Returns:
+        (start, end) times of the parts; end is None for the last part
+    """
+    result = await _run(
+        'ffprobe', '-v', 'error', '-show_entries', 'format=start_time,duration', '-of', 'json', file_path
+    )
+    if result.returncode != 0:
+        raise Exception(f"ffprobe failed: {result.stderr.decode(errors='ignore')[:200]}")
+    
+    media_format = json.loads(result.stdout or b'{}').get('format', {})
+    start_time = float(media_format.get('start_time') or 0)
+    duration = float(media_format.get('duration') or 0)
+    
+    result = await _run(
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,pos,flags', '-of', 'csv=p=0', file_path
+    )
+    if result.returncode != 0:
+        raise Exception(f"ffprobe failed: {result.stderr.decode(errors='ignore')[:200]}")
+    
+    # Hours of video are a lot of packet lines, parse them off the loop
+    return await asyncio.get_running_loop().run_in_executor(
+        None, _cut_points, result.stdout, start_time, duration, os.path.getsize(file_path), part_size
+    )
+
+
+def _cut_points(packets: bytes, start_time: float, duration: float, file_size: int,
+                part_size: int) -> List[Tuple[float, Optional[float]]]:
+    """
+    Parts from the keyframes in ffprobe's packet list
+    
+    A part's size is the byte distance between its keyframes, so parts
+    stay under part_size even when the bitrate varies.
+    """
+    # (time from the start, byte offset) of every keyframe
+    keyframes = []
+    for line in packets.decode(errors='ignore').splitlines():
+        fields = line.split(',')
+        if len(fields) < 3 or 'K' not in fields[2] or fields[0] in ('', 'N/A'):
+            continue
+        at = float(fields[0]) - start_time
+        if fields[1].isdigit():
+            offset = int(fields[1])
+        else:
+            offset = int(file_size * at / duration) if duration else 0
+        keyframes.append((at, offset))
+    
+    keyframes.sort()
+    if not keyframes:
+        raise Exception("No keyframes to split at")
+    
+    # Greedy: each part runs to the last keyframe that keeps it under part_size
+    starts = [keyframes[0]]
+    previous = keyframes[0]
+    for keyframe in keyframes[1:] + [(None, file_size)]:
+        if keyframe[1] - starts[-1][1] > part_size and previous is not starts[-1]:
+            starts.append(previous)
+        previous = keyframe
+    
+    return [
+        (start[0] if index else 0.0, starts[index + 1][0] if index + 1 < len(starts) else None)
+        for index, start in enumerate(starts)
+    ]
+
+
+def _ffmpeg_cut_args(src: str, dst: str, start: float, end: Optional[float]) -> List[str]:
+    args = ['ffmpeg', '-y', '-v', 'error']
+    
+    # Input seeking lands on the keyframe at (or just before) the seek point,
+    # and the part stops just short of the next part's keyframe
+    seek = start + 0.001 if start > 0 else 0
+    if seek:
+        args += ['-ss', f"{seek:.3f}"]
+    args += ['-i', src]
+    if end is not None:
+        args += ['-t', f"{end - seek - 0.001:.3f}"]
+    
+    return args + [
+        '-map', '0:v:0?', '-map', '0:a:0?', '-c', 'copy',
+        '-avoid_negative_ts', 'make_zero', '-movflags', '+faststart', dst
+    ]
+
+
+async def split_video(file_path: str, on_part: Callable[[int, int, str], Awaitable[None]]) -> int:
+    """
+    Cut a video at keyframes into parts under Config.MAX_FILE_SIZE
+    
+    Stream copy only, no re-encode. Up to Config.SPLIT_CONCURRENCY parts
+    are cut at once and on_part is awaited for each one in order as soon
+    as it is ready, while the next parts are still being cut.
+    
+    Args:
+        file_path: MP4 to split
+        on_part: Called with (index, total, part path); owns the part file
+    
+    Returns:
+        Number of parts
+    
+    Raises:
+        Exception: ffmpeg is missing or a part could not be cut
+    """
+    plan = await _plan_split(file_path, _split_part_size())
+    total = len(plan)
+    if total < 2:
+        raise Exception("Video can't be split at its keyframes")
+    
+    logger.info(f"Splitting {os.path.basename(file_path)} into {total} parts")
+    base = os.path.splitext(file_path)[0]
+    semaphore = asyncio.Semaphore(max(1, Config.SPLIT_CONCURRENCY))
+    
+    async def cut(index: int, start: float, end: Optional[float]) -> str:
+        output = f"{base}.part{index}.mp4"
+        async with semaphore:
+            process = await asyncio.create_subprocess_exec(
+                *_ffmpeg_cut_args(file_path, output, start, end),
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                _, stderr = await process.communicate()
+            except asyncio.CancelledError:
+                process.kill()
+                raise
+        
+        if process.returncode != 0:
+            raise Exception(f"Cutting part {index}/{total} failed: {stderr.decode(errors='ignore')[:200]}")
+        return output
+    
+    tasks = [asyncio.ensure_future(cut(index, start, end)) for index, (start, end) in enumerate(plan, 1)]
+    
+    try:
+        for index, task in enumerate(tasks, 1):
+            await on_part(index, total, await task)
+    finally:
+        for task in tasks:
+            task.cancel()
+    
+    return total
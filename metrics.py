@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prometheus-style metrics and the health check endpoint
+Serves /metrics (text exposition format) and /health on Config.PORT
+"""
+
+import time
+import asyncio
+import logging
+import functools
+import threading
+from typing import Callable, Dict, Optional, Sequence, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Buckets in seconds: sub-second DB calls up to hour-long downloads
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+STARTED_AT = time.time()
+
+
+def _label_text(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _matches(names: Sequence[str], key: Tuple[str, ...], labels: Dict[str, str]) -> bool:
+    return all(str(labels[name]) == value for name, value in zip(names, key) if name in labels)
+
+
+class _Metric:
+    kind = ""
+    
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+    
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+    
+    def render(self) -> str:
+        return f"# HELP {self.name} {self.help}\n# TYPE {self.name} {self.kind}\n" + "".join(self._samples())
+    
+    def _samples(self):
+        return []
+
+
+class Counter(_Metric):
+    """Monotonic counter"""
+    
+    kind = "counter"
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+    
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def total(self, **labels) -> float:
+        """Sum over the series matching the given labels"""
+        with self._lock:
+            items = list(self._values.items())
+        return sum(value for key, value in items if _matches(self.labels, key, labels))
+    
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_label_text(self.labels, key)} {value}\n"
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, or is read from a callback at scrape time"""
+    
+    kind = "gauge"
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], float]] = None
+    
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+    
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+    
+    def set_function(self, function: Callable[[], object]):
+        """
+        Read the value from a callback on every scrape
+        
+        The callback returns a number, or a dict of first-label value -> number.
+        """
+        self._function = function
+    
+    def _samples(self):
+        if self._function is not None:
+            try:
+                value = self._function()
+            except Exception as e:
+                logger.debug(f"Gauge {self.name} failed: {str(e)}")
+                return
+            
+            if isinstance(value, dict):
+                for label, number in value.items():
+                    yield f"{self.name}{_label_text(self.labels, (label,))} {number}\n"
+            else:
+                yield f"{self.name} {value}\n"
+            return
+        
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_label_text(self.labels, key)} {value}\n"
+
+
+class Histogram(_Metric):
+    """Cumulative histogram with _bucket, _sum and _count series"""
+    
+    kind = "histogram"
+    
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], list] = {}
+    
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[0][index] += 1
+            data[1] += value
+            data[2] += 1
+    
+    def total(self, **labels) -> Tuple[float, int]:
+        """(sum, count) over the series matching the given labels"""
+        with self._lock:
+            items = [(key, data[1], data[2]) for key, data in self._values.items()]
+        matching = [(total, count) for key, total, count in items if _matches(self.labels, key, labels)]
+        return sum(total for total, _ in matching), sum(count for _, count in matching)
+    
+    def time(self, **labels):
+        """Context manager observing the elapsed time of its block"""
+        return _Timer(self, labels)
+    
+    def _samples(self):
+        with self._lock:
+            items = [(key, (list(data[0]), data[1], data[2])) for key, data in self._values.items()]
+        for key, (counts, total, count) in items:
+            for bound, bucket in zip(self.buckets, counts):
+                labels = _label_text(self.labels, key, 'le="%s"' % bound)
+                yield f"{self.name}_bucket{labels} {bucket}\n"
+            labels = _label_text(self.labels, key, 'le="+Inf"')
+            yield f"{self.name}_bucket{labels} {count}\n"
+            yield f"{self.name}_sum{_label_text(self.labels, key)} {total}\n"
+            yield f"{self.name}_count{_label_text(self.labels, key)} {count}\n"
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+def timed(histogram: Histogram, **labels):
+    """Decorator observing the run time of a sync or async function"""
+    def decorator(function):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with histogram.time(**labels):
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with histogram.time(**labels):
+                    return function(*args, **kwargs)
+        return wrapper
+    
+    return decorator
+
+
+REGISTRY = []
+
+# Downloads / uploads
+DOWNLOAD_SECONDS = Histogram("videobot_download_seconds", "Time to download one video", ["backend", "result"])
+UPLOAD_SECONDS = Histogram("videobot_upload_seconds", "Time to upload one video", ["session", "mode"])
+BYTES_DOWNLOADED = Counter("videobot_downloaded_bytes_total", "Bytes downloaded", ["backend"])
+INFO_CACHE_REQUESTS = Counter("videobot_info_cache_requests_total", "Extractor info cache lookups", ["result"])
+INFO_CACHE_ENTRIES = Gauge("videobot_info_cache_entries", "Info dicts cached in memory")
+QUALITY_STEPDOWNS = Counter("videobot_quality_stepdowns_total", "Downloads moved to a lower quality to fit the size limit")
+BYTES_UPLOADED = Counter("videobot_uploaded_bytes_total", "Bytes uploaded to Telegram", ["session"])
+VIDEOS = Counter("videobot_videos_total", "Videos delivered", ["source"])
+ACTIVE_DOWNLOADS = Gauge("videobot_active_downloads", "Downloads in progress")
+ACTIVE_UPLOADS = Gauge("videobot_active_uploads", "Uploads in progress")
+ACTIVE_BATCHES = Gauge("videobot_active_batches", "Batches being processed")
+QUEUE_DEPTH = Gauge("videobot_pipeline_queue_depth", "Items waiting between pipeline stages", ["stage"])
+PENDING_JOBS = Gauge("videobot_pending_jobs", "Batch jobs not finished yet (all batches)")
+DISK_RESERVED = Gauge("videobot_disk_reserved_bytes", "Disk space reserved by running downloads")
+SCHEDULER_WAITING = Gauge("videobot_scheduler_waiting", "Downloads waiting for a scheduler slot", ["kind"])
+SCHEDULER_WAIT_SECONDS = Histogram("videobot_scheduler_wait_seconds", "Time downloads waited for a slot", ["kind"])
+
+# Telegram limits
+FLOOD_WAITS = Counter("videobot_floodwaits_total", "FloodWait errors received", ["source"])
+FLOOD_WAIT_SECONDS = Counter("videobot_floodwait_seconds_total", "Seconds asked to wait by FloodWaits", ["source"])
+
+# Storage
+DB_SECONDS = Histogram("videobot_db_seconds", "Database call latency", ["backend", "op"])
+
+# Runtime
+LOOP_LAG = Gauge("videobot_event_loop_lag_seconds", "Latest event loop scheduling delay")
+LOOP_LAG_SECONDS = Histogram(
+    "videobot_event_loop_lag_hist_seconds", "Event loop scheduling delay",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+UPTIME = Gauge("videobot_uptime_seconds", "Seconds since start")
+UPTIME.set_function(lambda: round(time.time() - STARTED_AT, 1))
+
+
+def record_flood_wait(source: str, seconds: float):
+    """Count one FloodWait"""
+    FLOOD_WAITS.inc(source=source)
+    FLOOD_WAIT_SECONDS.inc(seconds, source=source)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    return "".join(metric.render() for metric in REGISTRY)
+
+
+async def monitor_loop_lag(interval: float = 0.5):
+    """Measure how late the loop wakes up from a fixed sleep"""
+    loop = asyncio.get_running_loop()
+    
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        LOOP_LAG.set(round(lag, 6))
+        LOOP_LAG_SECONDS.observe(lag)
+
+
+class MetricsServer:
+    """
+    Embedded aiohttp server: /metrics and /health (also /)
+    
+    Doubles as the health check of the hosting platform's web service.
+    """
+    
+    def __init__(self, health_check: Callable[[], bool] = None):
+        self.health_check = health_check
+        self._runner = None
+        self._lag_task: Optional[asyncio.Task] = None
+    
+    async def _metrics(self, request):
+        from aiohttp import web
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+    
+    async def _health(self, request):
+        from aiohttp import web
+        
+        healthy = self.health_check() if self.health_check else True
+        return web.json_response(
+            {'status': 'ok' if healthy else 'unhealthy', 'uptime': int(time.time() - STARTED_AT)},
+            status=200 if healthy else 503
+        )
+    
+    async def start(self):
+        """Start serving on Config.PORT (no-op if disabled)"""
+        if not Config.PORT:
+            return
+        
+        from aiohttp import web
+        
+        app = web.Application()
+        app.router.add_get('/', self._health)
+        app.router.add_get('/health', self._health)
+        app.router.add_get('/metrics', self._metrics)
+        
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, '0.0.0.0', Config.PORT).start()
+        self._lag_task = asyncio.ensure_future(monitor_loop_lag())
+        
+        logger.info(f"Metrics/health server listening on port {Config.PORT}")
+    
+    async def stop(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+        if self._runner is not None:
+            await self._runner.cleanup()
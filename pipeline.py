@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Staged pipeline for batch processing
+Probe -> Download -> Upload, connected by bounded queues
+"""
+
+import weakref
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Optional
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stage's output
+_DONE = object()
+
+
+class BatchPipeline:
+    """
+    Run a batch of items through probe, download and upload stages
+    
+    The next item downloads while the current one uploads, but uploads
+    always happen in the order the items were given.
+    
+    Stage callables:
+        probe(item) -> item or None (None skips the item)
+        download(item) -> result
+        upload(item, result) -> None
+    """
+    
+    # Pipelines currently alive (for queue depth metrics)
+    _live: "weakref.WeakSet[BatchPipeline]" = weakref.WeakSet()
+    
+    def __init__(
+        self,
+        probe: Callable[[Any], Awaitable[Any]],
+        download: Callable[[Any], Awaitable[Any]],
+        upload: Callable[[Any, Any], Awaitable[None]],
+        prefetch: Optional[int] = None,
+        on_error: Optional[Callable[[Any, Exception], Awaitable[None]]] = None,
+    ):
+        self.probe = probe
+        self.download = download
+        self.upload = upload
+        self.prefetch = max(1, prefetch or Config.PIPELINE_PREFETCH)
+        self.on_error = on_error
+        
+        self.probe_queue: asyncio.Queue = asyncio.Queue(maxsize=self.prefetch)
+        self.upload_queue: asyncio.Queue = asyncio.Queue(maxsize=self.prefetch)
+        self.processed = 0
+        self.failed = 0
+        self._live.add(self)
+    
+    @classmethod
+    def queue_depths(cls) -> dict:
+        """Items waiting between stages, summed over all live pipelines"""
+        pipelines = list(cls._live)
+        return {
+            'probe': sum(p.probe_queue.qsize() for p in pipelines),
+            'upload': sum(p.upload_queue.qsize() for p in pipelines),
+        }
+    
+    async def _handle_error(self, item, error: Exception):
+        """Report a failed item without stopping the batch"""
+        self.failed += 1
+        logger.error(f"Pipeline error on {item}: {str(error)}")
+        
+        if self.on_error:
+            try:
+                await self.on_error(item, error)
+            except Exception as e:
+                logger.error(f"Error in pipeline error handler: {str(e)}")
+    
+    async def _probe_stage(self, items):
+        """Probe items and pass them on in order"""
+        if hasattr(items, '__aiter__'):
+            async for item in items:
+                await self._probe_one(item)
+        else:
+            for item in items:
+                await self._probe_one(item)
+        
+        await self.probe_queue.put(_DONE)
+    
+    async def _probe_one(self, item):
+        try:
+            probed = await self.probe(item)
+        except Exception as e:
+            await self._handle_error(item, e)
+            return
+        
+        if probed is not None:
+            await self.probe_queue.put(probed)
+    
+    async def _download_stage(self):
+        """Start downloads ahead of the uploader (bounded by the queue size)"""
+        while True:
+            item = await self.probe_queue.get()
+            if item is _DONE:
+                break
+            
+            task = asyncio.create_task(self.download(item))
+            await self.upload_queue.put((item, task))
+        
+        await self.upload_queue.put(_DONE)
+    
+    async def _upload_stage(self):
+        """Upload finished downloads strictly in order"""
+        while True:
+            entry = await self.upload_queue.get()
+            if entry is _DONE:
+                break
+            
+            item, task = entry
+            try:
+                result = await task
+                await self.upload(item, result)
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self._handle_error(item, e)
+    
+    async def run(self, items) -> dict:
+        """
+        Process all items
+        
+        Args:
+            items: Iterable or async iterable of items
+        
+        Returns:
+            Dict with 'processed' and 'failed' counts
+        """
+        stages = [
+            asyncio.create_task(self._probe_stage(items)),
+            asyncio.create_task(self._download_stage()),
+            asyncio.create_task(self._upload_stage()),
+        ]
+        
+        try:
+            await asyncio.gather(*stages)
+        except BaseException:
+            for stage in stages:
+                stage.cancel()
+            
+            # Don't leave orphaned downloads running
+            while not self.upload_queue.empty():
+                entry = self.upload_queue.get_nowait()
+                if entry is not _DONE:
+                    entry[1].cancel()
+            raise
+        
+        return {'processed': self.processed, 'failed': self.failed}
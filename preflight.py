@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pre-flight size checks and disk space admission
+Estimates the size of a download before it starts, steps the quality down
+until it fits Config.MAX_FILE_SIZE (unless oversized videos are split with
+Config.AUTO_SPLIT) and reserves disk space for it
+"""
+
+import os
+import time
+import shutil
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+from config import Config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# How often a job waiting for disk space re-checks the free space
+DISK_POLL_INTERVAL = 5
+
+
+class FileTooLarge(Exception):
+    """The video can't fit under Config.MAX_FILE_SIZE at any quality"""
+
+
+class NotEnoughDiskSpace(Exception):
+    """No disk space could be reserved for a download"""
+
+
+def format_size(size: float) -> str:
+    """Human readable size (MB below 1 GB)"""
+    if size >= 1024 ** 3:
+        return f"{size / 1024 ** 3:.2f} GB"
+    return f"{size / 1024 ** 2:.1f} MB"
+
+
+def estimate_size(info: Dict) -> Optional[int]:
+    """
+    Expected download size of a processed yt-dlp info dict
+    
+    Sums the selected formats (video + audio when merged), using
+    filesize, then filesize_approx, then bitrate x duration.
+    
+    Returns:
+        Size in bytes, or None if any selected format has no estimate
+    """
+    if not info or info.get('_type') in ('playlist', 'multi_video'):
+        return None
+    
+    duration = info.get('duration')
+    total = 0
+    
+    for fmt in info.get('requested_formats') or [info]:
+        size = fmt.get('filesize') or fmt.get('filesize_approx')
+        if not size and fmt.get('tbr') and duration:
+            size = fmt['tbr'] * 1000 / 8 * duration
+        if not size:
+            return None
+        total += size
+    
+    return int(total)
+
+
+def lower_qualities(quality: str) -> List[str]:
+    """Configured qualities below this one, highest first"""
+    limit = int(quality) if str(quality).isdigit() else 720
+    return sorted((q for q in Config.QUALITY_OPTIONS if int(q) < limit), key=int, reverse=True)
+
+
+def fit_quality(ydl, info: Dict, quality: str) -> Tuple[Dict, str, Optional[int]]:
+    """
+    Re-select formats at lower qualities until the estimate fits the limit
+    
+    With Config.AUTO_SPLIT the quality is kept, oversized videos are split.
+    
+    Args:
+        ydl: The YoutubeDL instance that extracted info
+        info: Processed info dict (formats already selected for quality)
+        quality: Quality info was selected for
+    
+    Returns:
+        (info dict, quality, estimated size) to download
+    
+    Raises:
+        FileTooLarge: Even the lowest quality is over the limit
+    """
+    size = estimate_size(info)
+    if size is None or size <= Config.MAX_FILE_SIZE or Config.AUTO_SPLIT:
+        return info, quality, size
+    
+    smallest = size
+    for lower in lower_qualities(quality):
+        format_spec = Config.QUALITY_OPTIONS[lower]
+        ydl.params['format'] = format_spec
+        ydl.format_selector = ydl.build_format_selector(format_spec)
+        
+        try:
+            candidate = ydl.process_ie_result(info, download=False)
+        except Exception as e:
+            logger.debug(f"No {lower}p formats: {str(e)}")
+            continue
+        
+        candidate_size = estimate_size(candidate)
+        if candidate_size is None or candidate_size <= Config.MAX_FILE_SIZE:
+            logger.info(f"Stepping down {quality}p -> {lower}p ({format_size(size)} is over the limit)")
+            return candidate, lower, candidate_size
+        
+        smallest = min(smallest, candidate_size)
+    
+    raise FileTooLarge(
+        f"Video is too large: {format_size(smallest)} at the lowest quality "
+        f"(limit {format_size(Config.MAX_FILE_SIZE)})"
+    )
+
+
+def _used_bytes(directory: str) -> int:
+    """Size of the files in a job workspace"""
+    total = 0
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file(follow_symlinks=False):
+                        total += entry.stat().st_size
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return total
+
+
+class DiskReservations:
+    """
+    Disk space promised to running downloads in Config.DOWNLOAD_PATH
+    
+    A job reserves its estimated size (times Config.DISK_RESERVE_FACTOR for
+    the remux copy) before it starts and keeps it until its workspace is
+    removed. Jobs that don't fit next to the other reservations wait.
+    """
+    
+    def __init__(self):
+        self._reserved: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._changed: Optional[asyncio.Event] = None
+    
+    @property
+    def reserved(self) -> int:
+        """Bytes reserved by all jobs"""
+        with self._lock:
+            return sum(self._reserved.values())
+    
+    def _wake(self):
+        event, self._changed = self._changed, asyncio.Event()
+        if event is not None:
+            event.set()
+    
+    async def reserve(self, key: str, size: Optional[int], timeout: float = None) -> int:
+        """
+        Wait until the space for one job is free and reserve it
+        
+        Reserving again under the same key replaces the earlier reservation.
+        
+        Args:
+            key: Job workspace
+            size: Estimated download size (None for Config.DISK_UNKNOWN_SIZE)
+            timeout: Give up after this many seconds (Config.DISK_WAIT_TIMEOUT)
+        
+        Returns:
+            Bytes reserved
+        
+        Raises:
+            NotEnoughDiskSpace: The space didn't become free in time
+        """
+        needed = int(size * Config.DISK_RESERVE_FACTOR) if size else Config.DISK_UNKNOWN_SIZE
+        timeout = Config.DISK_WAIT_TIMEOUT if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._changed = asyncio.Event()
+        
+        with self._lock:
+            self._reserved.pop(key, None)
+        
+        waited = False
+        while True:
+            changed = self._changed
+            free = shutil.disk_usage(Config.DOWNLOAD_PATH).free - Config.DISK_FREE_MARGIN
+            
+            with self._lock:
+                reservations = list(self._reserved.items())
+            
+            # What running jobs already wrote is gone from the free space
+            used = {other: _used_bytes(other) for other, _ in reservations}
+            others = sum(max(0, reserved - used[other]) for other, reserved in reservations)
+            
+            with self._lock:
+                if needed <= free - others:
+                    self._reserved[key] = needed
+                    return needed
+            
+            # Won't fit even once every other job is done and deleted
+            if needed > free + sum(used.values()) or time.monotonic() >= deadline:
+                raise NotEnoughDiskSpace(
+                    f"Not enough disk space: need {format_size(needed)}, "
+                    f"{format_size(max(0, free - others))} available"
+                )
+            
+            if not waited:
+                logger.info(f"Waiting for {format_size(needed)} of disk space ({format_size(others)} reserved)")
+                waited = True
+            
+            try:
+                await asyncio.wait_for(changed.wait(), min(DISK_POLL_INTERVAL, max(0.1, deadline - time.monotonic())))
+            except asyncio.TimeoutError:
+                pass
+    
+    def reserve_blocking(self, key: str, size: Optional[int], timeout: float = None) -> int:
+        """reserve() from a worker thread, once the loop has made a reservation"""
+        if self._loop is None:
+            raise RuntimeError("reserve() has not run on the event loop yet")
+        return asyncio.run_coroutine_threadsafe(self.reserve(key, size, timeout), self._loop).result()
+    
+    def release(self, key: str):
+        """Drop a job's reservation (safe to call from any thread)"""
+        with self._lock:
+            if self._reserved.pop(key, None) is None:
+                return
+        
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake)
+
+
+# Shared by every download
+disk_reservations = DiskReservations()
+metrics.DISK_RESERVED.set_function(lambda: disk_reservations.reserved)
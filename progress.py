@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rate-limited progress reporting for Telegram status messages
+"""
+
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+from pyrogram.errors import FloodWait, MessageNotModified
+from config import Config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def format_download_progress(d: dict) -> str:
+    """Build the download status text from a yt-dlp progress dict"""
+    percentage = d.get('_percent_str', '0%').strip()
+    speed = d.get('_speed_str', 'N/A').strip()
+    eta = d.get('_eta_str', 'N/A').strip()
+    
+    return (
+        f"📥 **Downloading...**\n\n"
+        f"Progress: {percentage}\n"
+        f"Speed: {speed}\n"
+        f"ETA: {eta}"
+    )
+
+
+def format_upload_progress(current: int, total: int, title: str) -> str:
+    """Build the upload status text"""
+    percentage = (current / total) * 100 if total else 0
+    bar_length = 20
+    filled = int(bar_length * current // total) if total else 0
+    bar = '█' * filled + '░' * (bar_length - filled)
+    
+    return (
+        f"📤 **Uploading: {title}**\n\n"
+        f"Progress: {percentage:.1f}%\n"
+        f"{bar}\n"
+        f"📊 {current / (1024*1024):.1f} MB / {total / (1024*1024):.1f} MB"
+    )
+
+
+class ProgressReporter:
+    """
+    Coalescing progress editor for one message
+    
+    update() is thread-safe and only stores the latest text; a single
+    task on the event loop flushes it at most once per interval and
+    skips edits whose text has not changed. Use for_message() so the
+    download and upload stages share the same reporter.
+    """
+    
+    _registry: Dict[Tuple[int, int], "ProgressReporter"] = {}
+    
+    def __init__(self, message, interval: Optional[float] = None):
+        self.message = message
+        self.interval = interval or Config.PROGRESS_UPDATE_INTERVAL
+        self.closed = False
+        
+        self._loop = asyncio.get_running_loop()
+        self._lock = threading.Lock()
+        self._pending: Optional[str] = None
+        self._last_text: Optional[str] = getattr(message, 'text', None)
+        self._task: Optional[asyncio.Task] = None
+        
+        # Serializes edits so a slow flush can't land after set()
+        self._edit_lock = asyncio.Lock()
+    
+    @classmethod
+    def for_message(cls, message) -> "ProgressReporter":
+        """Get the shared reporter of a message (created on first use)"""
+        if isinstance(message, cls):
+            return message
+        
+        key = (message.chat.id, message.id)
+        reporter = cls._registry.get(key)
+        
+        if reporter is None or reporter.closed:
+            reporter = cls(message)
+            cls._registry[key] = reporter
+        
+        return reporter
+    
+    def update(self, text: str):
+        """Queue a new progress text (safe to call from any thread)"""
+        with self._lock:
+            if self.closed:
+                return
+            self._pending = text
+        
+        if self._task is None:
+            try:
+                self._loop.call_soon_threadsafe(self._ensure_task)
+            except RuntimeError:
+                # Loop already closed (shutting down)
+                pass
+    
+    def _ensure_task(self):
+        if self._task is None and not self.closed:
+            self._task = self._loop.create_task(self._run())
+    
+    async def _run(self):
+        """Flush the latest text every interval"""
+        while not self.closed:
+            await self._flush()
+            await asyncio.sleep(self.interval)
+    
+    async def _flush(self):
+        async with self._edit_lock:
+            await self._flush_locked()
+    
+    async def _flush_locked(self):
+        with self._lock:
+            text, self._pending = self._pending, None
+        
+        if text is None or text == self._last_text:
+            return
+        
+        try:
+            await self.message.edit_text(text)
+            self._last_text = text
+        except MessageNotModified:
+            self._last_text = text
+        except FloodWait as e:
+            metrics.record_flood_wait('progress', e.value)
+            # Keep the text unless something newer arrived meanwhile
+            with self._lock:
+                if self._pending is None:
+                    self._pending = text
+            await asyncio.sleep(e.value)
+        except Exception as e:
+            logger.debug(f"Progress edit failed: {str(e)}")
+    
+    async def set(self, text: str):
+        """Replace the message text right away, dropping queued progress"""
+        async with self._edit_lock:
+            with self._lock:
+                self._pending = None
+            
+            if text == self._last_text:
+                return
+            
+            try:
+                await self.message.edit_text(text)
+                self._last_text = text
+            except MessageNotModified:
+                self._last_text = text
+            except FloodWait as e:
+                metrics.record_flood_wait('progress', e.value)
+                await asyncio.sleep(e.value)
+                await self.message.edit_text(text)
+                self._last_text = text
+    
+    async def finish(self, text: Optional[str] = None):
+        """Stop reporting, optionally with a final text"""
+        self.closed = True
+        
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        
+        key = (self.message.chat.id, self.message.id)
+        if self._registry.get(key) is self:
+            del self._registry[key]
+        
+        if text is not None:
+            try:
+                await self.set(text)
+            except Exception as e:
+                logger.debug(f"Final progress edit failed: {str(e)}")
+    
+    def download_hook(self):
+        """yt-dlp progress hook feeding this reporter"""
+        def hook(d):
+            if d.get('status') == 'downloading':
+                self.update(format_download_progress(d))
+        
+        return hook
+    
+    def upload_callback(self, title: str):
+        """Pyrogram upload progress callback feeding this reporter"""
+        async def callback(current, total):
+            self.update(format_upload_progress(current, total, title))
+        
+        return callback
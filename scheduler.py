@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fair download scheduler
+Per-user queues served by deficit round-robin under global and per-user caps
+"""
+
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, List, Optional
+from config import Config
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+
+class _Waiter:
+    def __init__(self, interactive: bool):
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.interactive = interactive
+        self.queued_at = time.monotonic()
+
+
+class _UserQueue:
+    """Waiting requests and running downloads of one user"""
+    
+    def __init__(self, user_id: int, weight: int):
+        self.user_id = user_id
+        self.weight = weight
+        self.deficit = 0
+        self.active = 0
+        self.waiters: Deque[_Waiter] = deque()
+    
+    def next_waiter(self, interactive: bool) -> Optional[_Waiter]:
+        for waiter in self.waiters:
+            if waiter.interactive == interactive:
+                return waiter
+        return None
+
+
+class FairScheduler:
+    """
+    Hand out download slots fairly between users
+    
+    Each user has their own queue. Single-link (interactive) requests are
+    served first, oldest first, so they stay fast while batches run; batch
+    downloads share the remaining slots by deficit round-robin, where a
+    user's weight is how many downloads they start per round (owner and
+    AUTH_USERS weigh more). No user holds more than the per-user cap, so a
+    200-link file can't take every slot.
+    """
+    
+    def __init__(self, max_active: int = None, per_user: int = None):
+        self.max_active = max(1, max_active or Config.SCHEDULER_MAX_ACTIVE or Config.MAX_CONCURRENT_DOWNLOADS)
+        self.per_user = max(1, per_user or Config.SCHEDULER_PER_USER)
+        self.active = 0
+        self.users: Dict[int, _UserQueue] = {}
+        
+        # Users with waiting batch downloads, in round-robin order
+        self._ring: Deque[_UserQueue] = deque()
+    
+    @staticmethod
+    def weight_of(user_id: int) -> int:
+        """Batch slots a user starts per round-robin turn"""
+        if user_id == Config.OWNER_ID:
+            return max(1, Config.SCHEDULER_OWNER_WEIGHT)
+        if user_id in Config.AUTH_USERS:
+            return max(1, Config.SCHEDULER_AUTH_WEIGHT)
+        return 1
+    
+    def _queue_of(self, user_id: int) -> _UserQueue:
+        queue = self.users.get(user_id)
+        if queue is None:
+            queue = self.users[user_id] = _UserQueue(user_id, self.weight_of(user_id))
+        return queue
+    
+    def _forget_if_idle(self, queue: _UserQueue):
+        if not queue.active and not queue.waiters:
+            self.users.pop(queue.user_id, None)
+    
+    def has_capacity(self, user_id: int) -> bool:
+        """Whether a request from this user would start right away"""
+        queue = self.users.get(user_id)
+        return self.active < self.max_active and (queue is None or queue.active < self.per_user)
+    
+    @asynccontextmanager
+    async def slot(self, user_id: int, interactive: bool = False):
+        """
+        Hold a download slot for the block
+        
+        Args:
+            user_id: User the download is for
+            interactive: Single-link request (served before batch downloads)
+        """
+        queue = self._queue_of(user_id)
+        waiter = _Waiter(interactive)
+        queue.waiters.append(waiter)
+        if not interactive and queue not in self._ring:
+            self._ring.append(queue)
+        
+        self._dispatch()
+        kind = INTERACTIVE if interactive else BATCH
+        
+        try:
+            with tracing.span('queue', kind=kind):
+                await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(queue)
+            else:
+                queue.waiters.remove(waiter)
+                self._forget_if_idle(queue)
+            raise
+        
+        metrics.SCHEDULER_WAIT_SECONDS.observe(time.monotonic() - waiter.queued_at, kind=kind)
+        
+        try:
+            yield
+        finally:
+            self._release(queue)
+    
+    def _release(self, queue: _UserQueue):
+        queue.active -= 1
+        self.active -= 1
+        self._forget_if_idle(queue)
+        self._dispatch()
+    
+    def _grant(self, queue: _UserQueue, waiter: _Waiter):
+        queue.waiters.remove(waiter)
+        queue.active += 1
+        self.active += 1
+        waiter.future.set_result(None)
+    
+    def _next_interactive(self):
+        """Oldest single-link request of a user below the per-user cap"""
+        best = None
+        for queue in self.users.values():
+            if queue.active >= self.per_user:
+                continue
+            waiter = queue.next_waiter(True)
+            if waiter and (best is None or waiter.queued_at < best[1].queued_at):
+                best = (queue, waiter)
+        return best
+    
+    def _next_batch(self):
+        """Deficit round-robin over users with waiting batch downloads"""
+        for _ in range(len(self._ring)):
+            if not self._ring:
+                break
+            queue = self._ring[0]
+            waiter = queue.next_waiter(False)
+            
+            if waiter is None:
+                # Nothing left to schedule: leave the ring, forfeit the deficit
+                self._ring.popleft()
+                queue.deficit = 0
+                continue
+            
+            if queue.active >= self.per_user:
+                self._ring.rotate(-1)
+                continue
+            
+            if queue.deficit <= 0:
+                queue.deficit += queue.weight
+            
+            queue.deficit -= 1
+            if queue.deficit <= 0:
+                self._ring.rotate(-1)
+            
+            return queue, waiter
+        
+        return None
+    
+    def _dispatch(self):
+        """Start as many waiting requests as the caps allow"""
+        while self.active < self.max_active:
+            picked = self._next_interactive() or self._next_batch()
+            if picked is None:
+                return
+            self._grant(*picked)
+    
+    def waiting(self) -> Dict[str, int]:
+        """Queued requests by kind (for metrics)"""
+        counts = {INTERACTIVE: 0, BATCH: 0}
+        for queue in self.users.values():
+            for waiter in queue.waiters:
+                counts[INTERACTIVE if waiter.interactive else BATCH] += 1
+        return counts
+    
+    def status(self) -> List[Dict]:
+        """Per-user counters for stats"""
+        return [
+            {
+                'user_id': queue.user_id,
+                'weight': queue.weight,
+                'active': queue.active,
+                'waiting': len(queue.waiters),
+            }
+            for queue in self.users.values()
+        ]
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Upload session pool
+Spreads uploads over the main bot and optional extra sessions (more bot
+tokens or a premium user session) with per-session FloodWait tracking
+"""
+
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from pyrogram import Client
+from pyrogram.errors import (
+    FloodWait, PeerIdInvalid, UserIsBlocked, InputUserDeactivated,
+    ChatWriteForbidden, ChatAdminRequired, ChannelPrivate
+)
+from config import Config
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# The session can't post in this chat (extra bot not started/not admin there)
+NO_ACCESS_ERRORS = (
+    PeerIdInvalid, UserIsBlocked, InputUserDeactivated,
+    ChatWriteForbidden, ChatAdminRequired, ChannelPrivate
+)
+
+MAIN_SESSION = "main"
+
+
+class UploadSession:
+    """One MTProto session able to upload"""
+    
+    def __init__(self, name: str, client: Client, managed: bool = True):
+        self.name = name
+        self.client = client
+        self.managed = managed  # started/stopped by the pool
+        self.active = 0
+        self.uploads = 0
+        self.flood_waits = 0
+        self.flood_until = 0.0
+        self.denied_chats = set()
+    
+    @property
+    def flood_remaining(self) -> float:
+        return max(0.0, self.flood_until - time.monotonic())
+
+
+class UploadPool:
+    """
+    Pick the least busy session that isn't in a FloodWait for each upload
+    
+    A FloodWait only blocks the session that got it; the upload is retried
+    on another one. Chats an extra session can't post in are remembered,
+    those uploads go through the main bot.
+    """
+    
+    def __init__(self, main_client: Client):
+        self.sessions: List[UploadSession] = [UploadSession(MAIN_SESSION, main_client, managed=False)]
+        
+        for index, token in enumerate(Config.UPLOAD_BOT_TOKENS, start=1):
+            self.sessions.append(UploadSession(f"bot{index}", Client(
+                f"upload_bot{index}",
+                api_id=Config.API_ID,
+                api_hash=Config.API_HASH,
+                bot_token=token,
+                in_memory=True,
+                no_updates=True
+            )))
+        
+        if Config.UPLOAD_SESSION_STRING:
+            self.sessions.append(UploadSession("premium", Client(
+                "upload_premium",
+                api_id=Config.API_ID,
+                api_hash=Config.API_HASH,
+                session_string=Config.UPLOAD_SESSION_STRING,
+                in_memory=True,
+                no_updates=True
+            )))
+    
+    async def start(self):
+        """Start the extra sessions (ones that fail to log in are dropped)"""
+        for session in list(self.sessions):
+            if not session.managed:
+                continue
+            
+            try:
+                await session.client.start()
+                logger.info(f"Upload session {session.name} started")
+            except Exception as e:
+                logger.error(f"Error starting upload session {session.name}: {str(e)}")
+                self.sessions.remove(session)
+    
+    async def stop(self):
+        """Stop the extra sessions"""
+        for session in self.sessions:
+            if session.managed and session.client.is_connected:
+                try:
+                    await session.client.stop()
+                except Exception as e:
+                    logger.error(f"Error stopping upload session {session.name}: {str(e)}")
+    
+    def get(self, name: str) -> Optional[UploadSession]:
+        """Session by name (None if it isn't configured anymore)"""
+        for session in self.sessions:
+            if session.name == name:
+                return session
+        return None
+    
+    def session_of(self, client: Client) -> UploadSession:
+        """Session owning a client (the main one for unknown clients)"""
+        for session in self.sessions:
+            if session.client is client:
+                return session
+        return self.sessions[0]
+    
+    def pick(self, chat_id=None) -> UploadSession:
+        """Least busy session allowed in the chat, preferring ones not in a FloodWait"""
+        candidates = [s for s in self.sessions if chat_id not in s.denied_chats] or self.sessions[:1]
+        return min(candidates, key=lambda s: (s.flood_remaining > 0, s.flood_remaining, s.active))
+    
+    async def run(self, chat_id, call: Callable[[Client], Awaitable],
+                  session: UploadSession = None) -> Tuple[object, UploadSession]:
+        """
+        Run one upload call on a pooled session
+        
+        Args:
+            chat_id: Target chat (used to skip sessions that can't post there)
+            call: Coroutine function taking the Client to use
+            session: Pin the call to this session (e.g. for its own file_ids)
+        
+        Returns:
+            (result of the call, session that ran it)
+        """
+        attempts = 0
+        
+        while True:
+            current = session or self.pick(chat_id)
+            
+            if current.flood_remaining:
+                with tracing.span('floodwait', source=f'upload:{current.name}'):
+                    await asyncio.sleep(current.flood_remaining)
+            
+            current.active += 1
+            try:
+                result = await call(current.client)
+                current.uploads += 1
+                return result, current
+            except FloodWait as e:
+                current.flood_waits += 1
+                current.flood_until = time.monotonic() + e.value
+                metrics.record_flood_wait(f'upload:{current.name}', e.value)
+                logger.warning(f"Upload session {current.name}: FloodWait {e.value}s")
+                
+                attempts += 1
+                if attempts > len(self.sessions):
+                    raise
+            except NO_ACCESS_ERRORS:
+                if session is not None or current.name == MAIN_SESSION:
+                    raise
+                logger.info(f"Upload session {current.name} can't post in {chat_id}, using another")
+                current.denied_chats.add(chat_id)
+            finally:
+                current.active -= 1
+    
+    def status(self) -> List[Dict]:
+        """Per-session counters for stats"""
+        return [
+            {
+                'name': session.name,
+                'active': session.active,
+                'uploads': session.uploads,
+                'flood_waits': session.flood_waits,
+                'flood_remaining': int(session.flood_remaining),
+            }
+            for session in self.sessions
+        ]
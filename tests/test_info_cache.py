@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Info cache: a cached link is re-selected for every caller's quality
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+for name, value in (('API_ID', '1'), ('API_HASH', 'x'), ('BOT_TOKEN', 'x'), ('OWNER_ID', '1')):
+    os.environ.setdefault(name, value)
+
+yt_dlp = pytest.importorskip("yt_dlp")
+pytest.importorskip("pyrogram")
+
+from config import Config
+from info_cache import InfoCache
+import helpers
+
+URL = "https://example.com/watch/lecture"
+
+# Separate 720p video + audio, and a single progressive 360p file
+RAW_INFO = {
+    'id': 'lecture',
+    'title': 'Lecture',
+    'extractor': 'test',
+    'extractor_key': 'Test',
+    'webpage_url': URL,
+    'duration': 600,
+    'formats': [
+        {'format_id': 'v720', 'url': 'https://cdn.example.com/v720.mp4', 'ext': 'mp4',
+         'height': 720, 'vcodec': 'avc1', 'acodec': 'none', 'filesize': 300_000_000},
+        {'format_id': 'a', 'url': 'https://cdn.example.com/a.m4a', 'ext': 'm4a',
+         'vcodec': 'none', 'acodec': 'mp4a', 'filesize': 10_000_000},
+        {'format_id': 'p360', 'url': 'https://cdn.example.com/p360.mp4', 'ext': 'mp4',
+         'height': 360, 'vcodec': 'avc1', 'acodec': 'mp4a', 'filesize': 80_000_000},
+    ],
+}
+
+
+class FakeSiteYDL(yt_dlp.YoutubeDL):
+    """YoutubeDL whose extractor returns RAW_INFO and counts site requests"""
+    
+    requests = 0
+    
+    def extract_info(self, url, download=True, process=True, **kwargs):
+        FakeSiteYDL.requests += 1
+        info = {**RAW_INFO, 'formats': [dict(fmt) for fmt in RAW_INFO['formats']]}
+        return self.process_ie_result(info, download) if process else info
+
+
+def _ydl(quality: str) -> FakeSiteYDL:
+    return FakeSiteYDL({'format': Config.QUALITY_OPTIONS[quality], 'quiet': True, 'no_warnings': True})
+
+
+def _selected(info):
+    return [fmt['format_id'] for fmt in info.get('requested_formats') or [info]]
+
+
+def test_cached_entry_is_reselected_at_another_quality(monkeypatch):
+    monkeypatch.setattr(Config, 'INFO_CACHE_DISK', False)
+    monkeypatch.setattr(helpers, 'info_cache', InfoCache(max_entries=8))
+    FakeSiteYDL.requests = 0
+    
+    first = helpers._extract_info(_ydl("720"), URL)
+    assert _selected(first) == ['v720', 'a']
+    assert helpers.estimate_size(first) == 310_000_000
+    
+    second = helpers._extract_info(_ydl("360"), URL)
+    assert FakeSiteYDL.requests == 1
+    assert _selected(second) == ['p360']
+    assert helpers.estimate_size(second) == 80_000_000
+
+
+def test_put_drops_a_previous_selection(monkeypatch):
+    monkeypatch.setattr(Config, 'INFO_CACHE_DISK', False)
+    cache = InfoCache(max_entries=8)
+    
+    processed = _ydl("720").process_ie_result(
+        {**RAW_INFO, 'formats': [dict(fmt) for fmt in RAW_INFO['formats']]}, download=False
+    )
+    cache.put(URL, processed)
+    
+    cached = cache.get(URL)
+    assert 'requested_formats' not in cached
+    assert _selected(_ydl("360").process_ie_result(cached, download=False)) == ['p360']
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-job stage timing
+Writes one JSONL record per span (extract, download, postprocess, upload,
+floodwait, ...) and summarizes them for the owner's /profile command
+"""
+
+import os
+import io
+import json
+import time
+import pstats
+import asyncio
+import cProfile
+import logging
+import threading
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Job the current task/thread works on: {'job': id, 'host': host}
+_current_job: contextvars.ContextVar = contextvars.ContextVar('trace_job', default=None)
+
+_write_lock = threading.Lock()
+
+# cProfile for one job: armed by /profile next, then owned by that job
+_profile_armed = False
+_profiler: Optional[cProfile.Profile] = None
+_profile_job = None
+_profile_callback: Optional[Callable[[str], Awaitable]] = None
+
+
+def _write(record: Dict):
+    """Append one span to the trace file (rotated at Config.TRACE_MAX_BYTES)"""
+    line = json.dumps(record, separators=(',', ':')) + '\n'
+    path = Config.TRACE_PATH
+    
+    with _write_lock:
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            if os.path.exists(path) and os.path.getsize(path) > Config.TRACE_MAX_BYTES:
+                os.replace(path, path + '.1')
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line)
+        except OSError as e:
+            logger.debug(f"Trace write failed: {str(e)}")
+
+
+@contextmanager
+def job(job_id, url: str = None, final: bool = True):
+    """
+    Attribute the spans inside this block to one job
+    
+    A job may run in several blocks (download and upload stages); pass
+    final=False for all but the last. Runs cProfile from the first block
+    to the final one if /profile armed it.
+    """
+    global _profile_armed, _profiler, _profile_job
+    
+    job_id = str(job_id)
+    token = _current_job.set({'job': job_id, 'host': urlsplit(url or '').hostname or ''})
+    
+    if _profile_armed and _profiler is None:
+        _profile_armed = False
+        _profiler = cProfile.Profile()
+        _profile_job = job_id
+        _profiler.enable()
+    
+    try:
+        yield
+    finally:
+        _current_job.reset(token)
+        if final and _profiler is not None and _profile_job == job_id:
+            _finish_profile()
+
+
+@contextmanager
+def span(stage: str, **fields):
+    """Time a stage of the current job and write it as a JSONL record"""
+    context = _current_job.get()
+    started = time.time()
+    perf_started = time.perf_counter()
+    ok = True
+    
+    try:
+        yield fields
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        if Config.TRACE_ENABLED and context is not None:
+            _write({
+                'ts': round(started, 3),
+                'job': context['job'],
+                'host': context['host'],
+                'stage': stage,
+                'dur': round(time.perf_counter() - perf_started, 4),
+                'ok': ok,
+                **fields,
+            })
+
+
+def run_in_executor(executor, function, *args) -> asyncio.Future:
+    """loop.run_in_executor that keeps the current job for spans in the worker thread"""
+    context = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(executor, context.run, function, *args)
+
+
+def arm_profile(callback: Callable[[str], Awaitable] = None) -> bool:
+    """
+    Profile the next job that starts
+    
+    Args:
+        callback: Coroutine function called with the report path when done
+    
+    Returns:
+        False if a profile is already armed or running
+    """
+    global _profile_armed, _profile_callback
+    
+    if _profile_armed or _profiler is not None:
+        return False
+    
+    _profile_armed = True
+    _profile_callback = callback
+    return True
+
+
+def _finish_profile():
+    global _profiler, _profile_job, _profile_callback
+    
+    profiler, job_id, callback = _profiler, _profile_job, _profile_callback
+    _profiler = _profile_job = _profile_callback = None
+    profiler.disable()
+    
+    directory = os.path.join(Config.DATA_PATH, 'profiles')
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, f"job-{job_id}-{int(time.time())}")
+    profiler.dump_stats(base + '.prof')
+    
+    # The loop thread is sampled, so concurrent jobs show up too
+    report = io.StringIO()
+    stats = pstats.Stats(profiler, stream=report)
+    stats.sort_stats('cumulative').print_stats(40)
+    with open(base + '.txt', 'w', encoding='utf-8') as f:
+        f.write(f"cProfile of job {job_id} (event loop thread)\n\n{report.getvalue()}")
+    
+    logger.info(f"Profile of job {job_id} written to {base}.txt")
+    if callback is not None:
+        asyncio.ensure_future(callback(base + '.txt'))
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def _read_records() -> List[Dict]:
+    records = []
+    for path in (Config.TRACE_PATH + '.1', Config.TRACE_PATH):
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    return records
+
+
+def summarize(last_jobs: int = None) -> Dict:
+    """
+    Stage percentiles over the most recent jobs (blocking, reads the trace file)
+    
+    Returns:
+        Dict with 'jobs' (count), 'stages' and 'hosts', each mapping a name
+        to {'count', 'p50', 'p90', 'p99', 'total'}
+    """
+    last_jobs = last_jobs or Config.TRACE_SUMMARY_JOBS
+    records = _read_records()
+    
+    recent = []
+    seen = set()
+    for record in reversed(records):
+        if record['job'] not in seen:
+            if len(seen) >= last_jobs:
+                continue
+            seen.add(record['job'])
+        recent.append(record)
+    
+    stages = defaultdict(list)
+    hosts = defaultdict(list)
+    
+    for record in recent:
+        stages[record['stage']].append(record['dur'])
+        if record['stage'] == 'download' and record.get('host'):
+            hosts[record['host']].append(record['dur'])
+    
+    def describe(groups):
+        result = {}
+        for name, values in groups.items():
+            values.sort()
+            result[name] = {
+                'count': len(values),
+                'p50': _percentile(values, 0.5),
+                'p90': _percentile(values, 0.9),
+                'p99': _percentile(values, 0.99),
+                'total': sum(values),
+            }
+        return result
+    
+    return {'jobs': len(seen), 'stages': describe(stages), 'hosts': describe(hosts)}
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming uploads
+Sends a file to Telegram's storage part by part while it is still being
+written, then posts it as a video once the download has finished
+"""
+
+import os
+import asyncio
+import logging
+from typing import Callable, Optional
+from pyrogram import Client, raw, types, utils
+from pyrogram.errors import FloodWait
+from pyrogram.session import Session
+from config import Config
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Telegram upload part size (the maximum allowed)
+PART_SIZE = 512 * 1024
+
+# Files below this size must use the small-file upload, so streaming only
+# starts once the file has grown past it
+BIG_FILE_SIZE = 10 * 1024 * 1024
+
+# How often the growing file is checked for new data
+POLL_INTERVAL = 0.5
+
+
+class StreamingUpload:
+    """
+    Upload a growing file with upload.SaveBigFilePart
+    
+    The writer calls attach() with the output path once it starts writing
+    sequentially, then complete() or abort(). Parts are sent with
+    file_total_parts=-1 while the final size is unknown; the last part is
+    held back and sent with the real part count after complete().
+    """
+    
+    def __init__(self, client: Client):
+        self.client = client
+        self.path: Optional[str] = None
+        self.file_id = client.rnd_id()
+        self.total_parts = 0
+        self.uploaded_bytes = 0
+        self.size = 0
+        
+        # Filled in by the writer when it knows them (e.g. from the playlist)
+        self.duration = 0
+        self.width = 0
+        self.height = 0
+        
+        self._finished = asyncio.Event()
+        self._aborted = False
+        self._task: Optional[asyncio.Task] = None
+        self._progress: Optional[Callable] = None
+    
+    @property
+    def active(self) -> bool:
+        """Whether the file is being (or has been) streamed"""
+        return self._task is not None and not self._aborted
+    
+    def attach(self, path: str):
+        """Start tailing a file that is written sequentially"""
+        if self._task is None and not self._aborted:
+            self.path = path
+            self._task = asyncio.ensure_future(self._run())
+    
+    def complete(self):
+        """The writer is done, the file on disk is final"""
+        self._finished.set()
+    
+    def abort(self):
+        """The file won't be used (download failed or was rewritten)"""
+        self._aborted = True
+        self._finished.set()
+        if self._task is not None:
+            self._task.cancel()
+    
+    async def _read_part(self, f) -> bytes:
+        return await asyncio.get_running_loop().run_in_executor(None, f.read, PART_SIZE)
+    
+    async def _run(self) -> bool:
+        """
+        Tail the file and upload its parts
+        
+        Returns:
+            False if the file stayed below BIG_FILE_SIZE (caller uploads it normally)
+        """
+        # Wait for enough data to qualify as a big file
+        while os.path.getsize(self.path) < BIG_FILE_SIZE:
+            if self._finished.is_set():
+                return False
+            await asyncio.sleep(POLL_INTERVAL)
+        
+        session = Session(
+            self.client,
+            await self.client.storage.dc_id(),
+            await self.client.storage.auth_key(),
+            await self.client.storage.test_mode(),
+            is_media=True
+        )
+        queue: asyncio.Queue = asyncio.Queue(maxsize=Config.STREAM_UPLOAD_WORKERS * 2)
+        
+        error = []
+        
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                # After a failure keep draining so the reader never blocks
+                if not error:
+                    try:
+                        await self._save_part(session, *item)
+                    except Exception as e:
+                        error.append(e)
+        
+        await session.start()
+        workers = [asyncio.ensure_future(worker()) for _ in range(max(1, Config.STREAM_UPLOAD_WORKERS))]
+        
+        try:
+            part_index = 0
+            held = None
+            offset = 0
+            
+            with open(self.path, 'rb') as f:
+                while True:
+                    finished = self._finished.is_set()
+                    available = os.path.getsize(self.path)
+                    
+                    # Only whole parts while the writer is running, the tail at the end
+                    while available - offset >= PART_SIZE or (finished and offset < available):
+                        chunk = await self._read_part(f)
+                        if not chunk:
+                            break
+                        offset += len(chunk)
+                        
+                        # Can't be posted whole, it gets split after the download
+                        if offset > Config.MAX_FILE_SIZE:
+                            logger.info(f"{os.path.basename(self.path)} is over the size limit, stopped streaming")
+                            return False
+                        
+                        if held is not None:
+                            await queue.put((part_index - 1, -1, held))
+                        held = chunk
+                        part_index += 1
+                    
+                    if finished:
+                        break
+                    
+                    await self._wait_for_data()
+            
+            # Every other part is in flight before the final one names the count
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            if error:
+                raise error[0]
+            
+            self.size = offset
+            self.total_parts = part_index
+            await self._save_part(session, part_index - 1, part_index, held)
+            return True
+        finally:
+            for task in workers:
+                task.cancel()
+            await session.stop()
+    
+    async def _wait_for_data(self):
+        try:
+            await asyncio.wait_for(self._finished.wait(), POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+    
+    async def _save_part(self, session: Session, index: int, total: int, data: bytes):
+        for _ in range(3):
+            try:
+                await session.invoke(raw.functions.upload.SaveBigFilePart(
+                    file_id=self.file_id,
+                    file_part=index,
+                    file_total_parts=total,
+                    bytes=data
+                ))
+                break
+            except FloodWait as e:
+                metrics.record_flood_wait('stream_upload', e.value)
+                with tracing.span('floodwait', source='stream_upload'):
+                    await asyncio.sleep(e.value)
+        else:
+            raise Exception(f"Streaming upload part {index} failed")
+        
+        self.uploaded_bytes += len(data)
+        if self._progress and self._finished.is_set():
+            await self._progress(self.uploaded_bytes, os.path.getsize(self.path))
+    
+    async def send_video(self, chat_id, caption: str = "", thumb: str = None,
+                         duration: int = 0, width: int = 0, height: int = 0,
+                         progress: Callable = None) -> Optional[types.Message]:
+        """
+        Wait for the remaining parts and post the file as a streamable video
+        
+        Probed duration/width/height win over the values the writer guessed.
+        
+        Returns:
+            The sent message, or None if nothing was streamed (upload the file normally)
+        """
+        if not self.active:
+            return None
+        
+        self._progress = progress
+        self.complete()
+        
+        try:
+            if not await self._task:
+                return None
+        except Exception as e:
+            logger.warning(f"Streaming upload failed, uploading normally: {str(e)}")
+            return None
+        
+        attributes = [
+            raw.types.DocumentAttributeVideo(
+                duration=int(duration or self.duration),
+                w=width or self.width,
+                h=height or self.height,
+                supports_streaming=True
+            ),
+            raw.types.DocumentAttributeFilename(file_name=os.path.basename(self.path)),
+        ]
+        media = raw.types.InputMediaUploadedDocument(
+            mime_type="video/mp4",
+            file=raw.types.InputFileBig(id=self.file_id, parts=self.total_parts, name=os.path.basename(self.path)),
+            thumb=await self.client.save_file(thumb) if thumb else None,
+            attributes=attributes
+        )
+        
+        for attempt in range(2):
+            try:
+                updates = await self.client.invoke(raw.functions.messages.SendMedia(
+                    peer=await self.client.resolve_peer(chat_id),
+                    media=media,
+                    random_id=self.client.rnd_id(),
+                    **await utils.parse_text_entities(self.client, caption, self.client.parse_mode, None)
+                ))
+                break
+            except FloodWait as e:
+                metrics.record_flood_wait('stream_upload', e.value)
+                if attempt:
+                    raise
+                with tracing.span('floodwait', source='stream_upload'):
+                    await asyncio.sleep(e.value)
+        
+        users = {user.id: user for user in updates.users}
+        chats = {chat.id: chat for chat in updates.chats}
+        
+        for update in updates.updates:
+            if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+                return await types.Message._parse(self.client, update.message, users, chats)
+        
+        return None